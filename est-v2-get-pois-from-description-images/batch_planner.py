@@ -0,0 +1,80 @@
+import base64
+import io
+import os
+from math import ceil
+
+from PIL import Image
+
+from image_encoding import estimate_vision_tokens
+
+# Per-request limits for a batch of LLM images: image count, base64 request
+# bytes and estimated vision input tokens
+LLM_BATCH_MAX_IMAGES = int(os.getenv("LLM_BATCH_MAX_IMAGES") or 10)
+LLM_BATCH_MAX_BYTES = int(os.getenv("LLM_BATCH_MAX_BYTES") or 4_000_000)
+LLM_BATCH_MAX_TOKENS = int(os.getenv("LLM_BATCH_MAX_TOKENS") or 12_000)
+
+
+def image_input_cost(image_input):
+    """(request bytes, estimated vision tokens) of one Responses or Chat Completions image part"""
+    url = image_input.get("image_url") or ""
+    detail = image_input.get("detail")
+    if isinstance(url, dict):
+        detail = url.get("detail", detail)
+        url = url.get("url") or ""
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))) as image:
+            width, height = image.size
+    except Exception:
+        # Unknown dimensions: assume a full high-detail image
+        width, height = 1536, 768
+    return len(url), estimate_vision_tokens(width, height, 'low' if detail == 'low' else 'high')
+
+
+def plan_batches(costs, max_images=None, max_bytes=None, max_tokens=None, min_batches=1, workers=None):
+    """
+    Split images into request batches by payload instead of by count.
+
+    `costs` is a list of (bytes, tokens) per image. The batch count is the
+    smallest that respects every limit (and at least `min_batches`); images
+    are then placed largest first into the least loaded batch they fit in,
+    so batches come out with similar payloads and finish at about the same
+    time. When the batches need more than one round on `workers` parallel
+    workers, the count is rounded up to whole rounds so no round runs half
+    empty. An image too large for any batch gets a batch of its own.
+    Returns lists of image indices, each in the original order.
+    """
+    max_images = max_images or LLM_BATCH_MAX_IMAGES
+    max_bytes = max_bytes or LLM_BATCH_MAX_BYTES
+    max_tokens = max_tokens or LLM_BATCH_MAX_TOKENS
+    if not costs:
+        return []
+
+    def weight(size, tokens):
+        return max(size / max_bytes, tokens / max_tokens)
+
+    count = max(
+        min_batches,
+        ceil(len(costs) / max_images),
+        ceil(sum(size for size, _ in costs) / max_bytes),
+        ceil(sum(tokens for _, tokens in costs) / max_tokens),
+    )
+    if workers and count > workers:
+        count = ceil(count / workers) * workers
+    batches = [{'indices': [], 'bytes': 0, 'tokens': 0} for _ in range(min(count, len(costs)))]
+    for index in sorted(range(len(costs)), key=lambda i: weight(*costs[i]), reverse=True):
+        size, tokens = costs[index]
+        fitting = [
+            batch for batch in batches
+            if len(batch['indices']) < max_images
+            and batch['bytes'] + size <= max_bytes
+            and batch['tokens'] + tokens <= max_tokens
+        ]
+        if fitting:
+            batch = min(fitting, key=lambda b: (weight(b['bytes'], b['tokens']), len(b['indices'])))
+        else:
+            batch = {'indices': [], 'bytes': 0, 'tokens': 0}
+            batches.append(batch)
+        batch['indices'].append(index)
+        batch['bytes'] += size
+        batch['tokens'] += tokens
+    return [sorted(batch['indices']) for batch in batches if batch['indices']]
@@ -1,12 +1,15 @@
 import json
-from utils import get_and_download_input_images, process_images_with_user_description
+from utils import filter_usable_images, get_and_download_input_images, process_images_with_user_description
 
 def lambda_handler(event, context):
     try:
         claim_id = event.get('claim_id')
         prompt = event.get('prompt')
         images = get_and_download_input_images(claim_id)
-        pois =process_images_with_user_description(prompt,images)
+        # quality_action: 'tag' (default), 'skip' or 'off'; quality_thresholds overrides per caller
+        images, quality = filter_usable_images(images, event.get('quality_action'), event.get('quality_thresholds'))
+        # Photos that can't be decoded are left out and listed in unreadable_images
+        pois, unreadable = process_images_with_user_description(prompt,images)
         poi_results = []
         for poi, images in pois.items():
             if len(images) > 0: 
@@ -19,7 +22,9 @@ def lambda_handler(event, context):
             'success':True,
             'claim_id':claim_id,
             'images':images,
-            'pois':poi_results
+            'pois':poi_results,
+            'quality':quality,
+            'unreadable_images':unreadable
         }
     except Exception as e:
         print(e)
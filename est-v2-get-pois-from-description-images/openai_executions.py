@@ -1,6 +1,7 @@
 import openai
 import json
 import os
+import time
 POIS = [
     'Front', 'R-Front-Corner', 'R-Front-Side','R-Side','R-Rear-Side',
     'Rear','L-Rear-Side','L-Side','L-Front-Side','Roof'
@@ -18,6 +19,7 @@ def get_pois_for_batch(
     print(f"prompt: {prompt}", len(image_inputs))
     messages = [{"role":"system", "content": "You are a car mechanic and you help find out point of impact (POIs) using user description and images."},{"role": "user", "content": [{"type": "text", "text": prompt}] + image_inputs}]
     try:
+        start_time = time.time()
         response = openai.chat.completions.create(
             model="gpt-4o-2024-11-20",
             messages=messages,
@@ -26,6 +28,7 @@ def get_pois_for_batch(
             temperature=0.3
         )
 
+        print(f"Batch completed in {time.time() - start_time:.2f}s")
         content = response.choices[0].message.content.strip()
         print(f"content pois: {content}")
         pois_dict = eval(content)  # Consider json.loads() for safer parsing
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from PIL import Image
+
+import utils
+
+
+class CorruptImageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.good = os.path.join(self.tmp.name, "good.jpg")
+        Image.new("RGB", (640, 480), (120, 60, 30)).save(self.good)
+        self.corrupt = os.path.join(self.tmp.name, "corrupt.jpg")
+        with open(self.corrupt, "wb") as f:
+            f.write(b"\xff\xd8 not really a jpeg")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_encode_image_with_name_returns_none_for_corrupt_file(self):
+        filename, image_input = utils.encode_image_with_name(self.corrupt)
+        self.assertEqual(filename, "corrupt.jpg")
+        self.assertIsNone(image_input)
+
+    def test_corrupt_image_is_skipped_and_reported(self):
+        with mock.patch.object(utils, "get_pois_for_batch", return_value={"Front": ["good.jpg"]}) as get_pois:
+            pois, unreadable = utils.process_images_with_user_description("prompt", [self.corrupt, self.good])
+        self.assertEqual(pois, {"Front": ["good.jpg"]})
+        self.assertEqual(unreadable, ["corrupt.jpg"])
+        get_pois.assert_called_once()
+        self.assertEqual(get_pois.call_args.args[1], ["good.jpg"])
+
+
+if __name__ == "__main__":
+    unittest.main()
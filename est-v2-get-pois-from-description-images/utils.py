@@ -2,7 +2,9 @@ import boto3
 import json
 import os
 from openai_executions import get_pois_for_batch
-import base64
+from image_encoding import encode_image
+from batch_planner import image_input_cost, plan_batches
+from image_quality import QUALITY_ACTION, assess_file, resolve_thresholds, summarize_quality
 
 s3 = boto3.client('s3')
 BUCKET_NAME = os.getenv("BUCKET_NAME")
@@ -30,19 +32,44 @@ def get_and_download_input_images(claim_id):
         local_orig_images.append(local_file)
     return local_orig_images
 
-# --- Encode one image with base64 and filename ---
-def encode_image_with_name(image_path):
-    with open(image_path, "rb") as f:
-        base64_img = base64.b64encode(f.read()).decode("utf-8")
-        return (
-            os.path.basename(image_path),
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_img}",
-                }
+# --- Check blur / exposure / size before paying for an LLM call ---
+def filter_usable_images(image_paths, quality_action=None, quality_thresholds=None):
+    quality_action = (quality_action or QUALITY_ACTION).lower()
+    if quality_action == 'off':
+        return image_paths, None
+    thresholds = resolve_thresholds(quality_thresholds)
+    reports = {}
+    usable = []
+    for path in image_paths:
+        try:
+            reports[os.path.basename(path)] = report = assess_file(path, thresholds)
+        except Exception as e:
+            print(f"Quality check failed for {path}: {e}")
+            usable.append(path)
+            continue
+        if report['issues']:
+            print(f"Unusable image {path}: {', '.join(report['issues'])}")
+        if quality_action != 'skip' or not report['issues']:
+            usable.append(path)
+    return usable, summarize_quality(reports, quality_action)
+
+# --- Encode one image (downscaled, size-budgeted JPEG) with filename; None if it can't be decoded ---
+def encode_image_with_name(image_path, profile='poi_description'):
+    try:
+        encoded = encode_image(image_path, profile)
+    except Exception as e:
+        print(f"Error encoding image {image_path}: {e}")
+        return os.path.basename(image_path), None
+    return (
+        os.path.basename(image_path),
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{encoded['base64']}",
+                "detail": encoded['detail'],
             }
-        )
+        }
+    )
 
 # --- Merge multiple batch results into one ---
 def merge_poi_mappings(mappings):
@@ -61,15 +88,23 @@ def process_images_with_user_description(
     image_paths,
     batch_size = 5
 ):
+    # Encode everything up front so batches can be packed by payload, up to batch_size images each
+    image_metadata = []
+    unreadable = []
+    for path in image_paths:
+        filename, image_input = encode_image_with_name(path)
+        if image_input:
+            image_metadata.append((filename, image_input))
+        else:
+            unreadable.append(filename)
+    batches = plan_batches([image_input_cost(img) for _, img in image_metadata], max_images=batch_size)
     all_results = []
-    for i in range(0, len(image_paths), batch_size):
-        batch_paths = image_paths[i:i + batch_size]
-        # Encode images and extract filenames + OpenAI dicts
-        image_metadata = [encode_image_with_name(p) for p in batch_paths]
-        filenames = [name for name, _ in image_metadata]
-        image_inputs = [img for _, img in image_metadata]
-        print(f"Processing batch {i//batch_size + 1}/{(len(image_paths) + batch_size - 1) // batch_size}", image_inputs)
+    for batch_number, indices in enumerate(batches, 1):
+        filenames = [image_metadata[i][0] for i in indices]
+        image_inputs = [image_metadata[i][1] for i in indices]
+        image_bytes = sum(len(img["image_url"]["url"]) for img in image_inputs)
+        print(f"Processing batch {batch_number}/{len(batches)}: {len(image_inputs)} images, {image_bytes / 1e6:.2f}MB encoded")
         # Call GPT for this batch
         batch_result = get_pois_for_batch(prompt, filenames, image_inputs)
         all_results.append(batch_result)
-    return merge_poi_mappings(all_results)
\ No newline at end of file
+    return merge_poi_mappings(all_results), unreadable
\ No newline at end of file
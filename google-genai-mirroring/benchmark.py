@@ -0,0 +1,145 @@
+"""
+Throughput benchmark for the handler against the offline Gemini stand-in.
+
+    python benchmark.py [--documents 64] [--latency-ms 200]
+    python benchmark.py --live-cache [--iterations 20]
+
+Measures:
+  * handler overhead  - wall time per call with a zero-latency model
+  * concurrency       - batch throughput at increasing max_concurrency
+  * cache             - implicit prompt cache hit ratio and latency for a
+                        shared vs. per-request system prompt
+  * streaming         - time to first line vs. full generation time
+
+Against the stand-in, cache hits and their speedup are simulated: the hit
+ratio only shows that a shared system prompt is a reusable prefix, and the
+latency gap is GENAI_FAKE_CACHED_SPEEDUP by construction. --live-cache runs
+only the cache section against Vertex AI (GOOGLE_CLOUD_PROJECT and
+credentials required) and reports the cached_content_token_count and
+latency the service actually returns.
+"""
+import argparse
+import base64
+import os
+import statistics
+import time
+
+os.environ.setdefault("GENAI_FAKE", "1")
+
+import lambda_function  # noqa: E402
+from google import genai  # noqa: E402
+
+SYSTEM_PROMPT = "Extract the estimate lines from the attached PDF. " * 200
+PDF_BASE64 = base64.b64encode(b"%PDF-1.7\n" + b"0" * 200_000).decode("utf-8")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def bench_overhead(fake, iterations):
+    fake.latency_ms = 0
+    fake.jitter_ms = 0
+    event = {"system_prompt": SYSTEM_PROMPT, "pdf_base64": PDF_BASE64}
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        lambda_function.lambda_handler(event, None)
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"handler overhead: p50 {percentile(timings, 50):.2f}ms  p99 {percentile(timings, 99):.2f}ms  ({iterations} calls)")
+
+
+def bench_concurrency(fake, documents, latency_ms):
+    fake.latency_ms = latency_ms
+    fake.jitter_ms = latency_ms / 4
+    baseline = None
+    print(f"concurrency scaling ({documents} documents, {latency_ms:.0f}ms model latency):")
+    for concurrency in (1, 2, 4, 8, 16, 32):
+        event = {
+            "system_prompt": SYSTEM_PROMPT,
+            "max_concurrency": concurrency,
+            "documents": [{"id": i, "pdf_base64": PDF_BASE64} for i in range(documents)],
+        }
+        start = time.perf_counter()
+        result = lambda_function.lambda_handler(event, None)
+        seconds = time.perf_counter() - start
+        throughput = documents / seconds
+        baseline = baseline or throughput
+        print(f"  max_concurrency={concurrency:<3} {throughput:8.1f} docs/s  speedup x{throughput / baseline:.1f}  failed={result['failed']}")
+
+
+def bench_cache(client, iterations, latency_ms=None):
+    """Implicit cache hits for a shared vs. per-request system prompt; simulated unless `client` is a real one"""
+    simulated = hasattr(client, "reset_cache")
+    if simulated:
+        client.latency_ms = latency_ms
+        client.jitter_ms = 0
+        print(f"implicit prompt cache (SIMULATED: hits are {client.cached_speedup}x latency by GENAI_FAKE_CACHED_SPEEDUP):")
+    else:
+        print(f"implicit prompt cache (live, {lambda_function.MODEL_ID}):")
+    for label, shared in (("shared system prompt", True), ("unique system prompt", False)):
+        if simulated:
+            client.reset_cache()
+        prompt_tokens = cached_tokens = 0
+        latencies = []
+        config_prompt = SYSTEM_PROMPT
+        for i in range(iterations):
+            if not shared:
+                config_prompt = f"{i}: {SYSTEM_PROMPT}"
+            config = lambda_function.build_generate_config(config_prompt, lambda_function.default_response_schema)
+            start = time.perf_counter()
+            response = client.models.generate_content(
+                model=lambda_function.MODEL_ID, contents=["Return an empty result."], config=config
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            prompt_tokens += response.usage_metadata.prompt_token_count or 0
+            cached_tokens += response.usage_metadata.cached_content_token_count or 0
+        print(f"  {label:<22} cached {cached_tokens / prompt_tokens:6.1%} of prompt tokens  mean latency {statistics.mean(latencies):.1f}ms")
+
+
+def bench_streaming(fake, latency_ms):
+    fake.latency_ms = latency_ms
+    fake.jitter_ms = 0
+    fake.reset_cache()
+    start = time.perf_counter()
+    first = []
+
+    def on_line(line):
+        if not first:
+            first.append(time.perf_counter() - start)
+
+    result = lambda_function.stream_document(
+        b"%PDF-1.7", SYSTEM_PROMPT, lambda_function.default_response_schema, on_line=on_line
+    )
+    total = time.perf_counter() - start
+    print(f"streaming: first line after {first[0] * 1000:.0f}ms, {len(result['lines'])} lines after {total * 1000:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--live-cache", action="store_true", help="measure the cache section against Vertex AI")
+    args = parser.parse_args()
+
+    if args.live_cache:
+        client = genai.Client(vertexai=True, project=lambda_function.PROJECT_ID, location=lambda_function.LOCATION)
+        bench_cache(client, min(args.iterations, 20))
+        return
+
+    fake = lambda_function.client
+    if not hasattr(fake, "reset_cache"):
+        raise SystemExit("benchmark requires GENAI_FAKE=1")
+    fake.error_rate = 0
+
+    bench_overhead(fake, args.iterations)
+    bench_concurrency(fake, args.documents, args.latency_ms)
+    bench_cache(fake, min(args.iterations, 20), args.latency_ms)
+    bench_streaming(fake, args.latency_ms * 10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Offline stand-in for the parts of `genai.Client` used by this lambda.
+
+Enabled by setting GENAI_FAKE=1. Responses are generated from the request's
+response schema, so the handler's parsing path runs exactly as in production.
+Behaviour is tuned with environment variables (or attributes on the client):
+
+    GENAI_FAKE_LATENCY_MS         mean generation latency per request (200)
+    GENAI_FAKE_JITTER_MS          uniform latency jitter (50)
+    GENAI_FAKE_ERROR_RATE         probability a request raises (0.0)
+    GENAI_FAKE_ARRAY_ITEMS        items generated for every array (20)
+    GENAI_FAKE_PROMPT_TOKENS      document tokens per request (1500)
+    GENAI_FAKE_CACHED_SPEEDUP     latency factor on implicit cache hits (0.7)
+    GENAI_FAKE_STREAM_CHUNK_CHARS characters per streamed chunk (200)
+    GENAI_FAKE_SEED               random seed (unset = nondeterministic)
+
+Implicit context caching is simulated: once a system instruction has been
+seen, later requests report its tokens as `cached_content_token_count` and
+run faster by GENAI_FAKE_CACHED_SPEEDUP.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+
+class FakeGenaiError(Exception):
+    pass
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count, cached_content_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.cached_content_token_count = cached_content_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4) if text else 0
+
+
+def _config_value(config, name):
+    if config is None:
+        return None
+    if isinstance(config, dict):
+        return config.get(name)
+    return getattr(config, name, None)
+
+
+def generate_from_schema(schema, rng, array_items, field_name="value"):
+    """Build a value that conforms to a (JSON / OpenAPI style) response schema."""
+    schema_type = schema.get("type", "string")
+    schema_type = str(getattr(schema_type, "value", schema_type)).lower()
+    if schema_type == "object":
+        return {
+            name: generate_from_schema(prop, rng, array_items, name)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        item_schema = schema.get("items", {"type": "string"})
+        return [generate_from_schema(item_schema, rng, array_items, field_name) for _ in range(array_items)]
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if schema_type == "integer":
+        return rng.randint(0, 1000)
+    if schema_type == "number":
+        return round(rng.uniform(0, 1000), 2)
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    return f"{field_name}-{rng.randint(0, 99999)}"
+
+
+class FakeClient:
+    def __init__(self, **overrides):
+        self.latency_ms = float(os.environ.get("GENAI_FAKE_LATENCY_MS", "200"))
+        self.jitter_ms = float(os.environ.get("GENAI_FAKE_JITTER_MS", "50"))
+        self.error_rate = float(os.environ.get("GENAI_FAKE_ERROR_RATE", "0"))
+        self.array_items = int(os.environ.get("GENAI_FAKE_ARRAY_ITEMS", "20"))
+        self.prompt_tokens = int(os.environ.get("GENAI_FAKE_PROMPT_TOKENS", "1500"))
+        self.cached_speedup = float(os.environ.get("GENAI_FAKE_CACHED_SPEEDUP", "0.7"))
+        self.stream_chunk_chars = int(os.environ.get("GENAI_FAKE_STREAM_CHUNK_CHARS", "200"))
+        seed = os.environ.get("GENAI_FAKE_SEED")
+        for name, value in overrides.items():
+            if name == "seed":
+                seed = value
+            else:
+                setattr(self, name, value)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.seen_prefixes = set()
+        self.models = FakeModels(self)
+        self.aio = FakeAio(self)
+
+    def reset_cache(self):
+        with self.lock:
+            self.seen_prefixes.clear()
+
+    def plan(self, config):
+        """Decide the outcome of one request: (latency seconds, response or exception)."""
+        system_instruction = _config_value(config, "system_instruction") or ""
+        schema = _config_value(config, "response_schema") or {"type": "object"}
+        if hasattr(schema, "model_dump"):
+            schema = schema.model_dump(exclude_none=True)
+
+        with self.lock:
+            prefix = hashlib.sha256(str(system_instruction).encode("utf-8")).hexdigest()
+            cache_hit = prefix in self.seen_prefixes
+            self.seen_prefixes.add(prefix)
+            latency = max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            failed = self.rng.random() < self.error_rate
+            value = None if failed else generate_from_schema(schema, self.rng, self.array_items)
+
+        system_tokens = estimate_tokens(str(system_instruction))
+        if cache_hit:
+            latency *= self.cached_speedup
+        if failed:
+            return latency, FakeGenaiError("503 UNAVAILABLE: fake injected error")
+
+        text = json.dumps(value)
+        usage = FakeUsageMetadata(
+            prompt_token_count=system_tokens + self.prompt_tokens,
+            cached_content_token_count=system_tokens if cache_hit else 0,
+            candidates_token_count=estimate_tokens(text),
+        )
+        return latency, FakeResponse(text, usage)
+
+    def chunks(self, response):
+        size = max(1, self.stream_chunk_chars)
+        count = max(1, -(-len(response.text) // size))
+        for i in range(count):
+            usage = response.usage_metadata if i == count - 1 else None
+            yield FakeResponse(response.text[i * size:(i + 1) * size], usage), count
+
+
+class FakeModels:
+    def __init__(self, fake_client):
+        self.fake_client = fake_client
+
+    def generate_content(self, model=None, contents=None, config=None):
+        latency, outcome = self.fake_client.plan(config)
+        time.sleep(latency)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def generate_content_stream(self, model=None, contents=None, config=None):
+        latency, outcome = self.fake_client.plan(config)
+        if isinstance(outcome, Exception):
+            time.sleep(latency)
+            raise outcome
+        for chunk, count in self.fake_client.chunks(outcome):
+            time.sleep(latency / count)
+            yield chunk
+
+
+class FakeAsyncModels:
+    def __init__(self, fake_client):
+        self.fake_client = fake_client
+
+    async def generate_content(self, model=None, contents=None, config=None):
+        latency, outcome = self.fake_client.plan(config)
+        await asyncio.sleep(latency)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def generate_content_stream(self, model=None, contents=None, config=None):
+        latency, outcome = self.fake_client.plan(config)
+        if isinstance(outcome, Exception):
+            await asyncio.sleep(latency)
+            raise outcome
+
+        async def iterate():
+            for chunk, count in self.fake_client.chunks(outcome):
+                await asyncio.sleep(latency / count)
+                yield chunk
+
+        return iterate()
+
+
+class FakeAio:
+    def __init__(self, fake_client):
+        self.models = FakeAsyncModels(fake_client)
@@ -1,6 +1,8 @@
+import asyncio
 import base64
 import json
 import os
+import time
 import boto3
 import requests
 from google import genai
@@ -9,16 +11,28 @@ from google.genai.types import (
     ThinkingConfig,
     Part,
 )
+from streaming import IncrementalArrayParser, S3NdjsonWriter
 
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT")
 LOCATION = "global"
 MODEL_ID = "gemini-2.5-flash"
+STREAM_FLUSH_EVERY = int(os.environ.get("GEMINI_STREAM_FLUSH_EVERY", "10"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("GEMINI_BATCH_CONCURRENCY", "8"))
 
-client = genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
+if os.environ.get("GENAI_FAKE"):
+    # Offline stand-in for local testing and benchmarks, see fake_genai.py
+    from fake_genai import FakeClient
+    client = FakeClient()
+else:
+    client = genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
 thinking_config = ThinkingConfig(thinking_budget=0)
 
 s3 = boto3.client("s3")
 
+# client.aio binds its connections to the event loop it first runs on, so batch
+# invocations share one loop per container instead of asyncio.run's fresh loop each time
+batch_loop = None
+
 
 def load_pdf_from_s3(s3_url):
     s3_url = s3_url.replace("s3://", "")
@@ -32,6 +46,27 @@ def load_pdf_from_url(url):
     r.raise_for_status()
     return r.content
 
+
+def load_pdf_bytes(source):
+    """Resolve the PDF bytes of an event or batch document entry."""
+    if "pdf_base64" in source:
+        return base64.b64decode(source["pdf_base64"])
+    elif "pdf_s3_url" in source:
+        return load_pdf_from_s3(source["pdf_s3_url"])
+    elif "pdf_url" in source:
+        return load_pdf_from_url(source["pdf_url"])
+    raise Exception("required_field is missing")
+
+
+def build_generate_config(system_prompt, response_schema):
+    return GenerateContentConfig(
+        system_instruction=system_prompt,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        # thinking_config=thinking_config,
+        temperature=0.01,
+    )
+
 default_response_schema = {
   "type": "object",
   "properties": {
@@ -119,6 +154,70 @@ default_response_schema = {
   ]
 }
 
+def stream_document(pdf_bytes, system_prompt, response_schema, on_line=None, array_key="lines"):
+    """
+    Stream the extraction and hand every completed element of `array_key`
+    to `on_line` as soon as it has been generated. Returns the final object.
+    """
+    parser = IncrementalArrayParser(array_key)
+    start_time = time.time()
+    first_line_seconds = None
+    stream = client.models.generate_content_stream(
+        model=MODEL_ID,
+        contents=[Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")],
+        config=build_generate_config(system_prompt, response_schema),
+    )
+    for chunk in stream:
+        if not chunk.text:
+            continue
+        for line in parser.feed(chunk.text):
+            if first_line_seconds is None:
+                first_line_seconds = time.time() - start_time
+            if on_line:
+                on_line(line)
+    total_seconds = time.time() - start_time
+    if first_line_seconds is not None:
+        print(f"Streamed {parser.emitted} {array_key}: first after {first_line_seconds:.2f}s, total {total_seconds:.2f}s")
+    return parser.result()
+
+
+async def extract_document_async(document, index, system_prompt, response_schema, semaphore):
+    """Load and extract a single batch document, isolating any failure to this entry."""
+    doc_id = document.get("id", index)
+    try:
+        async with semaphore:
+            pdf_bytes = await asyncio.to_thread(load_pdf_bytes, document)
+            response = await client.aio.models.generate_content(
+                model=MODEL_ID,
+                contents=[Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")],
+                config=build_generate_config(
+                    document.get("system_prompt", system_prompt),
+                    document.get("response_schema", response_schema),
+                ),
+            )
+        return {"id": doc_id, "success": True, "result": json.loads(response.text)}
+    except Exception as e:
+        print(f"Document {doc_id} failed: {e}")
+        return {"id": doc_id, "success": False, "error": str(e)}
+
+
+def run_batch_coroutine(coroutine):
+    """Run a coroutine on the container's persistent event loop"""
+    global batch_loop
+    if batch_loop is None or batch_loop.is_closed():
+        batch_loop = asyncio.new_event_loop()
+    return batch_loop.run_until_complete(coroutine)
+
+
+async def process_documents_batch(documents, system_prompt, response_schema, max_concurrency):
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    tasks = [
+        extract_document_async(document, index, system_prompt, response_schema, semaphore)
+        for index, document in enumerate(documents)
+    ]
+    return await asyncio.gather(*tasks)
+
+
 def lambda_handler(event, context):
     """
     Expected event format:
@@ -126,40 +225,75 @@ def lambda_handler(event, context):
       "system_prompt": "...",
       "pdf_base64": "JVBERi0xLjc...."   OR
       "pdf_s3_url": "s3://bucket/file.pdf" OR
-      "pdf_url": "https://domain.com/file.pdf"
+      "pdf_url": "https://domain.com/file.pdf",
+      "stream": false,
+      "stream_output_s3_url": "s3://bucket/lines.ndjson"
+    }
+
+    With "stream" enabled the response is generated with
+    generate_content_stream and each element of "lines" is written to
+    "stream_output_s3_url" (NDJSON) as soon as it is complete; the final
+    assembled object is still returned.
+
+    Batch event format (documents are extracted concurrently, each entry may
+    override "system_prompt" and "response_schema"):
+    {
+      "system_prompt": "...",
+      "max_concurrency": 8,
+      "documents": [
+        {"id": "claim-1", "pdf_s3_url": "s3://bucket/file.pdf"},
+        {"id": "claim-2", "pdf_url": "https://domain.com/file.pdf"}
+      ]
     }
     """
     try:
         system_prompt = event.get("system_prompt", "")
-        if not system_prompt:
-            raise Exception("required_field is missing")
 
         # Use Response Schema from payload if available
         active_schema = event.get("response_schema", default_response_schema)
 
-        # Load PDF bytes
-        if "pdf_base64" in event:
-            pdf_bytes = base64.b64decode(event["pdf_base64"])
-        elif "pdf_s3_url" in event:
-            pdf_bytes = load_pdf_from_s3(event["pdf_s3_url"])
-        elif "pdf_url" in event:
-            pdf_bytes = load_pdf_from_url(event["pdf_url"])
-        else:
+        if "documents" in event:
+            documents = event["documents"]
+            if not isinstance(documents, list) or any(
+                not doc.get("system_prompt", system_prompt) for doc in documents
+            ):
+                raise Exception("required_field is missing")
+            max_concurrency = int(event.get("max_concurrency", BATCH_MAX_CONCURRENCY))
+            results = run_batch_coroutine(
+                process_documents_batch(documents, system_prompt, active_schema, max_concurrency)
+            )
+            succeeded = sum(1 for r in results if r["success"])
+            return {
+                "results": results,
+                "succeeded": succeeded,
+                "failed": len(results) - succeeded,
+            }
+
+        if not system_prompt:
             raise Exception("required_field is missing")
+
+        # Load PDF bytes
+        pdf_bytes = load_pdf_bytes(event)
+
+        if event.get("stream"):
+            writer = None
+            if event.get("stream_output_s3_url"):
+                writer = S3NdjsonWriter(
+                    s3,
+                    event["stream_output_s3_url"],
+                    flush_every=event.get("stream_flush_every", STREAM_FLUSH_EVERY),
+                )
+            result = stream_document(pdf_bytes, system_prompt, active_schema, on_line=writer)
+            if writer:
+                writer.close()
+            return result
+
         response = client.models.generate_content(
             model=MODEL_ID,
             contents=[Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")],
-            config=GenerateContentConfig(
-                system_instruction=system_prompt,
-                response_mime_type="application/json",
-                response_schema=active_schema,
-                # thinking_config=thinking_config,
-                temperature=0.01,
-            ),
+            config=build_generate_config(system_prompt, active_schema),
         )
 
         return json.loads(response.text)
     except Exception as e:
         raise Exception(str(e))
-    
-
@@ -0,0 +1,108 @@
+import json
+
+
+class IncrementalArrayParser:
+    """
+    Incremental JSON scanner for streamed model output.
+
+    Text chunks are fed as they arrive and every element of the top-level
+    array stored under `array_key` is returned as soon as its closing bracket
+    has been seen, without waiting for the rest of the document.
+    """
+
+    def __init__(self, array_key="lines"):
+        self.array_key = array_key
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None
+        self.last_key = None
+        self.array_depth = None
+        self.element_start = None
+        self.emitted = 0
+
+    def feed(self, text):
+        """Consume a chunk of text and return the newly completed array elements."""
+        completed = []
+        self.buffer += text
+        buffer = self.buffer
+        for i in range(self.pos, len(buffer)):
+            c = buffer[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    self.last_string = buffer[self.string_start + 1:i]
+                continue
+
+            if c == '"':
+                self.in_string = True
+                self.string_start = i
+            elif c == ":":
+                if self.depth == 1:
+                    self.last_key = self.last_string
+            elif c in "{[":
+                if self.array_depth is None and c == "[" and self.depth == 1 and self.last_key == self.array_key:
+                    self.array_depth = self.depth + 1
+                elif self.depth == self.array_depth and self.element_start is None:
+                    self.element_start = i
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+                if self.element_start is not None and self.depth == self.array_depth:
+                    completed.append(json.loads(buffer[self.element_start:i + 1]))
+                    self.element_start = None
+                elif self.array_depth is not None and self.depth == self.array_depth - 1:
+                    # Closing bracket of the target array itself
+                    self.array_depth = -1
+        self.pos = len(buffer)
+        self.emitted += len(completed)
+        return completed
+
+    def result(self):
+        """Parse the fully assembled document."""
+        return json.loads(self.buffer)
+
+
+class S3NdjsonWriter:
+    """
+    Writes streamed elements to an NDJSON object in S3.
+
+    S3 objects cannot be appended to, so the object is rewritten every
+    `flush_every` elements and once more on close; readers polling the key
+    see a growing prefix of the final output.
+    """
+
+    def __init__(self, s3_client, s3_url, flush_every=10):
+        bucket, key = s3_url.replace("s3://", "").split("/", 1)
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.flush_every = max(1, int(flush_every))
+        self.lines = []
+        self.pending = 0
+
+    def __call__(self, element):
+        self.lines.append(json.dumps(element))
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        body = "\n".join(self.lines) + ("\n" if self.lines else "")
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=body.encode("utf-8"),
+            ContentType="application/x-ndjson",
+        )
+        self.pending = 0
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,83 @@
+import json
+import unittest
+
+from streaming import IncrementalArrayParser, S3NdjsonWriter
+
+LINES = [
+    {"description": "Bumper [front] {R&I}", "amount": 125.5},
+    {"description": "Say \"hello\" \\ goodbye: ]}", "parts": [{"id": 1}, {"id": [2, 3]}]},
+    {"description": "Phare avant — gauche", "amount": None},
+]
+DOCUMENT = json.dumps({
+    "name": "Estimate",
+    "totals": {"lines": [{"description": "nested, not the target"}]},
+    "lines": LINES,
+    "vin": "1HGCM82633A004352",
+})
+
+
+class FakeS3:
+    def __init__(self):
+        self.bodies = []
+
+    def put_object(self, **kwargs):
+        self.bodies.append(kwargs["Body"].decode("utf-8"))
+
+
+class IncrementalArrayParserTest(unittest.TestCase):
+    def test_whole_document_in_one_chunk(self):
+        parser = IncrementalArrayParser("lines")
+        self.assertEqual(parser.feed(DOCUMENT), LINES)
+        self.assertEqual(parser.emitted, len(LINES))
+        self.assertEqual(parser.result(), json.loads(DOCUMENT))
+
+    def test_every_split_point_gives_the_same_elements(self):
+        for split in range(1, len(DOCUMENT)):
+            parser = IncrementalArrayParser("lines")
+            elements = parser.feed(DOCUMENT[:split]) + parser.feed(DOCUMENT[split:])
+            self.assertEqual(elements, LINES, f"split at {split}")
+
+    def test_one_character_chunks(self):
+        parser = IncrementalArrayParser("lines")
+        elements = []
+        for c in DOCUMENT:
+            elements.extend(parser.feed(c))
+        self.assertEqual(elements, LINES)
+
+    def test_elements_are_emitted_before_the_document_ends(self):
+        parser = IncrementalArrayParser("lines")
+        first_end = DOCUMENT.index(json.dumps(LINES[0])) + len(json.dumps(LINES[0]))
+        self.assertEqual(parser.feed(DOCUMENT[:first_end]), LINES[:1])
+        self.assertEqual(parser.feed(DOCUMENT[first_end:]), LINES[1:])
+
+    def test_key_only_matches_at_the_top_level(self):
+        parser = IncrementalArrayParser("lines")
+        document = json.dumps({"totals": {"lines": [{"a": 1}]}, "other": [{"b": 2}]})
+        self.assertEqual(parser.feed(document), [])
+
+    def test_string_value_equal_to_the_key_is_not_a_key(self):
+        parser = IncrementalArrayParser("lines")
+        document = json.dumps({"name": "lines", "items": [{"a": 1}]})
+        self.assertEqual(parser.feed(document), [])
+
+    def test_empty_array(self):
+        parser = IncrementalArrayParser("lines")
+        self.assertEqual(parser.feed('{"lines": [], "vin": "x"}'), [])
+        self.assertEqual(parser.emitted, 0)
+
+
+class S3NdjsonWriterTest(unittest.TestCase):
+    def test_rewrites_the_object_every_flush_and_on_close(self):
+        s3 = FakeS3()
+        writer = S3NdjsonWriter(s3, "s3://bucket/out/lines.ndjson", flush_every=2)
+        for element in LINES:
+            writer(element)
+        self.assertEqual(len(s3.bodies), 1)
+        self.assertEqual(s3.bodies[0].splitlines(), [json.dumps(line) for line in LINES[:2]])
+        writer.close()
+        self.assertEqual([json.loads(line) for line in s3.bodies[-1].splitlines()], LINES)
+        self.assertEqual((writer.bucket, writer.key), ("bucket", "out/lines.ndjson"))
+
+
+if __name__ == "__main__":
+    unittest.main()
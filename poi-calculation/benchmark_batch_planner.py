@@ -0,0 +1,104 @@
+"""
+Fixed-count batching vs the payload-aware batch planner.
+
+    python benchmark_batch_planner.py [--images ./sample_claim] [--count 60] [--workers 10]
+
+With `--images`, photos are encoded with the damage_detection profile;
+otherwise a synthetic claim mixing phone photos, screenshots and large
+uncompressible images is used. For each strategy reports the number of
+batches, how many exceed the request limits (LLM_BATCH_MAX_BYTES /
+LLM_BATCH_MAX_TOKENS) and the simulated makespan when the batches run on
+`--workers` parallel workers, with per-batch latency modelled as
+base + tokens * per-token + bytes / bandwidth.
+"""
+import argparse
+import os
+import random
+
+from batch_planner import LLM_BATCH_MAX_BYTES, LLM_BATCH_MAX_TOKENS, plan_batches
+from image_encoding import encode_image, estimate_vision_tokens
+from openai_executions import default_batch_size
+
+
+def encoded_costs(directory):
+    costs = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith((".jpg", ".jpeg", ".png")):
+            continue
+        try:
+            encoded = encode_image(os.path.join(directory, name), 'damage_detection')
+        except Exception as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        base64_bytes = len(encoded['base64'])
+        costs.append((base64_bytes, estimate_vision_tokens(encoded['width'], encoded['height'], encoded['detail'])))
+    return costs
+
+
+def synthetic_costs(count, seed):
+    rng = random.Random(seed)
+    costs = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.6:  # phone photo, downscaled to 1536x768
+            size, dims = rng.randint(150_000, 450_000), (1536, 768)
+        elif kind < 0.85:  # small screenshot or thumbnail
+            size, dims = rng.randint(20_000, 80_000), (640, 480)
+        else:  # detailed photo that stays near the byte budget
+            size, dims = rng.randint(450_000, 600_000), (1536, 768)
+        costs.append((size * 4 // 3, estimate_vision_tokens(*dims)))
+    return costs
+
+
+def fixed_batches(count):
+    batch_size = default_batch_size(count)
+    return [list(range(start, min(start + batch_size, count))) for start in range(0, count, batch_size)]
+
+
+def makespan(batches, costs, workers, base, per_token, bandwidth):
+    finish = [0.0] * workers
+    for batch in batches:
+        tokens = sum(costs[i][1] for i in batch)
+        size = sum(costs[i][0] for i in batch)
+        worker = finish.index(min(finish))
+        finish[worker] += base + tokens * per_token + size / bandwidth
+    return max(finish)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", help="directory of claim photos")
+    parser.add_argument("--count", type=int, default=60, help="synthetic claim size")
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--base-seconds", type=float, default=4.0)
+    parser.add_argument("--per-token-ms", type=float, default=1.5)
+    parser.add_argument("--bandwidth-mbps", type=float, default=20.0)
+    args = parser.parse_args()
+
+    costs = encoded_costs(args.images) if args.images else synthetic_costs(args.count, args.seed)
+    if not costs:
+        raise SystemExit("No images to plan")
+    print(
+        f"{len(costs)} images, {sum(c[0] for c in costs) / 1e6:.1f}MB encoded, {sum(c[1] for c in costs)} vision tokens; "
+        f"limits {LLM_BATCH_MAX_BYTES / 1e6:.1f}MB / {LLM_BATCH_MAX_TOKENS} tokens per request, {args.workers} workers"
+    )
+    strategies = (
+        ("fixed count", fixed_batches(len(costs))),
+        ("payload planner", plan_batches(costs, max_images=default_batch_size(len(costs)), workers=args.workers)),
+    )
+    for label, batches in strategies:
+        sizes = [sum(costs[i][0] for i in batch) for batch in batches]
+        tokens = [sum(costs[i][1] for i in batch) for batch in batches]
+        oversized = sum(size > LLM_BATCH_MAX_BYTES or t > LLM_BATCH_MAX_TOKENS for size, t in zip(sizes, tokens))
+        seconds = makespan(
+            batches, costs, args.workers, args.base_seconds, args.per_token_ms / 1000, args.bandwidth_mbps * 1e6 / 8
+        )
+        print(
+            f"  {label:<16} {len(batches):3} batches  oversized {oversized:2}  "
+            f"largest {max(sizes) / 1e6:.2f}MB / {max(tokens)} tokens  makespan {seconds:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Request size before/after the size-budgeted LLM image encoder.
+
+    python benchmark_encoding.py --images ./sample_claim [--batch-size 5]
+    python benchmark_encoding.py --images ./sample_claim --end-to-end [--uplink-mbps 50] [--latency-ms 150]
+
+For every encoding profile, reports the base64 bytes per image and per
+OpenAI batch, encode time, and estimated vision tokens, next to the
+original full-size base64 encoding that was sent before.
+
+--end-to-end also sends every batch through process_single_batch to the
+local HTTPS stand-in of benchmark_openai_pool.py, one batch at a time, and
+reports the per-batch latency (encode + request + upload at `--uplink-mbps`
++ `--latency-ms` of modelled generation) and the input cost of the images'
+estimated vision tokens at OPENAI_PRICE_INPUT_PER_M. The stand-in does not
+model generation time growing with input tokens, so the latency difference
+comes from encoding and upload only; the token cost is an estimate.
+"""
+import argparse
+import base64
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from benchmark_openai_pool import StandInServer, percentile, self_signed_certificate
+from image_encoding import ENCODING_PROFILES, encode_image, estimate_vision_tokens
+
+
+def end_to_end(variants, batch_size, uplink_mbps, latency_ms):
+    """Per-batch latency and input cost of each variant's encoded images against the stand-in"""
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = self_signed_certificate(directory)
+        server = StandInServer(cert_path, key_path, 0, latency_ms / 1000, uplink_mbps)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ["REQUESTS_CA_BUNDLE"] = cert_path
+        os.environ["OPENAI_BASE_URL"] = f"https://localhost:{server.server_address[1]}/v1"
+        import openai_executions
+
+        print(f"end to end, {uplink_mbps:.0f} Mbps uplink, {latency_ms:.0f}ms modelled generation, batches sent one at a time:")
+        print(f"{'profile':<20} {'p50 ms':>8} {'p99 ms':>8} {'$/1k batches':>13}")
+        for name, (image_inputs, tokens, encode_ms) in variants.items():
+            latencies, batch_tokens = [], []
+            for start in range(0, len(image_inputs), batch_size):
+                indices = range(start, min(start + batch_size, len(image_inputs)))
+                request_start = time.perf_counter()
+                openai_executions.process_single_batch(
+                    "images_placeholder",
+                    [{"filename": f"image_{i}.jpg"} for i in indices],
+                    [image_inputs[i] for i in indices],
+                    f"{name} {start // batch_size + 1}",
+                )
+                latencies.append((time.perf_counter() - request_start) * 1000 + sum(encode_ms[i] for i in indices))
+                batch_tokens.append(sum(tokens[i] for i in indices))
+            cost = statistics.mean(batch_tokens) * 1000 * openai_executions.OPENAI_PRICE_INPUT_PER_M / 1e6
+            print(f"{name:<20} {percentile(latencies, 50):8.0f} {percentile(latencies, 99):8.0f} {cost:13.2f}")
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", required=True)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--end-to-end", action="store_true", help="also time requests against a local stand-in")
+    parser.add_argument("--uplink-mbps", type=float, default=50)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images)
+        if name.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    original_bytes, original_tokens, original_inputs = [], [], []
+    for path in paths:
+        try:
+            with Image.open(path) as image:
+                size = image.size
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        with open(path, "rb") as f:
+            original_b64 = base64.b64encode(f.read()).decode("utf-8")
+        original_bytes.append(len(original_b64))
+        original_tokens.append(estimate_vision_tokens(*size, 'high'))
+        original_inputs.append({"type": "input_image", "image_url": f"data:image/jpeg;base64,{original_b64}"})
+
+    def row(name, sizes, tokens, encode_ms=None):
+        timing = f"{statistics.median(encode_ms):7.1f}" if encode_ms else "      -"
+        print(
+            f"{name:<20} {statistics.mean(sizes) / 1e3:9.0f} {statistics.mean(sizes) * args.batch_size / 1e6:10.2f} "
+            f"{statistics.mean(tokens):8.0f} {timing}"
+        )
+
+    print(f"{len(original_bytes)} images, batch of {args.batch_size}")
+    print(f"{'profile':<20} {'KB/image':>9} {'MB/batch':>10} {'tokens':>8} {'enc ms':>7}")
+    row("original", original_bytes, original_tokens)
+    variants = {"original": (original_inputs, original_tokens, [0.0] * len(original_inputs))}
+    for profile in ENCODING_PROFILES:
+        sizes, tokens, timings, image_inputs = [], [], [], []
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                encoded = encode_image(path, profile)
+            except Exception:
+                continue
+            timings.append((time.perf_counter() - start) * 1000)
+            sizes.append(len(encoded['base64']))
+            tokens.append(estimate_vision_tokens(encoded['width'], encoded['height'], encoded['detail']))
+            image_inputs.append({
+                "type": "input_image",
+                "image_url": "data:image/jpeg;base64," + encoded['base64'],
+                "detail": encoded['detail'],
+            })
+        row(profile, sizes, tokens, timings)
+        variants[profile] = (image_inputs, tokens, timings)
+
+    if args.end_to_end:
+        end_to_end(variants, args.batch_size, args.uplink_mbps, args.latency_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+ONNX position model throughput at different batch sizes.
+
+    python benchmark_onnx.py --model ONNX_f1_0.83-positons-res34.onnx --images ./sample_claim [--batch-sizes 1 8 32]
+    python benchmark_onnx.py --model ONNX_f1_0.83-positons-res34.onnx --images ./sample_claim --check-session-options
+
+Images are decoded once up front so the numbers isolate session.run.
+--check-session-options compares the Lambda's session (saved EXTENDED
+graph loaded with build_session_options) against a default
+InferenceSession and fails if inference got slower.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import onnxruntime as rt
+
+from lambda_function import ONNX_INPUT_SIZE, build_session_options, onnx_model_io, preprocess_into_batch, run_onnx_batch
+
+
+def pass_seconds(session, model_io, batch, decoded):
+    start = time.perf_counter()
+    for offset in range(0, len(decoded), len(batch)):
+        count = min(len(batch), len(decoded) - offset)
+        batch[:count] = decoded[offset:offset + count]
+        run_onnx_batch(session, model_io, batch, count)
+    return time.perf_counter() - start
+
+
+def best_seconds(sessions, decoded, batch_size, repeats):
+    """
+    Best of `repeats` passes over all images for each session, in seconds.
+    Passes alternate between the sessions so load drift hits them equally.
+    """
+    runs = []
+    for session in sessions:
+        model_io = onnx_model_io(session)
+        batch = np.zeros((model_io[2] or batch_size, 3, ONNX_INPUT_SIZE, ONNX_INPUT_SIZE), dtype=np.float32)
+        run_onnx_batch(session, model_io, batch, 1)  # warm-up
+        runs.append((session, model_io, batch))
+    best = [None] * len(runs)
+    for _ in range(repeats):
+        for index, (session, model_io, batch) in enumerate(runs):
+            elapsed = pass_seconds(session, model_io, batch, decoded)
+            best[index] = elapsed if best[index] is None else min(best[index], elapsed)
+    return best
+
+
+def check_session_options(model, decoded, batch_size, repeats, tolerance):
+    """Assert the Lambda's session options are no slower than onnxruntime's defaults"""
+    with tempfile.TemporaryDirectory() as tmp:
+        optimized_path = os.path.join(tmp, "optimized.onnx")
+        rt.InferenceSession(model, sess_options=build_session_options(optimized_path))
+        lambda_session = rt.InferenceSession(optimized_path, sess_options=build_session_options())
+    baseline, tuned = best_seconds([rt.InferenceSession(model), lambda_session], decoded, batch_size, repeats)
+    print(f"default session  {baseline * 1000 / len(decoded):.1f} ms/image")
+    print(f"lambda session   {tuned * 1000 / len(decoded):.1f} ms/image")
+    assert tuned <= baseline * (1 + tolerance), (
+        f"Lambda session options are {tuned / baseline - 1:.0%} slower than the default session"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--images", required=True, help="directory of claim photos")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--check-session-options", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown for --check-session-options")
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images)
+        if name.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    decoded = np.zeros((len(paths), 3, ONNX_INPUT_SIZE, ONNX_INPUT_SIZE), dtype=np.float32)
+    count = 0
+    for path in paths:
+        try:
+            preprocess_into_batch(path, ONNX_INPUT_SIZE, decoded[count])
+            count += 1
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+    paths = paths[:count]
+    decoded = decoded[:count]
+
+    if args.check_session_options:
+        check_session_options(args.model, decoded, args.batch_sizes[-1], args.repeats, args.tolerance)
+        return
+
+    session = rt.InferenceSession(args.model)
+    model_io = onnx_model_io(session)
+    if model_io[2]:
+        print(f"Model has a fixed batch dimension of {model_io[2]}; only that batch size is meaningful")
+
+    print(f"{len(paths)} images, {os.cpu_count()} vCPUs")
+    for batch_size in args.batch_sizes:
+        batch_size = model_io[2] or batch_size
+        best = best_seconds([session], decoded, batch_size, args.repeats)[0]
+        print(f"batch_size={batch_size:<3} {len(paths) / best:7.1f} images/sec  ({best * 1000 / len(paths):.1f} ms/image)")
+
+
+if __name__ == "__main__":
+    main()
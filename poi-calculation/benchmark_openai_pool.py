@@ -0,0 +1,196 @@
+"""
+Per-batch OpenAI latency with a fresh connection per request vs the pooled session.
+
+    python benchmark_openai_pool.py [--batches 64] [--concurrency 8] [--handshake-ms 60] [--latency-ms 150]
+
+Starts a local HTTPS stand-in for the Responses API (self-signed certificate
+generated with the openssl CLI) and points OPENAI_BASE_URL at it. The stand-in
+sleeps `--handshake-ms` before completing each TLS handshake to model the
+TCP + TLS round trips to the real endpoint, and `--latency-ms` per request to
+model generation time. Reports p50/p99 of the per-batch latency recorded by
+process_single_batch and the number of connections the stand-in accepted.
+
+`--batches x --images-per-batch` images go through get_pois_for_batch, whose
+planner may pack them differently (claims over 50 images get 10 per batch),
+so the batch and image counts printed are the ones actually sent.
+"""
+import argparse
+import base64
+import json
+import os
+import re
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+
+def validation_result(filename):
+    """One result satisfying VALIDATION_RESPONSE_SCHEMA, so no batch needs a repair request"""
+    return {
+        "filename": filename,
+        "onnx_prediction": ["Front"],
+        "validated_labels": ["Front"],
+        "is_correct": True,
+        "confidence": "high",
+        "confidence_number": 0.95,
+        "reasoning": "stand-in",
+        "changes_made": "",
+        "has_damage": False,
+        "damage_regions": [],
+    }
+
+
+def response_body(request_body):
+    """A Responses API answer with one valid result per image named in the request's BATCH section"""
+    payload = json.loads(request_body or b"{}")
+    batch_text = "".join(
+        part.get("text", "")
+        for message in payload.get("input", [])
+        for part in message.get("content", [])
+        if part.get("type") == "input_text"
+    ).split("# BATCH", 1)[-1]
+    filenames = list(dict.fromkeys(re.findall(r"image_\d+\.jpg", batch_text)))
+    answer = {"validation_results": [validation_result(filename) for filename in filenames]}
+    return json.dumps({
+        "output": [{"role": "assistant", "content": [{"type": "output_text", "text": json.dumps(answer)}]}]
+    }).encode("utf-8")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def self_signed_certificate(directory):
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+            "-keyout", key_path, "-out", cert_path,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert_path, key_path
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        request_body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.server.uplink_bytes_per_second:
+            # Upload time of the request body over the modelled client uplink
+            time.sleep(len(request_body) / self.server.uplink_bytes_per_second)
+        body = response_body(request_body)
+        time.sleep(self.server.latency_seconds)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cert_path, key_path, handshake_seconds, latency_seconds, uplink_mbps=0):
+        super().__init__(("localhost", 0), StandInHandler)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert_path, key_path)
+        self.handshake_seconds = handshake_seconds
+        self.latency_seconds = latency_seconds
+        self.uplink_bytes_per_second = uplink_mbps * 1e6 / 8
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def finish_request(self, request, client_address):
+        # Runs on the per-connection thread, so the handshake delay does not serialise accepts
+        with self.lock:
+            self.connections += 1
+        time.sleep(self.handshake_seconds)
+        try:
+            request = self.context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        super().finish_request(request, client_address)
+
+
+class FreshConnectionSession:
+    """Stand-in for the pooled session that opens a new connection per request, as bare requests.post does"""
+
+    def post(self, url, **kwargs):
+        return requests.post(url, **kwargs)
+
+
+def run_batches(openai_executions, batches, images_per_batch, image_input):
+    filenames = [{"filename": f"image_{i}.jpg"} for i in range(batches * images_per_batch)]
+    inputs = [image_input] * len(filenames)
+    batch_stats = []
+    start = time.perf_counter()
+    openai_executions.get_pois_for_batch("images_placeholder", filenames, inputs, images_per_batch, batch_stats)
+    seconds = time.perf_counter() - start
+    return [record["latency_seconds"] * 1000 for record in batch_stats if "latency_seconds" in record], seconds, batch_stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=64)
+    parser.add_argument("--images-per-batch", type=int, default=5)
+    parser.add_argument("--image-kb", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--handshake-ms", type=float, default=60)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = self_signed_certificate(directory)
+        server = StandInServer(cert_path, key_path, args.handshake_ms / 1000, args.latency_ms / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        # requests prefers REQUESTS_CA_BUNDLE over Session.verify, so trust the stand-in through it
+        os.environ["REQUESTS_CA_BUNDLE"] = cert_path
+        os.environ["OPENAI_BASE_URL"] = f"https://localhost:{server.server_address[1]}/v1"
+        os.environ["OPENAI_PARALLEL_WORKERS"] = str(args.concurrency)
+        os.environ["OPENAI_MAX_CONCURRENCY"] = str(args.concurrency)
+        import openai_executions
+
+        image_b64 = base64.b64encode(os.urandom(args.image_kb * 1000)).decode("utf-8")
+        image_input = {"type": "input_image", "image_url": f"data:image/jpeg;base64,{image_b64}"}
+        openai_executions.openai_limiter.limit = float(args.concurrency)
+
+        print(
+            f"{args.batches * args.images_per_batch} images (requested {args.batches} batches x {args.images_per_batch}), "
+            f"concurrency {args.concurrency}, handshake {args.handshake_ms:.0f}ms, model latency {args.latency_ms:.0f}ms"
+        )
+        pooled = openai_executions.get_openai_session()
+        for label, session in (("fresh connection", FreshConnectionSession()), ("pooled session", pooled)):
+            openai_executions._openai_session = session
+            run_batches(openai_executions, 2, args.images_per_batch, image_input)  # warm-up
+            server.connections = 0
+            latencies, seconds, batch_stats = run_batches(openai_executions, args.batches, args.images_per_batch, image_input)
+            sent = len(batch_stats)
+            images = sum(record["images"] for record in batch_stats)
+            print(
+                f"  {label:<17} p50 {percentile(latencies, 50):7.1f}ms  p99 {percentile(latencies, 99):7.1f}ms  "
+                f"mean {statistics.mean(latencies):7.1f}ms  {sent} batches sent ({images / max(sent, 1):.1f} images each) "
+                f"in {seconds:.2f}s  connections {server.connections}"
+            )
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from math import ceil
+
+import boto3
+from botocore.config import Config
+
+# Claims with more images than this are split into shards processed by parallel workers (0 disables)
+FAN_OUT_MIN_IMAGES = int(os.getenv("FAN_OUT_MIN_IMAGES") or 150)
+# Images per shard; the shard count grows with the claim so each worker's share stays about the same
+FAN_OUT_SHARD_SIZE = int(os.getenv("FAN_OUT_SHARD_SIZE") or 40)
+# FAN_OUT_INVOKER: "lambda" invokes FAN_OUT_FUNCTION_NAME once per shard, "local" runs
+# shards in a process pool on this machine (tests and benchmarks)
+FAN_OUT_INVOKER = (os.getenv("FAN_OUT_INVOKER") or "lambda").lower()
+FAN_OUT_FUNCTION_NAME = os.getenv("FAN_OUT_FUNCTION_NAME") or os.getenv("AWS_LAMBDA_FUNCTION_NAME")
+# Seconds to wait for one shard worker; keep it under the coordinator's own timeout
+FAN_OUT_INVOKE_TIMEOUT = int(os.getenv("FAN_OUT_INVOKE_TIMEOUT") or 600)
+
+# Pipeline settings every shard reports the same way: taken from the first shard, never added up
+SHARED_STATS = {'threshold', 'method', 'mode', 'action', 'concurrency'}
+
+_lambda_client = None
+_lambda_client_lock = threading.Lock()
+
+
+def should_fan_out(image_count, requested=None):
+    """Fan out when the event asks for it, or by default when the claim is over FAN_OUT_MIN_IMAGES"""
+    if requested is not None:
+        return bool(requested) and image_count > 1
+    return 0 < FAN_OUT_MIN_IMAGES < image_count
+
+
+def plan_shards(objects, shard_size=None):
+    """Contiguous shards of at most `shard_size` objects, with sizes differing by at most one"""
+    shard_size = max(1, shard_size or FAN_OUT_SHARD_SIZE)
+    count = ceil(len(objects) / shard_size)
+    if count == 0:
+        return []
+    base, extra = divmod(len(objects), count)
+    shards = []
+    start = 0
+    for index in range(count):
+        end = start + base + (1 if index < extra else 0)
+        shards.append(objects[start:end])
+        start = end
+    return shards
+
+
+def get_lambda_client(max_connections=10):
+    global _lambda_client
+    if _lambda_client is None:
+        with _lambda_client_lock:
+            if _lambda_client is None:
+                _lambda_client = boto3.client('lambda', config=Config(
+                    read_timeout=FAN_OUT_INVOKE_TIMEOUT,
+                    connect_timeout=10,
+                    # A shard that failed is rerun by the coordinator rather than re-invoked
+                    retries={'max_attempts': 0},
+                    max_pool_connections=max(10, max_connections),
+                ))
+    return _lambda_client
+
+
+def invoke_lambda_shard(event, function_name=None, client=None):
+    """Run one shard synchronously on another instance of this function and return its result"""
+    client = client or get_lambda_client()
+    response = client.invoke(
+        FunctionName=function_name or FAN_OUT_FUNCTION_NAME,
+        InvocationType='RequestResponse',
+        Payload=json.dumps(event).encode('utf-8'),
+    )
+    payload = json.loads(response['Payload'].read() or b'null')
+    if response.get('FunctionError'):
+        message = payload.get('errorMessage') if isinstance(payload, dict) else payload
+        raise RuntimeError(f"Shard worker error: {message}")
+    return payload
+
+
+def run_shards(shard_events, worker, invoker=None, function_name=None):
+    """
+    Run every shard event in parallel and return (results, errors) in shard order.
+
+    With the "lambda" invoker each shard is a synchronous invoke of
+    `function_name`; with "local" it is `worker(event)` in a process pool.
+    A shard that fails has None as its result and the exception in `errors`.
+    """
+    invoker = (invoker or FAN_OUT_INVOKER).lower()
+    results = [None] * len(shard_events)
+    errors = [None] * len(shard_events)
+    if not shard_events:
+        return results, errors
+    if invoker == 'local':
+        # One fresh process per shard, like one Lambda instance per shard. Spawned rather than
+        # forked: this process already runs pool threads whose locks a fork would inherit held
+        executor = ProcessPoolExecutor(max_workers=len(shard_events), mp_context=multiprocessing.get_context('spawn'))
+        submit = lambda event: executor.submit(worker, event)
+    elif invoker == 'lambda':
+        if not (function_name or FAN_OUT_FUNCTION_NAME):
+            raise ValueError("FAN_OUT_FUNCTION_NAME is not set")
+        client = get_lambda_client(len(shard_events))
+        executor = ThreadPoolExecutor(max_workers=len(shard_events))
+        submit = lambda event: executor.submit(invoke_lambda_shard, event, function_name, client)
+    else:
+        raise ValueError(f"Unknown fan-out invoker: {invoker}")
+    with executor:
+        futures = [submit(event) for event in shard_events]
+        for index, future in enumerate(futures):
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"Shard {index + 1}/{len(shard_events)} failed: {e}")
+                errors[index] = e
+    return results, errors
+
+
+def merge_stats(stats_list):
+    """
+    Add up per-shard pipeline stats: counters are summed (peaks take the
+    maximum), nested dicts merged the same way, lists concatenated. Settings
+    (SHARED_STATS) and any other value are taken from the first shard that
+    has them; ratios are too, for the caller to recompute from the totals.
+    """
+    merged = {}
+    for stats in stats_list:
+        for name, value in (stats or {}).items():
+            if name not in merged:
+                merged[name] = merge_stats([value]) if isinstance(value, dict) else (list(value) if isinstance(value, list) else value)
+            elif name in SHARED_STATS or name.endswith('ratio') or isinstance(value, bool) or not isinstance(value, (int, float, dict, list)):
+                continue
+            elif isinstance(value, dict) and isinstance(merged[name], dict):
+                merged[name] = merge_stats([merged[name], value])
+            elif isinstance(value, list) and isinstance(merged[name], list):
+                merged[name].extend(value)
+            elif isinstance(value, (int, float)) and isinstance(merged[name], (int, float)):
+                merged[name] = max(merged[name], value) if name.startswith('peak') else merged[name] + value
+    return merged
+
+
+def merge_shard_results(shard_results):
+    """
+    Concatenate the shards' ONNX items and OpenAI validations in shard order
+    and merge their stats. OpenAI batch labels are prefixed with the shard
+    number so they stay unique.
+    """
+    items = []
+    openai_validation = []
+    stats_list = []
+    for number, result in enumerate(shard_results, 1):
+        items.extend(result['onnx_results']['items'])
+        openai_validation.extend(result['openai_validation'])
+        stats = dict(result['pipeline'])
+        stats['openai_batches'] = [
+            dict(batch, batch=f"{number}:{batch.get('batch')}") for batch in stats.get('openai_batches', [])
+        ]
+        stats_list.append(stats)
+    return {'items': items}, openai_validation, merge_stats(stats_list)
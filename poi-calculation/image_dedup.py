@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+
+# Near-duplicate detection: IMAGE_DEDUP selects the hash ("dhash", "phash" or "none", the default)
+IMAGE_DEDUP = (os.getenv("IMAGE_DEDUP") or "none").lower()
+# Largest Hamming distance (of 64 bits) at which two photos count as the same shot
+DEDUP_HAMMING_THRESHOLD = int(os.getenv("DEDUP_HAMMING_THRESHOLD") or 4)
+
+
+def grayscale(image):
+    """Luma of a CHW float array (as fed to ONNX) or an HWC uint8 array"""
+    image = np.asarray(image, dtype=np.float32)
+    if image.ndim == 2:
+        return image
+    if image.shape[0] == 3:
+        red, green, blue = image
+    else:
+        red, green, blue = image[..., 0], image[..., 1], image[..., 2]
+    return 0.299 * red + 0.587 * green + 0.114 * blue
+
+
+def block_mean(gray, rows, cols):
+    """Area-average downsample to (rows, cols) for any input size"""
+    row_edges = np.linspace(0, gray.shape[0], rows + 1).astype(int)[:-1]
+    col_edges = np.linspace(0, gray.shape[1], cols + 1).astype(int)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(gray, row_edges, axis=0), col_edges, axis=1)
+    counts = np.outer(np.diff(np.append(row_edges, gray.shape[0])), np.diff(np.append(col_edges, gray.shape[1])))
+    return sums / counts
+
+
+def pack_bits(bits):
+    return int(np.packbits(bits.ravel()).view('>u8')[0])
+
+
+def dhash(gray):
+    """Difference hash: sign of horizontal gradients on a 9x8 thumbnail"""
+    small = block_mean(gray, 8, 9)
+    return pack_bits(small[:, 1:] > small[:, :-1])
+
+
+_DCT_32 = np.cos(np.pi * (2 * np.arange(32)[None, :] + 1) * np.arange(32)[:, None] / 64)
+
+
+def phash(gray):
+    """Perceptual hash: low 8x8 DCT frequencies of a 32x32 thumbnail against their median"""
+    coefficients = (_DCT_32 @ block_mean(gray, 32, 32) @ _DCT_32.T)[:8, :8]
+    return pack_bits(coefficients > np.median(coefficients.ravel()[1:]))
+
+
+HASHES = {'dhash': dhash, 'phash': phash}
+
+
+def hamming_distances(hashes, image_hash):
+    """Bits differing between each of the uint64 `hashes` and `image_hash`"""
+    differences = hashes ^ np.uint64(image_hash)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(differences)
+    # NumPy 1.x has no popcount ufunc
+    return np.unpackbits(differences.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def image_hash(image, method=IMAGE_DEDUP):
+    return HASHES[method](grayscale(image))
+
+
+class DuplicateIndex:
+    """
+    Greedy clustering of image hashes: each image joins the nearest earlier
+    representative (the earliest on ties) within `threshold` bits, or becomes
+    a representative. Images must be added in a fixed order for the clusters
+    to be reproducible; the pipeline adds them in input order.
+    """
+
+    def __init__(self, threshold=DEDUP_HAMMING_THRESHOLD):
+        self.threshold = threshold
+        self.hashes = np.zeros(64, dtype=np.uint64)
+        self.representatives = []
+        self.clusters = {}
+
+    def add(self, index, image_hash):
+        """Returns the representative index `index` duplicates, or None if it is a new representative"""
+        count = len(self.representatives)
+        if count:
+            distances = hamming_distances(self.hashes[:count], image_hash)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= self.threshold:
+                representative = self.representatives[nearest]
+                self.clusters[representative].append(index)
+                return representative
+        if count == len(self.hashes):
+            self.hashes = np.concatenate([self.hashes, np.zeros_like(self.hashes)])
+        self.hashes[count] = image_hash
+        self.representatives.append(index)
+        self.clusters[index] = []
+        return None
+
+
+def fan_out_item(representative_item, member_path):
+    """The representative's result for a duplicate photo, pointing at the duplicate's own file"""
+    item = dict(representative_item)
+    item['filename'] = os.path.basename(member_path)
+    item['image_path'] = member_path
+    item['duplicate_of'] = representative_item['filename']
+    return item
+
+
+def fan_out_validation(openai_validation, member_filenames):
+    """
+    Copies of the representatives' validation results for their duplicates.
+    `member_filenames` maps a representative filename to its members' filenames.
+    """
+    copies = []
+    for validation_item in openai_validation:
+        if not isinstance(validation_item, dict):
+            continue
+        for member in member_filenames.get(validation_item.get('filename'), []):
+            copies.append(dict(validation_item, filename=member, duplicate_of=validation_item['filename']))
+    return copies
@@ -0,0 +1,148 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+# Per use-case encoding profiles. OpenAI downsizes "high" detail images so the
+# shortest side is at most 768px and "low" detail images to 512px, so pixels
+# beyond that only cost upload time and request size.
+ENCODING_PROFILES = {
+    'damage_detection': {'long_edge': 1536, 'short_edge': 768, 'max_bytes': 450_000, 'detail': 'high'},
+    'position_validation': {'long_edge': 512, 'short_edge': 512, 'max_bytes': 120_000, 'detail': 'low'},
+    'poi_description': {'long_edge': 1536, 'short_edge': 768, 'max_bytes': 450_000, 'detail': 'high'},
+}
+# Optional global overrides, e.g. LLM_IMAGE_LONG_EDGE=1024 LLM_IMAGE_MAX_BYTES=300000
+ENV_OVERRIDES = {
+    'long_edge': os.getenv("LLM_IMAGE_LONG_EDGE"),
+    'max_bytes': os.getenv("LLM_IMAGE_MAX_BYTES"),
+}
+ENCODE_CACHE_MAX_BYTES = int(os.getenv("LLM_IMAGE_CACHE_MAX_BYTES") or 100_000_000)
+
+_encode_cache = OrderedDict()
+_encode_cache_bytes = 0
+_encode_cache_lock = threading.Lock()
+
+
+def resolve_profile(profile='damage_detection', **overrides):
+    settings = dict(ENCODING_PROFILES[profile])
+    for name, value in ENV_OVERRIDES.items():
+        if value:
+            settings[name] = int(value)
+    settings.update({name: value for name, value in overrides.items() if value is not None})
+    return settings
+
+
+def target_size(width, height, long_edge, short_edge):
+    scale = min(1.0, long_edge / max(width, height), short_edge / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _source_identity(source):
+    """Cache identity of an image source: path with mtime/size, or a digest of the bytes"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return ('bytes', hashlib.blake2b(source, digest_size=16).hexdigest())
+    stat = os.stat(source)
+    return ('path', str(source), stat.st_mtime_ns, stat.st_size)
+
+
+def _open(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+def _source_bytes(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def _result(data, width, height, quality, settings):
+    return {
+        'base64': base64.b64encode(data).decode('utf-8'),
+        'bytes': len(data),
+        'width': width,
+        'height': height,
+        'quality': quality,
+        'detail': settings['detail'],
+    }
+
+
+def _encode(source, settings):
+    with _open(source) as image:
+        width, height = target_size(*image.size, settings['long_edge'], settings['short_edge'])
+        if (
+            image.format == 'JPEG'
+            and (width, height) == image.size
+            and image.mode == 'RGB'
+            and image.getexif().get(0x0112, 1) == 1
+        ):
+            # Already a small, upright JPEG: re-encoding would only lose quality
+            data = _source_bytes(source)
+            if len(data) <= settings['max_bytes']:
+                return _result(data, width, height, None, settings)
+        image.draft('RGB', (width, height))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        width, height = target_size(*image.size, settings['long_edge'], settings['short_edge'])
+        if (width, height) != image.size:
+            image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    # Step quality down until the JPEG fits the byte budget, then shrink the image
+    while True:
+        for quality in (90, 82, 74, 66, 58, 50, 42):
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= settings['max_bytes']:
+                break
+        if buffer.tell() <= settings['max_bytes'] or min(image.size) <= 64:
+            break
+        image = image.resize((int(image.width * 0.8), int(image.height * 0.8)), Image.Resampling.LANCZOS)
+
+    return _result(buffer.getvalue(), image.width, image.height, quality, settings)
+
+
+def encode_image(source, profile='damage_detection', **overrides):
+    """
+    Downscale and re-encode an image (path or bytes) as JPEG for an LLM request.
+
+    Returns a dict with the base64 payload, encoded size, dimensions and the
+    `detail` level of the profile. Results are cached per source and
+    settings, so an image sent in several requests is only encoded once.
+    """
+    global _encode_cache_bytes
+    settings = resolve_profile(profile, **overrides)
+    cache_key = (_source_identity(source), tuple(sorted(settings.items())))
+    with _encode_cache_lock:
+        if cache_key in _encode_cache:
+            _encode_cache.move_to_end(cache_key)
+            return _encode_cache[cache_key]
+
+    encoded = _encode(source, settings)
+
+    with _encode_cache_lock:
+        if cache_key not in _encode_cache:
+            _encode_cache[cache_key] = encoded
+            _encode_cache_bytes += len(encoded['base64'])
+            while _encode_cache_bytes > ENCODE_CACHE_MAX_BYTES and len(_encode_cache) > 1:
+                _, evicted = _encode_cache.popitem(last=False)
+                _encode_cache_bytes -= len(evicted['base64'])
+    return encoded
+
+
+def estimate_vision_tokens(width, height, detail='high'):
+    """OpenAI's published tile-based estimate of the input tokens an image costs"""
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = -(-int(width) // 512) * -(-int(height) // 512)
+    return 85 + 170 * tiles
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+# QUALITY_ACTION: "tag" marks unusable photos, "skip" also keeps them away from
+# the model and the LLM, "off" disables the check
+QUALITY_ACTION = (os.getenv("QUALITY_ACTION") or "tag").lower()
+QUALITY_THRESHOLDS = {
+    # Variance of the Laplacian on the 448x448 grey thumbnail (0-255 scale); lower is blurrier
+    'min_sharpness': float(os.getenv("QUALITY_MIN_SHARPNESS") or 20),
+    # Share of pixels that are near black / near white
+    'max_dark_fraction': float(os.getenv("QUALITY_MAX_DARK_FRACTION") or 0.9),
+    'max_bright_fraction': float(os.getenv("QUALITY_MAX_BRIGHT_FRACTION") or 0.9),
+    # Shortest side of the original photo, in pixels
+    'min_side': int(os.getenv("QUALITY_MIN_SIDE") or 224),
+}
+QUALITY_SIZE = 448
+
+
+def resolve_thresholds(overrides=None):
+    """Default thresholds with a caller's overrides (unknown names are ignored)"""
+    thresholds = dict(QUALITY_THRESHOLDS)
+    thresholds.update({name: value for name, value in (overrides or {}).items() if name in thresholds and value is not None})
+    return thresholds
+
+
+def to_gray(image):
+    """0-255 luma of a CHW float array in [0, 1] (as fed to ONNX) or an HWC / HW uint8 array"""
+    image = np.asarray(image, dtype=np.float32)
+    if image.ndim == 3 and image.shape[0] == 3:
+        return (0.299 * image[0] + 0.587 * image[1] + 0.114 * image[2]) * 255
+    if image.ndim == 3:
+        return 0.299 * image[..., 0] + 0.587 * image[..., 1] + 0.114 * image[..., 2]
+    return image
+
+
+def load_gray(path, size=QUALITY_SIZE):
+    """Grey thumbnail of an image file decoded at reduced resolution, plus the original (width, height)"""
+    with Image.open(path) as image:
+        original_size = image.size
+        image.draft('L', (size, size))
+        gray = image.convert('L').resize((size, size), reducing_gap=3.0)
+    return np.asarray(gray, dtype=np.float32), original_size
+
+
+def assess_quality(image, original_size, thresholds=None):
+    """
+    Sharpness, exposure and size checks on an already decoded thumbnail.
+
+    Returns a dict of the measurements and the list of `issues`
+    ('blurry', 'underexposed', 'overexposed', 'too_small'); an empty list
+    means the photo is usable.
+    """
+    thresholds = thresholds or QUALITY_THRESHOLDS
+    gray = to_gray(image)
+    laplacian = gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1] - 4 * gray[1:-1, 1:-1]
+    histogram = np.bincount(np.clip(gray, 0, 255).astype(np.uint8).ravel(), minlength=256) / gray.size
+    report = {
+        'sharpness': round(float(laplacian.var()), 2),
+        'dark_fraction': round(float(histogram[:20].sum()), 3),
+        'bright_fraction': round(float(histogram[236:].sum()), 3),
+        'width': original_size[0],
+        'height': original_size[1],
+    }
+    issues = []
+    if min(original_size) < thresholds['min_side']:
+        issues.append('too_small')
+    if report['dark_fraction'] > thresholds['max_dark_fraction']:
+        issues.append('underexposed')
+    elif report['bright_fraction'] > thresholds['max_bright_fraction']:
+        issues.append('overexposed')
+    elif report['sharpness'] < thresholds['min_sharpness']:
+        # A black or blown-out frame is flat anyway; only call it blurry when exposure is fine
+        issues.append('blurry')
+    report['issues'] = issues
+    return report
+
+
+def assess_file(path, thresholds=None):
+    gray, original_size = load_gray(path)
+    return assess_quality(gray, original_size, thresholds)
+
+
+def summarize_quality(reports, action):
+    """Counts per issue and the flagged files, from {filename: report}"""
+    flagged = {filename: report['issues'] for filename, report in reports.items() if report['issues']}
+    issue_counts = {}
+    for issues in flagged.values():
+        for issue in issues:
+            issue_counts[issue] = issue_counts.get(issue, 0) + 1
+    return {
+        'action': action,
+        'checked': len(reports),
+        'flagged': len(flagged),
+        'skipped': len(flagged) if action == 'skip' else 0,
+        'issues': issue_counts,
+        'flagged_images': [{'filename': filename, 'issues': issues} for filename, issues in flagged.items()],
+    }
@@ -6,62 +6,75 @@ import numpy as np
 from pathlib import Path
 import boto3
 import time
-import base64
-from openai_executions import get_pois_for_batch
+import io
+from openai_executions import get_batch_executor, openai_limiter, process_single_batch, default_batch_size, summarize_hedges, summarize_usage
+from prediction_cache import get_prediction_cache, prediction_cache_key
+from image_encoding import encode_image
+from batch_planner import image_input_cost, plan_batches
+from metrics import emit_claim_batch_metrics, emit_pipeline_metrics
+from image_quality import QUALITY_ACTION, assess_quality, resolve_thresholds, summarize_quality
+from fan_out import merge_shard_results, plan_shards, run_shards, should_fan_out
+from scratch_cache import ImageBuffers, get_scratch_cache, new_cache_stats
+from image_dedup import DEDUP_HAMMING_THRESHOLD, IMAGE_DEDUP, DuplicateIndex, fan_out_item, fan_out_validation, image_hash
 from concurrent.futures import ThreadPoolExecutor
+import threading
+import queue
 
 # S3 configuration
 s3 = boto3.client('s3')
 BUCKET_NAME = os.getenv("BUCKET_NAME") or "trueclaim"
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE") or 8)
+ONNX_INPUT_SIZE = 448
+ONNX_MODEL_FILE = "ONNX_f1_0.83-positons-res34.onnx"
+# Selectable position model variants (see quantize_model.py for producing int8)
+ONNX_MODEL_VARIANTS = {
+    'fp32': ONNX_MODEL_FILE,
+    'int8': "ONNX_f1_0.83-positons-res34.int8.onnx",
+}
+ONNX_MODEL_VARIANT = os.getenv("ONNX_MODEL_VARIANT") or 'fp32'
+# Upload the graph-optimized model next to the original so new containers skip optimization
+ONNX_PERSIST_OPTIMIZED = (os.getenv("ONNX_PERSIST_OPTIMIZED") or "true").lower() == "true"
 
-def download_file_from_s3(key, local_path):
-    """Download a file from S3"""
-    s3.download_file(BUCKET_NAME, key, local_path)
+# Sessions are kept at module level and reused across warm invocations
+_position_models = {}
+_position_models_lock = threading.Lock()
+MODEL_INIT_STATS = {}
 
-def list_s3_files(prefix):
-    """List files in S3 with given prefix"""
-    response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=prefix)
-    keys = []
-    if "Contents" in response:
-        for obj in response["Contents"]:
-            keys.append(obj["Key"])
-    return keys
-
-def get_and_download_input_images(claim_id):
-    """Download images from S3 for a given claim_id"""
-    base_est_prefix = f"claims/{claim_id}/est/"
-    keys = list_s3_files(base_est_prefix + "InputImages/")
-    local_orig_images = []
-    print(f"Found {len(keys)} images in S3")
-    
-    # Create temp directory for downloaded images
-    temp_dir = "/tmp/vehicle_images"
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    for key in keys:
-        local_file = os.path.join(temp_dir, os.path.basename(key))
-        download_file_from_s3(key, local_file)
-        local_orig_images.append(local_file)
-    
-    return local_orig_images
+# Confidence gating: which images are sent to OpenAI for position validation
+POSITION_VALIDATION_POLICY = os.getenv("POSITION_VALIDATION_POLICY") or 'all'  # or 'low_confidence'
+ONNX_CONFIDENCE_THRESHOLD = float(os.getenv("ONNX_CONFIDENCE_THRESHOLD") or 0.8)
+ONNX_MARGIN_THRESHOLD = float(os.getenv("ONNX_MARGIN_THRESHOLD") or 0.2)
 
+# Pipeline configuration: download/decode workers and the bounded hand-off to inference
+PIPELINE_DOWNLOAD_WORKERS = int(os.getenv("PIPELINE_DOWNLOAD_WORKERS") or 10)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE") or 32)
+# IMAGE_FETCH_MODE: "memory" reads each photo once into a buffer shared by ONNX and the
+# OpenAI encoder, "disk" downloads every photo into the /tmp scratch cache
+IMAGE_FETCH_MODE = (os.getenv("IMAGE_FETCH_MODE") or "memory").lower()
+# Bytes of photos held in memory at once; past this, photos spill to the scratch cache
+IMAGE_MEMORY_MAX_BYTES = int(os.getenv("IMAGE_MEMORY_MAX_BYTES") or 200_000_000)
 
-def get_and_download_input_images_parallel(claim_id):
-    base_est_prefix = f"claims/{claim_id}/est/"
-    keys = list_s3_files(base_est_prefix + "InputImages/")
-    temp_dir = "/tmp/vehicle_images"
-    os.makedirs(temp_dir, exist_ok=True)
+# Multi-claim events (claim_ids): claims processed at once on the shared model and OpenAI pools
+CLAIM_BATCH_CONCURRENCY = int(os.getenv("CLAIM_BATCH_CONCURRENCY") or 2)
+# Where write_results stores each claim's result in multi-claim mode
+CLAIM_RESULTS_KEY = os.getenv("CLAIM_RESULTS_KEY") or "claims/{claim_id}/est/poi-calculation-results.json"
 
-    def download(key):
-        local_file = os.path.join(temp_dir, os.path.basename(key))
-        download_file_from_s3(key, local_file)
-        return local_file
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        local_orig_images = list(executor.map(download, keys))
-    return local_orig_images
+def download_file_from_s3(key, local_path):
+    """Download a file from S3"""
+    s3.download_file(BUCKET_NAME, key, local_path)
 
+def read_file_from_s3(key):
+    """Read an S3 object into memory"""
+    return s3.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()
 
+def list_s3_objects(prefix):
+    """List objects (Key, ETag, Size) in S3 with given prefix"""
+    objects = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            objects.append({'Key': obj["Key"], 'ETag': obj.get("ETag"), 'Size': obj.get("Size", 0)})
+    return objects
 
 position_labels = ['position-Front',
  'position-Front_Left',
@@ -95,9 +108,8 @@ POI_MAPPING = {
     'RearLeft': ['Rear','L-Side'],   
 }
 
-def models_loading():
-    """Load ONNX model from S3 or local cache with timing"""
-    model_file = "ONNX_f1_0.83-positons-res34.onnx"
+def fetch_model_file(model_file, required=True):
+    """Return a local path for a model file, downloading it from S3 into /tmp if needed"""
     local_model_path = f"/tmp/{model_file}"
     if not os.path.exists(local_model_path):
         try:
@@ -105,107 +117,351 @@ def models_loading():
             s3_key = f"models/{model_file}"
             download_file_from_s3(s3_key, local_model_path)
         except Exception as e:
+            if os.path.exists(local_model_path):
+                os.remove(local_model_path)
+            if not required:
+                return None
             print(f"❌ Error downloading model from S3: {e}")
             # Fallback to local file if it exists
             if os.path.exists(model_file):
                 local_model_path = model_file
             else:
                 raise Exception(f"Model file not found locally or in S3: {model_file}")
-    new_position_model = rt.InferenceSession(local_model_path)
+    return local_model_path
+
+def available_vcpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def build_session_options(optimized_model_path=None):
+    """
+    Explicit session options sized to the Lambda's vCPUs.
+
+    When `optimized_model_path` is given the graph is optimized at the
+    portable EXTENDED level and serialized there. Sessions that run
+    inference use ENABLE_ALL: the layout optimizations it adds (NCHWc) are
+    hardware specific and are not serialized, so they are applied at load
+    time even on a pre-optimized model.
+    """
+    options = rt.SessionOptions()
+    options.execution_mode = rt.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = int(os.getenv("ONNX_INTRA_OP_THREADS") or available_vcpus())
+    options.inter_op_num_threads = int(os.getenv("ONNX_INTER_OP_THREADS") or 1)
+    if optimized_model_path:
+        options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        options.optimized_model_filepath = optimized_model_path
+    else:
+        options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+def optimized_model_name(model_file):
+    # Optimized graphs are tied to the onnxruntime version that produced them
+    stem = model_file.rsplit(".onnx", 1)[0]
+    return f"{stem}.ort-{rt.__version__}.optimized.onnx"
+
+def models_loading(model_file=ONNX_MODEL_FILE):
+    """Build an InferenceSession, preferring a previously optimized copy of the model"""
+    start_time = time.time()
+    optimized_file = optimized_model_name(model_file)
+    optimized_path = fetch_model_file(optimized_file, required=False)
+    if optimized_path:
+        new_position_model = rt.InferenceSession(optimized_path, sess_options=build_session_options())
+        source = "optimized"
+    else:
+        local_model_path = fetch_model_file(model_file)
+        optimized_path = f"/tmp/{optimized_file}"
+        # This session only writes the portable optimized graph; inference runs on an ENABLE_ALL session
+        rt.InferenceSession(local_model_path, sess_options=build_session_options(optimized_path))
+        source = "original"
+        if os.path.exists(optimized_path):
+            new_position_model = rt.InferenceSession(optimized_path, sess_options=build_session_options())
+            if ONNX_PERSIST_OPTIMIZED:
+                try:
+                    s3.upload_file(optimized_path, BUCKET_NAME, f"models/{optimized_file}")
+                except Exception as e:
+                    print(f"Could not persist optimized model to S3: {e}")
+        else:
+            new_position_model = rt.InferenceSession(local_model_path, sess_options=build_session_options())
+    print(f"Loaded ONNX session from {source} model in {time.time() - start_time:.2f}s")
+    MODEL_INIT_STATS[model_file] = {'source': source, 'cold_init_seconds': round(time.time() - start_time, 3)}
 
     return new_position_model
 
+def resolve_model_file(model_variant=None):
+    """Model file for a variant name (event field or ONNX_MODEL_VARIANT env)"""
+    model_variant = model_variant or ONNX_MODEL_VARIANT
+    if model_variant not in ONNX_MODEL_VARIANTS:
+        raise Exception(f"Unknown model variant: {model_variant}")
+    return ONNX_MODEL_VARIANTS[model_variant]
+
+def get_position_model(model_file=ONNX_MODEL_FILE):
+    """Lazily create the session for `model_file` once per container and reuse it"""
+    start_time = time.time()
+    cold_start = model_file not in _position_models
+    if cold_start:
+        with _position_models_lock:
+            if model_file not in _position_models:
+                _position_models[model_file] = models_loading(model_file)
+    init_seconds = time.time() - start_time
+    stats = MODEL_INIT_STATS.setdefault(model_file, {})
+    stats['cold_start'] = cold_start
+    stats['init_seconds'] = round(init_seconds, 3)
+    if not cold_start:
+        print(f"Reusing warm ONNX session ({init_seconds * 1000:.2f}ms)")
+    return _position_models[model_file]
+
+
+def image_file(source):
+    '''A file path or file object PIL can open, for a path or in-memory bytes.'''
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+def decode_resized(path, size: int) -> Image.Image:
+    '''
+    Decode an image (path or bytes) at reduced resolution and resize it to (size, size) RGB.
+
+    For JPEGs `draft` lets the decoder scale by 1/2, 1/4 or 1/8 while
+    decoding, so a 12MP photo is decoded at roughly the target size instead
+    of full resolution. Other formats fall back to `reduce` via reducing_gap.
+    '''
+    with Image.open(image_file(path)) as image:
+        image.draft(image.mode, (size, size))
+        if image.mode != 'RGB':
+            # RGBA, LA, L, P, CMYK... would otherwise break the CHW transpose
+            image = image.convert('RGB')
+        return image.resize((size, size), reducing_gap=3.0)
 
-def image_transform_onnx(path: str, size: int) -> np.ndarray:
-    '''Image transform helper for onnx runtime inference.'''
-    image = Image.open(path)
-    image = image.resize((size,size))
-    image = np.array(image)
-    image = image.transpose(2,0,1).astype(np.float32)
-    image /= 255
-    image = image[None, ...]
-    return image
+def preprocess_into_batch(path: str, size: int, out: np.ndarray) -> np.ndarray:
+    '''Decode, resize and normalise an image straight into a preallocated CHW float32 slot.'''
+    image = np.asarray(decode_resized(path, size))
+    np.divide(image.transpose(2,0,1), np.float32(255), out=out, dtype=np.float32)
+    return out
 
-def onnx_position_pred(pth,labels = position_labels ,position_model = None, size = 448):
+def onnx_model_io(position_model):
+    """Input name, output name and fixed batch dimension (None when dynamic) of the model"""
+    model_input = position_model.get_inputs()[0]
+    fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) and model_input.shape[0] > 0 else None
+    return model_input.name, position_model.get_outputs()[0].name, fixed_batch
 
-    input_name = position_model.get_inputs()[0].name
-    output_name = position_model.get_outputs()[0].name
-    processed_input = image_transform_onnx(str(pth),size)
-    results = position_model.run([output_name], {input_name: processed_input})[0]
-    #labels[np.argmax(results)], results, labels
-    return labels[np.argmax(results)]
+def run_onnx_batch(position_model, model_io, batch, count):
+    """Run the first `count` rows of a preallocated batch, returning one score row per image"""
+    input_name, output_name, fixed_batch = model_io
+    batch_input = batch if fixed_batch else batch[:count]
+    return position_model.run([output_name], {input_name: batch_input})[0][:count]
 
 def map_position_to_labels(position_pred):
     """Map position prediction to standard labels"""
     return label_mapping.get(position_pred, ['Front'])
 
-def classify_vehicle_images_onnx(image_paths):
+def predict_filled_batch(position_model, model_io, batch, filled, items, openai_policy=None):
     """
-    Classify multiple vehicle images using ONNX position model
-    
-    Args:
-        image_paths: list of image file paths
-        
-    Returns:
-        dict: classification results in the expected format
+    Run the filled rows of `batch` and store one result item per image in `items`.
+
+    `filled` holds (index, image_path) for each row. If the batched run fails
+    the images are retried one by one so a single bad input only fails itself.
+    Returns (index, scores) for every image that was predicted successfully.
     """
-    items = []
-    new_position_model = models_loading()
-    for i, image_path in enumerate(image_paths):
-        try:
-            position_pred = onnx_position_pred(image_path,position_model=new_position_model, size=448)
-            mapped_labels = map_position_to_labels(position_pred)
-            item = {
-                'filename': os.path.basename(image_path),
-                'image_path': image_path,
-                'labels': mapped_labels,
-                'uncertain': False,  # ONNX model is generally confident
-                'reasons': f"ONNX position model prediction: {position_pred} -> {', '.join(mapped_labels)}"
-            }
-            items.append(item)
-            
-        except Exception as e:
-            print(f"Error processing image {image_path}: {e}")
-            item = {
-                'filename': os.path.basename(image_path),
-                'labels': [],
-                'uncertain': True,
-                'reasons': f"Error: {str(e)}"
-            }
-            items.append(item)
-    
+    try:
+        scores = run_onnx_batch(position_model, model_io, batch, len(filled))
+    except Exception as e:
+        print(f"Batched inference failed ({e}), retrying images individually")
+        scores = []
+        for row, (index, image_path) in enumerate(filled):
+            try:
+                if model_io[2]:
+                    raise e
+                scores.append(run_onnx_batch(position_model, model_io, batch[row:row + 1], 1)[0])
+            except Exception as single_error:
+                items[index] = onnx_error_item(image_path, single_error)
+                scores.append(None)
+
+    predicted = []
+    for (index, image_path), image_scores in zip(filled, scores):
+        if image_scores is not None:
+            position_pred = position_labels[int(np.argmax(image_scores))]
+            items[index] = onnx_result_item(image_path, position_pred, image_scores, openai_policy)
+            predicted.append((index, image_scores))
+    return predicted
+
+def position_confidence(scores):
+    """
+    Softmax probabilities, top-1 confidence and top-2 margin for one score row.
+    Rows that already look like probabilities are used as-is.
+    """
+    scores = np.asarray(scores, dtype=np.float64).ravel()
+    if scores.min() < 0 or abs(scores.sum() - 1) > 1e-3:
+        exp_scores = np.exp(scores - scores.max())
+        probabilities = exp_scores / exp_scores.sum()
+    else:
+        probabilities = scores
+    top_two = np.sort(probabilities)[-2:]
+    return probabilities, float(top_two[-1]), float(top_two[-1] - top_two[0])
+
+def build_openai_policy(validate_with_openai=True, detect_damage=True, policy=None, confidence_threshold=None, margin_threshold=None):
+    """
+    OpenAI routing policy, or None when neither validation nor damage detection is requested.
+
+    policy 'all' sends every image for position validation; 'low_confidence'
+    only sends images whose ONNX confidence or top-2 margin is under the
+    thresholds. Damage detection needs every image, so `detect_damage`
+    sends all images regardless of confidence; the confident ones go with
+    the short damage-only prompt (create_damage_prompt).
+    """
+    if not validate_with_openai and not detect_damage:
+        return None
+    return {
+        'validate_position': bool(validate_with_openai),
+        'detect_damage': bool(detect_damage),
+        'policy': policy or POSITION_VALIDATION_POLICY,
+        'confidence_threshold': ONNX_CONFIDENCE_THRESHOLD if confidence_threshold is None else float(confidence_threshold),
+        'margin_threshold': ONNX_MARGIN_THRESHOLD if margin_threshold is None else float(margin_threshold),
+    }
+
+def is_low_confidence(confidence, margin, openai_policy=None):
+    confidence_threshold = openai_policy['confidence_threshold'] if openai_policy else ONNX_CONFIDENCE_THRESHOLD
+    margin_threshold = openai_policy['margin_threshold'] if openai_policy else ONNX_MARGIN_THRESHOLD
+    return confidence < confidence_threshold or margin < margin_threshold
+
+def openai_routing(uncertain, openai_policy):
+    """(send to OpenAI, validate position) for an image under the given policy"""
+    if not openai_policy:
+        return False, False
+    validate_position = openai_policy['validate_position'] and (openai_policy['policy'] == 'all' or uncertain)
+    return validate_position or openai_policy['detect_damage'], validate_position
+
+def route_item_for_openai(item, openai_policy):
+    """Mark whether OpenAI should validate the item's position; returns True if the image must be sent"""
+    if not item or not item.get('image_path'):
+        return False
+    send, validate_position = openai_routing(item.get('uncertain', True), openai_policy)
+    item['validate_position'] = validate_position
+    return send
+
+def onnx_result_item(image_path, position_pred, scores=None, openai_policy=None):
+    mapped_labels = map_position_to_labels(position_pred)
+    item = {
+        'filename': os.path.basename(image_path),
+        'image_path': image_path,
+        'labels': mapped_labels,
+        'uncertain': False,  # ONNX model is generally confident
+        'reasons': f"ONNX position model prediction: {position_pred} -> {', '.join(mapped_labels)}"
+    }
+    if scores is not None:
+        probabilities, confidence, margin = position_confidence(scores)
+        item['position_probabilities'] = {
+            label: round(float(probability), 4) for label, probability in zip(position_labels, probabilities)
+        }
+        item['confidence'] = round(confidence, 4)
+        item['margin'] = round(margin, 4)
+        item['uncertain'] = is_low_confidence(confidence, margin, openai_policy)
+        item['reasons'] += f" (confidence {confidence:.2f}, margin {margin:.2f})"
+    return item
+
+def onnx_error_item(image_path, error):
+    print(f"Error processing image {image_path}: {error}")
+    return {
+        'filename': os.path.basename(image_path),
+        'labels': [],
+        'uncertain': True,
+        'reasons': f"Error: {str(error)}"
+    }
+
+def quality_skipped_item(image_path, quality):
+    print(f"Skipping unusable image {image_path}: {', '.join(quality['issues'])}")
     return {
-        'items': items,
+        'filename': os.path.basename(image_path),
+        'image_path': image_path,
+        'labels': [],
+        'uncertain': True,
+        'skipped': True,
+        'quality': quality,
+        'reasons': f"Skipped: unusable photo ({', '.join(quality['issues'])})"
     }
 
-def encode_image_for_openai(image_path):
-    """Encode image for OpenAI API with base64"""
+def encode_image_for_openai(image_path, profile='damage_detection', source=None):
+    """Encode image for OpenAI API as a downscaled, size-budgeted base64 JPEG (from `source` bytes when given)"""
     try:
-        with open(image_path, "rb") as f:
-            base64_img = base64.b64encode(f.read()).decode("utf-8")
-            filename = os.path.basename(image_path)
-
-            image_input = {
-                "type": "input_image",
-                "image_url": "data:image/jpeg;base64," + base64_img,
-                
-            }
-            return filename, image_input
+        encoded = encode_image(image_path if source is None else source, profile)
+        filename = os.path.basename(image_path)
+
+        image_input = {
+            "type": "input_image",
+            "image_url": "data:image/jpeg;base64," + encoded['base64'],
+            "detail": encoded['detail'],
+        }
+        return filename, image_input
     except Exception as e:
         print(f"Error encoding image {image_path}: {e}")
         return os.path.basename(image_path), None
 
+def encoding_profile_for(openai_policy):
+    """Damage detection needs full detail; position-only validation works on low-detail thumbnails"""
+    if openai_policy and not openai_policy['detect_damage']:
+        return 'position_validation'
+    return 'damage_detection'
+
+
+# POI options and their mapping, shared by the validation and damage-only prompts
+POI_PROMPT_SECTIONS = """# VALID POI OPTIONS
+        "Right Front Corner", "Right Front Side", "Right Side", "Right Rear Side",
+        "Right Rear Corner", "Rear", "Left Rear Corner", "Left Rear Side",
+        "Left Side", "Left Front Side", "Left Front Corner", "Front", "Roof",
+        "Engine / Electrical", "Interior", "Steering / Suspension", "A/C", "Frame / Floor"
+
+        # POI MAPPING DEFINITIONS
+        {
+        "Right Front Corner": ["Right Headlight", "Right Front Bumper Corner", "Right Fender (Front Portion)", "Right Fog Light (if equipped)"],
+        "Right Front Side": ["Right Front Fender", "Right Side Mirror", "Right A-Pillar"],
+        "Right Side": ["Right Front Door", "Right Rear Door", "Right Side Skirts", "Right B-Pillar"],
+        "Right Rear Side": ["Right Quarter Panel", "Right Rear Wheel Arch"],
+        "Right Rear Corner": ["Right Tail Light", "Rear Bumper (Right Corner)", "Right Rear Fender Extension"],
+        "Rear": ["Trunk / Boot Lid", "Rear Windshield", "Rear Bumper", "Number Plate Area"],
+        "Left Rear Corner": ["Left Tail Light", "Rear Bumper (Left Corner)", "Left Rear Fender Extension"],
+        "Left Rear Side": ["Left Quarter Panel", "Left Rear Wheel Arch"],
+        "Left Side": ["Left Front Door", "Left Rear Door", "Left Side Skirts", "Left B-Pillar"],
+        "Left Front Side": ["Left Front Fender", "Left Side Mirror", "Left A-Pillar"],
+        "Left Front Corner": ["Left Headlight", "Left Front Bumper Corner", "Left Fender (Front Portion)", "Left Fog Light (if equipped)"],
+        "Front": ["Front Bumper", "Front Grill", "Bonnet / Hood", "Front Windshield"],
+        "Roof": ["Roof Panel", "Roof Rails (if equipped)", "Sunroof / Moonroof (if equipped)"],
+        "Engine / Electrical": ["Engine components", "Electrical systems", "Battery", "Wiring"],
+        "Interior": ["Interior components", "Seats", "Dashboard", "Interior panels"],
+        "Steering / Suspension": ["Steering components", "Suspension parts", "Wheels", "Axles"],
+        "A/C": ["Air conditioning system", "HVAC components"],
+        "Frame / Floor": ["Vehicle frame", "Floor panels", "Structural components"]
+        }"""
+
+
+def create_damage_prompt():
+    # Damage-only instructions for images whose ONNX position is confident and is kept as is
+    return f"""
+        You are an expert automotive imaging analyst performing damage detection on vehicle images.
+        The images and their filenames are given in the BATCH section at the end.
+
+        # RULES
+        1. Your output must include ALL images provided, in the same order.
+        2. Detect visible damage (dents, scratches, cracks, broken/missing parts, deformation, misalignment, broken glass, etc.)
+        3. Map each damaged region to a valid POI, classify it as PRIMARY (main point of impact) or SECONDARY (minor or related damage), assess severity as MAJOR (structural or heavy) or MINOR (light/cosmetic) and describe it briefly.
+        4. Set "has_damage" to true if there is any damage in the image.
+
+        {POI_PROMPT_SECTIONS}
+
+        # STRICT JSON OUTPUT FORMAT
+        Return ONLY JSON in the following structure, with exactly one entry per image:
+        {{"damage_results": [{{"filename": "<string>", "has_damage": true | false, "damage_regions": [{{"poi": "Front", "severity": "major", "type": "primary", "description": "<short description>"}}]}}]}}
+    """
+
 
 def create_validation_prompt(custom_prompt=None):
+    # Static instructions only: per-batch images and predictions are appended after them
+    # (see build_batch_content) so the prompt stays a cacheable prefix across batches and claims.
     # Use custom prompt if provided, otherwise use default
     if custom_prompt:
         validation_prompt = custom_prompt
     else:
         validation_prompt = f"""
         You are an expert automotive imaging analyst validating ONNX model predictions for vehicle position classification and performing detailed damage detection.
-
-        # ONNX Model Prediction
-        images_placeholder
+        The images, their filenames and the ONNX model prediction for each are given in the BATCH section at the end.
 
         # VERY STRICT RULES
         1. Your output must include ALL images provided.
@@ -237,36 +493,10 @@ def create_validation_prompt(custom_prompt=None):
         5. Provide a short descriptive explanation for each damaged region.
         6. Add "has_damage": true to the output if there is any damage in the image.
 
-        # VALID POI OPTIONS
-        "Right Front Corner", "Right Front Side", "Right Side", "Right Rear Side",
-        "Right Rear Corner", "Rear", "Left Rear Corner", "Left Rear Side",
-        "Left Side", "Left Front Side", "Left Front Corner", "Front", "Roof",
-        "Engine / Electrical", "Interior", "Steering / Suspension", "A/C", "Frame / Floor"
-
-        # POI MAPPING DEFINITIONS
-        {{
-        "Right Front Corner": ["Right Headlight", "Right Front Bumper Corner", "Right Fender (Front Portion)", "Right Fog Light (if equipped)"],
-        "Right Front Side": ["Right Front Fender", "Right Side Mirror", "Right A-Pillar"],
-        "Right Side": ["Right Front Door", "Right Rear Door", "Right Side Skirts", "Right B-Pillar"],
-        "Right Rear Side": ["Right Quarter Panel", "Right Rear Wheel Arch"],
-        "Right Rear Corner": ["Right Tail Light", "Rear Bumper (Right Corner)", "Right Rear Fender Extension"],
-        "Rear": ["Trunk / Boot Lid", "Rear Windshield", "Rear Bumper", "Number Plate Area"],
-        "Left Rear Corner": ["Left Tail Light", "Rear Bumper (Left Corner)", "Left Rear Fender Extension"],
-        "Left Rear Side": ["Left Quarter Panel", "Left Rear Wheel Arch"],
-        "Left Side": ["Left Front Door", "Left Rear Door", "Left Side Skirts", "Left B-Pillar"],
-        "Left Front Side": ["Left Front Fender", "Left Side Mirror", "Left A-Pillar"],
-        "Left Front Corner": ["Left Headlight", "Left Front Bumper Corner", "Left Fender (Front Portion)", "Left Fog Light (if equipped)"],
-        "Front": ["Front Bumper", "Front Grill", "Bonnet / Hood", "Front Windshield"],
-        "Roof": ["Roof Panel", "Roof Rails (if equipped)", "Sunroof / Moonroof (if equipped)"],
-        "Engine / Electrical": ["Engine components", "Electrical systems", "Battery", "Wiring"],
-        "Interior": ["Interior components", "Seats", "Dashboard", "Interior panels"],
-        "Steering / Suspension": ["Steering components", "Suspension parts", "Wheels", "Axles"],
-        "A/C": ["Air conditioning system", "HVAC components"],
-        "Frame / Floor": ["Vehicle frame", "Floor panels", "Structural components"]
-        }}
+        {POI_PROMPT_SECTIONS}
 
         # TASK 3 — OUTPUT FORMAT
-        The "validation_results" array length must equal: input_images_length_placeholder
+        The "validation_results" array must contain exactly one entry per image in the BATCH section, in the same order.
 
         # STRICT JSON OUTPUT FORMAT
         Return ONLY JSON in the following structure:
@@ -304,47 +534,69 @@ def create_validation_prompt(custom_prompt=None):
     """
     return validation_prompt
 
-def validate_onnx_with_openai(onnx_results, custom_prompt=None):
-    # Create validation prompt
-    validation_prompt = create_validation_prompt(custom_prompt)
+def validation_kind(custom_prompt=None):
+    """Response kind for the full prompt: a custom prompt's answer is not held to the validation schema"""
+    return 'custom' if custom_prompt else 'validation'
 
-    image_filenames = []
-    image_inputs = []
-    valid_items = []
-    for item in onnx_results['items']:
-        if item.get('image_path'):
-            filename, image_input = encode_image_for_openai(item['image_path'])
-            if image_input:  # Only add if encoding was successful
-                image_filenames.append(item)
-                image_inputs.append(image_input)
-                valid_items.append(item)
-    
-    if not image_inputs:
-        print("No valid images found for OpenAI validation")
-        return []
-    
-    try:
-        print(f"Making single OpenAI API call for {len(image_inputs)} images")
-        openai_validation = get_pois_for_batch(
-            validation_prompt, 
-            image_filenames,
-            image_inputs
-        )
-        # Handle both single result and list of results
-        if isinstance(openai_validation, list):
-            return openai_validation
-        elif isinstance(openai_validation, dict) and 'error' not in openai_validation:
-            return [openai_validation]
-        else:
-            return []
-            
-    except Exception as e:
-        print(f"Error during OpenAI validation: {e}")
+def index_validation_results(openai_validation, known_filenames):
+    """
+    Index OpenAI validation results by filename in one pass.
+
+    When the model answers twice for the same file the more confident answer
+    is kept. Results naming a file that was never sent are returned
+    separately so they cannot be attached to the wrong image.
+
+    Returns:
+        tuple: (index, duplicate_filenames, unknown_results)
+    """
+    index = {}
+    duplicates = []
+    unknown = []
+    for validation_item in openai_validation:
+        if not isinstance(validation_item, dict):
+            continue
+        filename = validation_item.get('filename')
+        if filename not in known_filenames:
+            unknown.append(validation_item)
+            continue
+        if filename in index:
+            duplicates.append(filename)
+            if (validation_item.get('confidence_number') or 0) <= (index[filename].get('confidence_number') or 0):
+                continue
+        index[filename] = validation_item
+    return index, duplicates, unknown
+
+def damage_regions_of(validation_item):
+    """Damage regions reported for one image, in the all_damaged_regions format"""
+    if not validation_item.get("has_damage", False):
         return []
-    
+    return [
+        {
+            "filename": validation_item.get("filename"),
+            "poi": region.get("poi", "").strip(),
+            "severity": region.get("severity", "major"),
+            "type": region.get("type", "primary"),
+            "description": region.get("description", "")
+        }
+        for region in validation_item.get("damage_regions") or []
+    ]
+
+def damage_pois_from_regions(all_damage_regions):
+    """Unique, sorted primary POIs (point of impact) among the damaged regions"""
+    return sorted({
+        region["poi"] for region in all_damage_regions
+        if region["poi"] and region.get("type", "primary") == "primary"
+    })
 
 def combine_onnx_openai_results(onnx_results, openai_validation):
-    """Combine ONNX and OpenAI results with damage detection"""
+    """
+    Combine ONNX and OpenAI results with damage detection.
+
+    Validation results are indexed by filename once, and final_results,
+    all_damaged_regions and damage_pois are produced in a single pass over
+    the ONNX items. Duplicate, unknown and missing filenames in the OpenAI
+    response are reported under merge_report.
+    """
     combined_results = {
         # 'onnx_predictions': onnx_results,
         'openai_validation': openai_validation,
@@ -352,64 +604,57 @@ def combine_onnx_openai_results(onnx_results, openai_validation):
         'damage_pois': [],
         'all_damaged_regions': []  # All damaged regions for reference
     }
-    
-    # Check if OpenAI validation was successful
-    if openai_validation and isinstance(openai_validation, list):
-        updated_items = []
-        for item in onnx_results.get('items', []):
-            filename = item['filename']
-            
-            # Find corresponding validation result from the list
-            validation_item = next(
-                (v for v in openai_validation 
-                 if v.get('filename') == filename), 
-                None
-            )
-            if validation_item:
-                # Use OpenAI result if confidence is high, otherwise use ONNX
-                if validation_item.get('confidence_number') >= 0.6:
-                    item['labels'] = validation_item.get('validated_labels', item['labels'])
-                    item['reasons'] = f"ONNX: {item.get('reasons', '')} | OpenAI Validation: {validation_item.get('reasoning', '')}"
-                    item['source'] = 'OpenAI (high confidence)'
-                else:
-                    item['reasons'] = f"ONNX: {item.get('reasons', '')} | OpenAI Low Confidence: {validation_item.get('reasoning', '')}"
-                    item['source'] = 'ONNX (OpenAI low confidence)'
-                item['is_onnx_correct'] = validation_item.get('is_correct', False)
-                item['openai_confidence'] = validation_item.get('confidence', 'medium')
-            updated_items.append(item)
-        
-        # Convert to POI format
-        combined_results['final_results'] = convert_to_poi_format({'items': updated_items})
-    else:
-        combined_results['final_results'] = convert_to_poi_format(onnx_results)
-    
-    # Process damage detection results
-    if openai_validation and isinstance(openai_validation, list):
-        # Extract all damaged regions for reference
-        all_regions = []
-        for damage_item in openai_validation:
-            filename = damage_item.get("filename")
-            has_damage = damage_item.get("has_damage", False)
-            damage_regions = damage_item.get("damage_regions", [])
-            
-            if has_damage and damage_regions:
-                for region in damage_regions:
-                    all_regions.append({
-                        "filename": filename,
-                        "poi": region.get("poi", "").strip(),
-                        "severity": region.get("severity", "major"),
-                        "type": region.get("type", "primary"),
-                        "description": region.get("description", "")
-                    })
-        
-        combined_results['all_damaged_regions'] = all_regions
-        
-        # Only include primary POI (point of impact) in damage_pois
-        combined_results['damage_pois'] = convert_to_damage_poi_format(openai_validation)
-    else:
-        combined_results['damage_pois'] = []
-        combined_results['all_damaged_regions'] = []
-    
+    items = [item for item in onnx_results.get('items', []) if item]
+    if not openai_validation or not isinstance(openai_validation, list):
+        combined_results['final_results'] = convert_to_poi_format({'items': items})
+        return combined_results
+
+    validation_index, duplicates, unknown = index_validation_results(
+        openai_validation, {item['filename'] for item in items}
+    )
+    all_regions = []
+    missing = []
+    for item in items:
+        validation_item = validation_index.get(item['filename'])
+        if validation_item is None:
+            if 'validate_position' in item:
+                missing.append(item['filename'])
+            continue
+
+        if not item.get('validate_position', True):
+            # Image was only sent for damage detection; keep the confident ONNX labels
+            item['source'] = 'ONNX (high confidence)'
+        else:
+            # Use OpenAI result if confidence is high, otherwise use ONNX
+            if (validation_item.get('confidence_number') or 0) >= 0.6:
+                item['labels'] = validation_item.get('validated_labels', item['labels'])
+                item['reasons'] = f"ONNX: {item.get('reasons', '')} | OpenAI Validation: {validation_item.get('reasoning', '')}"
+                item['source'] = 'OpenAI (high confidence)'
+            else:
+                item['reasons'] = f"ONNX: {item.get('reasons', '')} | OpenAI Low Confidence: {validation_item.get('reasoning', '')}"
+                item['source'] = 'ONNX (OpenAI low confidence)'
+            item['is_onnx_correct'] = validation_item.get('is_correct', False)
+            item['openai_confidence'] = validation_item.get('confidence', 'medium')
+        if not validation_item.get('duplicate_of'):
+            # A near-duplicate's regions repeat its representative's
+            all_regions.extend(damage_regions_of(validation_item))
+
+    # Damage seen in results with an unrecognised filename still describes this claim
+    for validation_item in unknown:
+        all_regions.extend(damage_regions_of(validation_item))
+
+    # Convert to POI format
+    combined_results['final_results'] = convert_to_poi_format({'items': items})
+    combined_results['all_damaged_regions'] = all_regions
+    # Only include primary POI (point of impact) in damage_pois
+    combined_results['damage_pois'] = damage_pois_from_regions(all_regions)
+    if duplicates or unknown or missing:
+        print(f"OpenAI filename issues: duplicates={duplicates} unknown={[v.get('filename') for v in unknown]} missing={missing}")
+    combined_results['merge_report'] = {
+        'duplicate_filenames': sorted(set(duplicates)),
+        'unknown_filenames': [v.get('filename') for v in unknown],
+        'missing_filenames': missing,
+    }
     return combined_results
 
 
@@ -475,56 +720,10 @@ def convert_to_damage_poi_format(damage_results):
     if not isinstance(damage_results, list):
         return []
     
-    # First pass: collect all damage regions with their metadata
     all_damage_regions = []
     for damage_item in damage_results:
-        filename = damage_item.get("filename")
-        has_damage = damage_item.get("has_damage", False)
-        damage_regions = damage_item.get("damage_regions", [])
-        
-        if has_damage and damage_regions:
-            for region in damage_regions:
-                poi = region.get("poi", "").strip()
-                if poi:
-                    all_damage_regions.append({
-                        "filename": filename,
-                        "poi": poi,
-                        "severity": region.get("severity", "major"),
-                        "type": region.get("type", "primary"),
-                        "description": region.get("description", "")
-                    })
-    
-    if not all_damage_regions:
-        return []
-    
-    # Determine if there's any major primary damage
-    major_primary_damage = any(
-        r.get("severity") == "major" and r.get("type") == "primary"
-        for r in all_damage_regions
-    )
-    filtered_regions = []
-    for region in all_damage_regions:
-        region_type = region.get("type", "primary")
-        region_severity = region.get("severity", "major")
-        
-        if major_primary_damage:
-            # Only include primary regions when major primary damage exists
-            if region_type == "primary":
-                filtered_regions.append(region)
-        else:
-            # Include all primary regions if no major primary damage
-            if region_type == "primary":
-                filtered_regions.append(region)
-    
-    # Collect all unique POIs after mapping
-    unique_pois = set()
-    for region in filtered_regions:
-        poi_name = region["poi"]
-        # mapped_pois = map_poi_to_standard_format(poi_name)
-        unique_pois.update([poi_name])
-    
-    # Convert to sorted list for consistent output
-    return sorted(list(unique_pois))
+        all_damage_regions.extend(damage_regions_of(damage_item))
+    return damage_pois_from_regions(all_damage_regions)
 
 def convert_to_poi_format(results):
     """
@@ -571,60 +770,604 @@ def convert_to_poi_format(results):
     
     return final_results
 
-def classify_vehicle_images_onnx_with_openai(image_paths, validate_with_openai=True, detect_damage=True, custom_prompt=None, damage_detection_prompt=None):
+def download_image(obj, claim_id, cache_stats=None):
+    """Download one S3 image into the claim's scratch directory, reusing a warm copy of the same object"""
+    return get_scratch_cache().fetch(claim_id, obj['Key'], obj.get('ETag'), download_file_from_s3, cache_stats)
+
+def load_image(obj, claim_id, buffers=None, cache_stats=None):
     """
-    Classify multiple vehicle images using ONNX model and optionally validate with OpenAI and detect damage
-    
+    Fetch one S3 image once, as (image_path, source).
+
+    A warm scratch copy of the same object is used as is. Otherwise, while
+    `buffers` has room the object is read straight into memory: `source` is
+    its bytes, kept in `buffers` under the S3 key, and `image_path` is the
+    key. Without `buffers`, or once they are full, the image is downloaded
+    into the scratch cache and both values are the local path.
+    """
+    local_file = get_scratch_cache().lookup(claim_id, obj['Key'], obj.get('ETag'), cache_stats)
+    if local_file:
+        return local_file, local_file
+    if buffers is not None:
+        reserved = obj.get('Size') or 0
+        if buffers.reserve(reserved):
+            try:
+                data = read_file_from_s3(obj['Key'])
+            except Exception:
+                buffers.cancel(reserved)
+                raise
+            buffers.put(obj['Key'], data, reserved)
+            return obj['Key'], data
+    local_file = download_image(obj, claim_id, cache_stats)
+    return local_file, local_file
+
+def fetch_and_decode_image(obj, claim_id, size=ONNX_INPUT_SIZE, cache_stats=None, buffers=None):
+    """Fetch one S3 image and decode it into a CHW float32 array"""
+    image_path, source = load_image(obj, claim_id, buffers, cache_stats)
+    image = np.empty((3, size, size), dtype=np.float32)
+    preprocess_into_batch(source, size, image)
+    return image_path, source, image
+
+def validate_items_with_openai(validation_prompt, batch_items, batch_label, profile='damage_detection', batch_stats=None, buffers=None, kind='validation'):
+    """
+    Encode one batch of predicted items and submit its OpenAI validation
+    (kind 'damage': damage detection only). The batch is planned by payload
+    across the adaptive limiter's workers and each part is submitted to the
+    batch executor, so the parts run in parallel. Returns the parts' futures;
+    nothing here waits on them, so a worker never blocks on its own pool.
+    """
+    image_filenames = []
+    image_inputs = []
+    for item in batch_items:
+        source = buffers.get(item['image_path']) if buffers is not None else None
+        filename, image_input = encode_image_for_openai(item['image_path'], profile, source)
+        if buffers is not None:
+            # The encoded JPEG is all the request needs from here on
+            buffers.release(item['image_path'])
+        if image_input:
+            image_filenames.append(item)
+            image_inputs.append(image_input)
+    if not image_inputs:
+        return []
+    parts = plan_batches(
+        [image_input_cost(image_input) for image_input in image_inputs],
+        max_images=len(image_inputs),
+        workers=int(openai_limiter.limit),
+    )
+    executor = get_batch_executor()
+    return [
+        executor.submit(
+            process_single_batch,
+            validation_prompt,
+            [image_filenames[i] for i in indices],
+            [image_inputs[i] for i in indices],
+            batch_label if len(parts) == 1 else f"{batch_label}.{part_number}",
+            batch_stats=batch_stats,
+            kind=kind,
+        )
+        for part_number, indices in enumerate(parts, 1)
+    ]
+
+def estimate_text_tokens(text):
+    """Rough token count of English prompt text (about 4 characters per token)"""
+    return len(text or '') // 4
+
+def openai_savings(stats, full_prompt, damage_prompt, openai_batch_size):
+    """
+    Estimated OpenAI calls and prompt tokens avoided by routing: images kept
+    from OpenAI entirely, and damage-only batches sent with the short prompt
+    instead of the full validation prompt.
+    """
+    calls_avoided = (stats['openai_images_skipped'] + openai_batch_size - 1) // openai_batch_size
+    damage_batches = sum(1 for batch in stats['openai_batches'] if batch.get('kind') == 'damage')
+    prompt_tokens = estimate_text_tokens(full_prompt)
+    prompt_tokens_saved = calls_avoided * prompt_tokens
+    if damage_prompt is not None:
+        prompt_tokens_saved += damage_batches * (prompt_tokens - estimate_text_tokens(damage_prompt))
+    return {
+        'images_skipped': stats['openai_images_skipped'],
+        'calls_avoided': calls_avoided,
+        'damage_only_images': stats['damage_only_images'],
+        'damage_only_batches': damage_batches,
+        'prompt_tokens_saved': prompt_tokens_saved,
+    }
+
+def run_classification_pipeline(objects, openai_policy=None, custom_prompt=None, batch_size=None, size=ONNX_INPUT_SIZE, model_variant=None, prediction_cache=None, dedup=None, dedup_threshold=None, quality_action=None, quality_thresholds=None, claim_id=None, fetch_mode=None):
+    """
+    Overlapped download -> decode -> ONNX -> OpenAI pipeline.
+
+    Worker threads download and decode images and hand them to the calling
+    thread through a bounded queue; a full queue blocks the workers, so a
+    slow inference stage throttles downloads instead of filling memory. The
+    calling thread runs ONNX batches, and every time enough predictions are
+    ready an OpenAI validation batch is dispatched without waiting for the
+    rest of the claim.
+
+    When a prediction cache is given, images whose ETag already has a cached
+    prediction for this model are neither decoded nor inferred, and are only
+    downloaded if OpenAI needs to see them. Which images OpenAI sees is
+    decided per image by `openai_policy` (see build_openai_policy).
+
+    Near-duplicate photos (perceptual hash within `dedup_threshold` bits of
+    an earlier image) skip ONNX and OpenAI; they get their representative's
+    prediction and validation, marked with `duplicate_of`.
+
+    Every decoded photo is checked for blur, exposure and size first;
+    unusable ones are tagged with a `quality` report, or with
+    quality_action='skip' are left out of ONNX and OpenAI entirely.
+
+    With fetch_mode='memory' each photo is read from S3 once into memory and
+    the same bytes are decoded for ONNX and encoded for OpenAI; once
+    IMAGE_MEMORY_MAX_BYTES are held, further photos spill to the scratch
+    cache on /tmp, which is also used for warm copies already on disk.
+
     Args:
-        image_paths: list of image file paths
-        validate_with_openai: whether to validate results with OpenAI
-        detect_damage: whether to detect damage POIs from images
+        objects: S3 objects ({'Key', 'ETag'}) or plain keys of the claim's input images
+        openai_policy: OpenAI routing policy from build_openai_policy(), None to skip OpenAI
         custom_prompt: custom prompt template for OpenAI validation
-        damage_detection_prompt: custom prompt template for damage detection
-        
+        batch_size: images per ONNX session run (defaults to ONNX_BATCH_SIZE)
+        model_variant: position model variant, 'fp32' or 'int8'
+        prediction_cache: cache backend from prediction_cache.get_prediction_cache()
+        dedup: near-duplicate hash, 'dhash', 'phash' or 'none' (defaults to IMAGE_DEDUP)
+        dedup_threshold: Hamming distance for near-duplicates (defaults to DEDUP_HAMMING_THRESHOLD)
+        quality_action: 'tag', 'skip' or 'off' for unusable photos (defaults to QUALITY_ACTION)
+        quality_thresholds: overrides for image_quality.QUALITY_THRESHOLDS
+        claim_id: scratch cache namespace for the downloaded images
+        fetch_mode: 'memory' or 'disk' (defaults to IMAGE_FETCH_MODE)
+
     Returns:
-        dict: classification results with validation and damage detection
+        tuple: (onnx_results, openai_validation, stats)
     """
-    onnx_results = classify_vehicle_images_onnx(image_paths)
-    if not validate_with_openai and not detect_damage:
-        return {
-            'results': onnx_results,
-        }
-    
+    start_time = time.time()
+    objects = [{'Key': obj} if isinstance(obj, str) else obj for obj in objects]
+    total = len(objects)
+    items = [None] * total
     openai_validation = []
+    stats = {
+        'images': total,
+        'prediction_cache': {'hits': 0, 'misses': 0},
+        'openai_images': 0,
+        'position_validations': 0,
+        'damage_only_images': 0,
+        'openai_images_skipped': 0,
+        'openai_batches': [],
+    }
+    if total == 0:
+        return {'items': items}, openai_validation, stats
+
+    claim_id = claim_id or 'unscoped'
+    stats['scratch_cache'] = new_cache_stats()
+    fetch_mode = (fetch_mode or IMAGE_FETCH_MODE).lower()
+    buffers = ImageBuffers(IMAGE_MEMORY_MAX_BYTES) if fetch_mode == 'memory' else None
+
+    model_file = resolve_model_file(model_variant)
+    model_version = f"{model_file.rsplit('.onnx', 1)[0]}-{size}"
+    position_model = get_position_model(model_file)
+    model_io = onnx_model_io(position_model)
+    batch_size = model_io[2] or max(1, batch_size or ONNX_BATCH_SIZE)
+    batch = np.zeros((batch_size, 3, size, size), dtype=np.float32)
+
+    dedup = (dedup or IMAGE_DEDUP).lower()
+    duplicate_index = DuplicateIndex(DEDUP_HAMMING_THRESHOLD if dedup_threshold is None else dedup_threshold) if dedup != 'none' else None
+    duplicates = {}
+    quality_action = (quality_action or QUALITY_ACTION).lower()
+    quality_thresholds = resolve_thresholds(quality_thresholds)
+    quality_reports = {}
+
+    # A custom prompt defines its own answer, so every image sent goes with it
+    full_kind = validation_kind(custom_prompt)
+    prompts = {
+        full_kind: create_validation_prompt(custom_prompt) if openai_policy else None,
+        'damage': create_damage_prompt() if openai_policy and not custom_prompt else None,
+    }
+    openai_batch_size = default_batch_size(total)
+    total_openai_batches = (total + openai_batch_size - 1) // openai_batch_size
+    openai_futures = []
+    pending = {full_kind: [], 'damage': []}
+
+    decoded = queue.Queue(maxsize=max(1, PIPELINE_QUEUE_SIZE))
+    stop = threading.Event()
+
+    def analyse(entry, image):
+        if quality_action != 'off':
+            with Image.open(image_file(entry['source'])) as original:
+                entry['quality'] = assess_quality(image, original.size, quality_thresholds)
+        if duplicate_index is not None:
+            entry['hash'] = image_hash(image, dedup)
+
+    def produce(index, obj):
+        entry = {'index': index, 'image_path': obj['Key']}
+        try:
+            entry['cache_key'] = prediction_cache_key(obj.get('ETag'), model_version) if prediction_cache else None
+            cached = prediction_cache.get(entry['cache_key']) if entry['cache_key'] else None
+            if cached:
+                entry['cached'] = cached
+                _, confidence, margin = position_confidence(cached['scores'])
+                send, _ = openai_routing(is_low_confidence(confidence, margin, openai_policy), openai_policy)
+                if send:
+                    entry['image_path'], entry['source'] = load_image(obj, claim_id, buffers, stats['scratch_cache'])
+                    if duplicate_index is not None or quality_action != 'off':
+                        analyse(entry, np.asarray(decode_resized(entry['source'], size)))
+            else:
+                entry['image_path'], entry['source'], entry['image'] = fetch_and_decode_image(
+                    obj, claim_id, size, stats['scratch_cache'], buffers
+                )
+                analyse(entry, entry['image'])
+        except Exception as e:
+            entry['error'] = e
+        while not stop.is_set():
+            try:
+                decoded.put(entry, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def dispatch_validation(force=False):
+        for kind, pending_items in pending.items():
+            while pending_items and (force or len(pending_items) >= openai_batch_size):
+                batch_items = pending_items[:openai_batch_size]
+                del pending_items[:openai_batch_size]
+                batch_label = f"{len(openai_futures) + 1}/{total_openai_batches}"
+                openai_futures.append(openai_executor.submit(
+                    validate_items_with_openai, prompts[kind], batch_items,
+                    f"damage {batch_label}" if kind == 'damage' else batch_label,
+                    encoding_profile_for(openai_policy), stats['openai_batches'], buffers, kind
+                ))
+
+    def release(image_path):
+        if buffers is not None:
+            buffers.release(image_path)
+
+    def predicted(index):
+        if route_item_for_openai(items[index], openai_policy):
+            damage_only = not items[index]['validate_position'] and prompts['damage'] is not None
+            pending['damage' if damage_only else full_kind].append(items[index])
+            stats['openai_images'] += 1
+            stats['position_validations'] += int(items[index]['validate_position'])
+            stats['damage_only_images'] += int(damage_only)
+        else:
+            if openai_policy and items[index]:
+                stats['openai_images_skipped'] += 1
+            release(items[index]['image_path'])
+
+    def flush(filled):
+        results = predict_filled_batch(position_model, model_io, batch, filled, items, openai_policy)
+        succeeded = {index for index, _ in results}
+        for index, image_path in filled:
+            if index not in succeeded:
+                release(image_path)
+        for index, scores in results:
+            if cache_keys.get(index):
+                # Cache writes go through the worker pool so they never stall inference
+                download_executor.submit(prediction_cache.put, cache_keys[index], {
+                    'position_pred': position_labels[int(np.argmax(scores))],
+                    'scores': [float(score) for score in np.ravel(scores)],
+                    'model_version': model_version,
+                })
+            predicted(index)
+        if openai_policy:
+            dispatch_validation()
+
+    cache_keys = {}
+    download_executor = ThreadPoolExecutor(max_workers=max(1, PIPELINE_DOWNLOAD_WORKERS))
+    openai_executor = get_batch_executor()
+    get_scratch_cache().begin_claim(claim_id, stats['scratch_cache'])
+    try:
+        for index, obj in enumerate(objects):
+            download_executor.submit(produce, index, obj)
+
+        filled = []
+        received = 0
+        arrived = {}
+        next_index = 0
+        while received < total:
+            try:
+                entry = decoded.get_nowait()
+            except queue.Empty:
+                # Nothing decoded yet: run what we have rather than idle
+                if filled:
+                    flush(filled)
+                    filled = []
+                entry = decoded.get()
+            received += 1
+            if duplicate_index is None:
+                ready = [entry]
+            else:
+                # Clustering is greedy, so hashes are added in input order: the representative
+                # (and the verdict its duplicates inherit) is then the same on every run of a claim
+                arrived[entry['index']] = entry
+                ready = []
+                while next_index in arrived:
+                    ready.append(arrived.pop(next_index))
+                    next_index += 1
+            for entry in ready:
+                index = entry['index']
+                if 'error' in entry:
+                    release(entry['image_path'])
+                    items[index] = onnx_error_item(entry['image_path'], entry['error'])
+                    continue
+                if 'quality' in entry:
+                    quality_reports[index] = entry['quality']
+                    if quality_action == 'skip' and entry['quality']['issues']:
+                        release(entry['image_path'])
+                        items[index] = quality_skipped_item(entry['image_path'], entry['quality'])
+                        continue
+                if 'hash' in entry:
+                    representative = duplicate_index.add(index, entry['hash'])
+                    if representative is not None:
+                        release(entry['image_path'])
+                        duplicates[index] = (representative, entry['image_path'])
+                        continue
+                if 'cached' in entry:
+                    stats['prediction_cache']['hits'] += 1
+                    items[index] = onnx_result_item(
+                        entry['image_path'], entry['cached']['position_pred'], entry['cached']['scores'], openai_policy
+                    )
+                    if 'source' not in entry:
+                        items[index]['image_path'] = None
+                    predicted(index)
+                    continue
+                if entry['cache_key']:
+                    stats['prediction_cache']['misses'] += 1
+                    cache_keys[index] = entry['cache_key']
+                batch[len(filled)] = entry['image']
+                filled.append((index, entry['image_path']))
+                if len(filled) == batch_size:
+                    flush(filled)
+                    filled = []
+        if filled:
+            flush(filled)
+        print(f"ONNX stage finished for {total} images in {time.time() - start_time:.2f}s (cache {stats['prediction_cache']})")
+
+        if openai_policy:
+            dispatch_validation(force=True)
+            for future in openai_futures:
+                try:
+                    part_futures = future.result()
+                except Exception as e:
+                    print(f"Unhandled exception in batch future: {e}")
+                    continue
+                for part_future in part_futures:
+                    try:
+                        openai_validation.extend(part_future.result() or [])
+                    except Exception as e:
+                        print(f"Unhandled exception in batch future: {e}")
+    finally:
+        stop.set()
+        download_executor.shutdown(wait=True)
+        get_scratch_cache().end_claim(claim_id)
+    stats['scratch_cache']['bytes_cached'] = get_scratch_cache().total_bytes()
+    stats['image_fetch'] = dict(buffers.stats, mode='memory') if buffers is not None else {'mode': 'disk'}
+
+    # Fan the representatives' results out to their near-duplicates
+    member_filenames = {}
+    for index, (representative, path) in duplicates.items():
+        items[index] = fan_out_item(items[representative], path)
+        member_filenames.setdefault(items[representative]['filename'], []).append(items[index]['filename'])
+    openai_validation.extend(fan_out_validation(openai_validation, member_filenames))
+    # Only photos with issues carry their quality report
+    for index, report in quality_reports.items():
+        if report['issues']:
+            items[index]['quality'] = report
+        else:
+            items[index].pop('quality', None)
+    if quality_action != 'off':
+        stats['quality'] = summarize_quality(
+            {os.path.basename(objects[index]['Key']): report for index, report in quality_reports.items()}, quality_action
+        )
+    if duplicate_index is not None:
+        stats['dedup'] = {
+            'method': dedup,
+            'threshold': duplicate_index.threshold,
+            'clusters': len(duplicate_index.representatives),
+            'duplicates': len(duplicates),
+            'ratio': round(len(duplicates) / total, 3),
+        }
+
+    if openai_policy:
+        stats['openai_savings'] = openai_savings(stats, prompts[full_kind], prompts['damage'], openai_batch_size)
+    stats['hedging'] = summarize_hedges(stats['openai_batches'])
+    stats['openai_usage'] = summarize_usage(stats['openai_batches'])
+    stats['seconds'] = round(time.time() - start_time, 3)
+    print(f"Pipeline finished for {total} images in {time.time() - start_time:.2f}s")
+    return {'items': items}, openai_validation, stats
+
+
+def event_openai_policy(event):
+    """OpenAI routing policy requested by a handler event"""
+    return build_openai_policy(
+        event.get('validate_with_openai', True),
+        event.get('detect_damage', True),  # Enable damage detection by default
+        policy=event.get('position_validation_policy'),  # 'all' or 'low_confidence'
+        confidence_threshold=event.get('confidence_threshold'),
+        margin_threshold=event.get('margin_threshold'),
+    )
+
+def run_event_pipeline(event, objects):
+    """Run the classification pipeline over `objects` with the options of a handler event"""
+    return run_classification_pipeline(
+        objects,
+        openai_policy=event_openai_policy(event),
+        custom_prompt=event.get('custom_prompt', None),
+        model_variant=event.get('model_variant', None),  # 'fp32' or 'int8', defaults to ONNX_MODEL_VARIANT
+        prediction_cache=None if event.get('skip_prediction_cache') else get_prediction_cache(BUCKET_NAME, s3),
+        dedup=event.get('dedup'),  # 'dhash', 'phash' or 'none'
+        dedup_threshold=event.get('dedup_threshold'),
+        quality_action=event.get('quality_action'),  # 'tag', 'skip' or 'off'
+        quality_thresholds=event.get('quality_thresholds'),
+        claim_id=event.get('claim_id'),
+        fetch_mode=event.get('image_fetch_mode'),  # 'memory' or 'disk'
+    )
+
+def model_init_stats(model_variant=None):
+    model_file = resolve_model_file(model_variant)
+    return dict(MODEL_INIT_STATS.get(model_file, {}), model_file=model_file)
+
+def process_shard(event):
+    """Shard worker: classify one shard of a claim and return the raw results for the coordinator to merge"""
+    shard = event['shard']
+    print(f"Processing shard {shard['index'] + 1}/{shard['count']} ({len(shard['objects'])} images)")
+    onnx_results, openai_validation, pipeline_stats = run_event_pipeline(event, shard['objects'])
+    return {
+        'shard': shard['index'],
+        'onnx_results': onnx_results,
+        'openai_validation': openai_validation,
+        'pipeline': pipeline_stats,
+        'model_init': model_init_stats(event.get('model_variant')),
+    }
+
+def run_fan_out_pipeline(event, objects):
+    """
+    Map-reduce over a large claim: split the images into contiguous shards,
+    classify every shard on its own worker (see fan_out.run_shards) and
+    merge the workers' ONNX items, OpenAI validations and stats in shard
+    order, ready for combine_onnx_openai_results.
+
+    The shard count grows with the claim, so wall time stays close to that
+    of a single shard. Near-duplicates are only detected within a shard.
+    Shards whose worker failed are rerun together in this process.
+
+    Returns:
+        tuple: (onnx_results, openai_validation, stats, model_init)
+    """
+    start_time = time.time()
+    shards = plan_shards(objects, event.get('shard_size'))
+    shard_events = [
+        dict(event, fan_out=False, shard={'index': index, 'count': len(shards), 'objects': shard})
+        for index, shard in enumerate(shards)
+    ]
+    print(f"Fanning out {len(objects)} images to {len(shards)} shards")
+    shard_results, errors = run_shards(shard_events, process_shard, event.get('fan_out_invoker'))
+
+    failed = [index for index, error in enumerate(errors) if error is not None]
+    if failed:
+        print(f"Re-running {len(failed)} failed shard(s) in the coordinator")
+        rerun = process_shard(dict(event, fan_out=False, shard={
+            'index': failed[0], 'count': len(shards), 'objects': [obj for index in failed for obj in shards[index]],
+        }))
+        rerun_items = rerun['onnx_results']['items']
+        for position, index in enumerate(failed):
+            # Items come back in object order; give each failed shard its own slice
+            shard_results[index] = {
+                'onnx_results': {'items': rerun_items[:len(shards[index])]},
+                'openai_validation': rerun['openai_validation'] if position == 0 else [],
+                'pipeline': rerun['pipeline'] if position == 0 else {},
+                'model_init': rerun['model_init'],
+            }
+            rerun_items = rerun_items[len(shards[index]):]
+
+    onnx_results, openai_validation, stats = merge_shard_results(shard_results)
+    # Ratios and percentiles do not add up across shards; recompute them from the merged values
+    stats['hedging'] = summarize_hedges(stats['openai_batches'])
+    stats['openai_usage'] = summarize_usage(stats['openai_batches'])
+    if 'dedup' in stats:
+        stats['dedup']['ratio'] = round(stats['dedup']['duplicates'] / len(objects), 3)
+    stats['fan_out'] = {
+        'shards': len(shards),
+        'rerun_shards': len(failed),
+        'shard_seconds': [result['pipeline'].get('seconds') for result in shard_results],
+    }
+    stats['seconds'] = round(time.time() - start_time, 3)
+    print(f"Fan-out finished for {len(objects)} images in {stats['seconds']:.2f}s")
+    return onnx_results, openai_validation, stats, shard_results[0]['model_init']
+
+def process_claim(event):
+    """List one claim's images, classify them (fanned out when the claim is large) and combine the ONNX and OpenAI results"""
+    claim_id = event.get('claim_id')
+    openai_policy = event_openai_policy(event)
     
-    # Perform OpenAI validation if requested
-    if validate_with_openai:
-        openai_validation = validate_onnx_with_openai(onnx_results, custom_prompt)
-    
-    combined_results = combine_onnx_openai_results(onnx_results, openai_validation)
-    
-    return combined_results
+    objects = [obj for obj in list_s3_objects(f"claims/{claim_id}/est/InputImages/") if not obj['Key'].endswith("/")]
+    print(f"Found {len(objects)} images in S3 for claim {claim_id}")
+    if should_fan_out(len(objects), event.get('fan_out')):
+        onnx_results, openai_validation, pipeline_stats, model_init = run_fan_out_pipeline(event, objects)
+    else:
+        onnx_results, openai_validation, pipeline_stats = run_event_pipeline(event, objects)
+        model_init = model_init_stats(event.get('model_variant'))
+    if not openai_policy:
+        results = {'results': onnx_results}
+    else:
+        results = combine_onnx_openai_results(onnx_results, openai_validation)
+    results['model_init'] = model_init
+    results['pipeline'] = pipeline_stats
+    emit_pipeline_metrics(pipeline_stats, claim_id)
+    return results
 
+def write_claim_results(claim_id, results):
+    """Store one claim's results as JSON in S3 and return the key"""
+    key = CLAIM_RESULTS_KEY.format(claim_id=claim_id)
+    s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=json.dumps(results).encode('utf-8'), ContentType='application/json')
+    return key
+
+def process_claim_batch(event):
+    """
+    Multi-claim mode for reprocessing: classify every claim in `claim_ids` in this invocation.
+
+    Claims run `claim_concurrency` (CLAIM_BATCH_CONCURRENCY) at a time, all
+    on the container's one ONNX session and OpenAI HTTP pool, so the model
+    is loaded once and one claim's ONNX batches run while another waits on
+    S3 or OpenAI. The image memory budget (IMAGE_MEMORY_MAX_BYTES) applies
+    to each running claim. A failing claim is reported under its own ID
+    and the others carry on.
+
+    With write_results each claim's result is written to CLAIM_RESULTS_KEY
+    and only the key is returned, keeping large batches under Lambda's 6MB
+    response limit.
+    """
+    claim_ids = list(dict.fromkeys(event['claim_ids']))
+    write_results = event.get('write_results', False)
+    claim_event = {name: value for name, value in event.items() if name not in ('claim_ids', 'write_results', 'claim_concurrency')}
+    concurrency = max(1, min(int(event.get('claim_concurrency') or CLAIM_BATCH_CONCURRENCY), len(claim_ids)))
+    start_time = time.time()
+    print(f"Processing {len(claim_ids)} claims, {concurrency} at a time")
+
+    def run(claim_id):
+        claim_start = time.time()
+        try:
+            results = process_claim(dict(claim_event, claim_id=claim_id))
+            outcome = {'status': 'ok'}
+            if write_results:
+                outcome['results_key'] = write_claim_results(claim_id, results)
+            else:
+                outcome['results'] = results
+        except Exception as e:
+            print(f"Claim {claim_id} failed: {e}")
+            outcome = {'status': 'error', 'error': str(e)}
+        outcome['seconds'] = round(time.time() - claim_start, 3)
+        return outcome
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        claims = dict(zip(claim_ids, executor.map(run, claim_ids)))
+    failed_claims = [claim_id for claim_id, outcome in claims.items() if outcome['status'] != 'ok']
+    summary = {
+        'claims': len(claim_ids),
+        'succeeded': len(claim_ids) - len(failed_claims),
+        'failed': len(failed_claims),
+        'failed_claims': failed_claims,
+        'concurrency': concurrency,
+        'seconds': round(time.time() - start_time, 3),
+    }
+    print(f"Claim batch finished: {summary['succeeded']}/{summary['claims']} claims in {summary['seconds']:.2f}s")
+    emit_claim_batch_metrics(summary)
+    return {'claims': claims, 'batch': summary}
 
 def lambda_handler(event, context):
     """
     AWS Lambda handler function
     
     Args:
-        event: Lambda event containing claim_id, validate_with_openai, detect_damage, and optionally custom_prompt, damage_detection_prompt
+        event: Lambda event containing claim_id, validate_with_openai, detect_damage, and optionally custom_prompt, damage_detection_prompt, model_variant,
+            position_validation_policy ('all' | 'low_confidence'), confidence_threshold, margin_threshold,
+            dedup ('dhash' | 'phash' | 'none'), dedup_threshold, quality_action ('tag' | 'skip' | 'off'), quality_thresholds,
+            image_fetch_mode ('memory' | 'disk'), fan_out (defaults to claims over FAN_OUT_MIN_IMAGES), shard_size,
+            fan_out_invoker ('lambda' | 'local'). Events with a `shard` are shard worker invocations from a fan-out coordinator.
+            Events with `claim_ids` instead of claim_id process several claims (see process_claim_batch), with
+            optional write_results and claim_concurrency.
         context: Lambda context
         
     Returns:
-        dict: Lambda response with classification results and damage POIs
+        dict: Lambda response with classification results and damage POIs, or per-claim outcomes for `claim_ids`
     """
-    claim_id = event.get('claim_id')
-    validate_with_openai = event.get('validate_with_openai', True)
-    detect_damage = event.get('detect_damage', True)  # Enable damage detection by default
-    custom_prompt = event.get('custom_prompt', None)
-    damage_detection_prompt = event.get('damage_detection_prompt', None)
-    
-    image_paths = get_and_download_input_images_parallel(claim_id)
-    results = classify_vehicle_images_onnx_with_openai(
-        image_paths, 
-        validate_with_openai=validate_with_openai,
-        detect_damage=detect_damage,
-        custom_prompt=custom_prompt,
-        damage_detection_prompt=damage_detection_prompt
-    )
-    return results
\ No newline at end of file
+    if event.get('shard'):
+        return process_shard(event)
+    if event.get('claim_ids'):
+        return process_claim_batch(event)
+    return process_claim(event)
@@ -0,0 +1,78 @@
+import json
+import os
+import time
+
+# CloudWatch Embedded Metric Format: JSON log lines that CloudWatch turns into metrics
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE") or "POICalculation"
+METRICS_ENABLED = (os.getenv("METRICS_ENABLED") or "true").lower() != "false"
+FUNCTION_NAME = os.getenv("AWS_LAMBDA_FUNCTION_NAME") or "poi-calculation"
+
+BATCH_METRICS = {
+    'images': 'Count',
+    'attempts': 'Count',
+    'hedges': 'Count',
+    'repaired_images': 'Count',
+    'missing_images': 'Count',
+    'request_bytes': 'Bytes',
+    'latency_seconds': 'Seconds',
+    'input_tokens': 'Count',
+    'cached_tokens': 'Count',
+    'output_tokens': 'Count',
+    'cost_usd': 'None',
+}
+CLAIM_METRICS = {
+    'images': 'Count',
+    'seconds': 'Seconds',
+}
+CLAIM_BATCH_METRICS = {
+    'claims': 'Count',
+    'succeeded': 'Count',
+    'failed': 'Count',
+    'seconds': 'Seconds',
+}
+
+
+def emit_metrics(values, units, properties=None):
+    """Print one EMF record with a metric for every name in `values` that has a unit in `units`"""
+    if not METRICS_ENABLED:
+        return
+    metrics = {name: value for name, value in values.items() if name in units and isinstance(value, (int, float))}
+    if not metrics:
+        return
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["FunctionName"]],
+                "Metrics": [{"Name": name, "Unit": units[name]} for name in metrics],
+            }],
+        },
+        "FunctionName": FUNCTION_NAME,
+    }
+    record.update(properties or {})
+    record.update(metrics)
+    print(json.dumps(record))
+
+
+def emit_pipeline_metrics(pipeline_stats, claim_id=None):
+    """One EMF record per OpenAI batch plus one for the claim's totals"""
+    for batch in pipeline_stats.get('openai_batches', []):
+        emit_metrics(batch, BATCH_METRICS, {'claim_id': claim_id, 'batch': batch.get('batch'), 'status': batch.get('status')})
+    usage = pipeline_stats.get('openai_usage') or {}
+    totals = {f"total_{name}": value for name, value in usage.items()}
+    totals['total_hedges'] = (pipeline_stats.get('hedging') or {}).get('sent')
+    totals.update({f"claim_{name}": pipeline_stats.get(name) for name in CLAIM_METRICS})
+    units = {f"total_{name}": unit for name, unit in BATCH_METRICS.items() if name != 'latency_seconds'}
+    units.update({'total_batches': 'Count', 'total_failed_batches': 'Count', 'total_cached_ratio': 'None'})
+    units.update({f"claim_{name}": unit for name, unit in CLAIM_METRICS.items()})
+    emit_metrics(totals, units, {'claim_id': claim_id})
+
+
+def emit_claim_batch_metrics(summary):
+    """One EMF record for a multi-claim invocation"""
+    emit_metrics(
+        {f"batch_{name}": summary.get(name) for name in CLAIM_BATCH_METRICS},
+        {f"batch_{name}": unit for name, unit in CLAIM_BATCH_METRICS.items()},
+        {'failed_claims': summary.get('failed_claims')},
+    )
@@ -0,0 +1,110 @@
+"""
+Accuracy / latency report for the fp32 and int8 position models.
+
+    python model_variant_report.py --labelled ./held_out [--variants fp32 int8]
+
+`--labelled` uses the same layout as parity_check_preprocessing.py: one
+sub-folder per position label. For every variant the report shows macro F1,
+accuracy, per-image inference latency and session load time, all measured on
+a session built like the serving one (ENABLE_ALL, nothing serialized). The
+one-off cost of writing the optimized model on a cold start is reported
+separately as "save s".
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import onnxruntime as rt
+
+from lambda_function import (
+    ONNX_INPUT_SIZE,
+    ONNX_MODEL_VARIANTS,
+    build_session_options,
+    fetch_model_file,
+    onnx_model_io,
+    position_labels,
+    preprocess_into_batch,
+    run_onnx_batch,
+)
+
+
+def macro_f1(labels, predictions):
+    scores = []
+    for label in sorted(set(labels)):
+        tp = sum(1 for y, p in zip(labels, predictions) if y == label and p == label)
+        fp = sum(1 for y, p in zip(labels, predictions) if y != label and p == label)
+        fn = sum(1 for y, p in zip(labels, predictions) if y == label and p != label)
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        scores.append(2 * precision * recall / (precision + recall) if precision + recall else 0.0)
+    return statistics.mean(scores)
+
+
+def load_samples(labelled_dir):
+    paths, labels = [], []
+    for label in sorted(os.listdir(labelled_dir)):
+        folder = os.path.join(labelled_dir, label)
+        if label in position_labels and os.path.isdir(folder):
+            for name in sorted(os.listdir(folder)):
+                paths.append(os.path.join(folder, name))
+                labels.append(label)
+    return paths, labels
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--labelled", required=True)
+    parser.add_argument("--variants", nargs="+", default=list(ONNX_MODEL_VARIANTS))
+    args = parser.parse_args()
+
+    paths, labels = load_samples(args.labelled)
+    inputs, kept_labels = [], []
+    for path, label in zip(paths, labels):
+        image = np.empty((3, ONNX_INPUT_SIZE, ONNX_INPUT_SIZE), dtype=np.float32)
+        try:
+            preprocess_into_batch(path, ONNX_INPUT_SIZE, image)
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        inputs.append(image)
+        kept_labels.append(label)
+    if not inputs:
+        raise SystemExit(f"No labelled images found under {args.labelled}")
+
+    print(f"{len(inputs)} held-out images, {os.cpu_count()} vCPUs")
+    print(f"{'variant':<8} {'size MB':>8} {'save s':>7} {'load s':>7} {'F1':>6} {'acc':>6} {'p50 ms':>7} {'p95 ms':>7}")
+    for variant in args.variants:
+        model_path = fetch_model_file(ONNX_MODEL_VARIANTS[variant])
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            rt.InferenceSession(model_path, sess_options=build_session_options(os.path.join(directory, f"{variant}.onnx")))
+            save_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        session = rt.InferenceSession(model_path, sess_options=build_session_options())
+        load_seconds = time.perf_counter() - start
+        model_io = onnx_model_io(session)
+        batch = np.zeros((model_io[2] or 1, 3, ONNX_INPUT_SIZE, ONNX_INPUT_SIZE), dtype=np.float32)
+
+        predictions, latencies = [], []
+        run_onnx_batch(session, model_io, batch, 1)  # warm-up
+        for image in inputs:
+            batch[0] = image
+            start = time.perf_counter()
+            scores = run_onnx_batch(session, model_io, batch, 1)[0]
+            latencies.append((time.perf_counter() - start) * 1000)
+            predictions.append(position_labels[int(np.argmax(scores))])
+
+        accuracy = sum(p == y for p, y in zip(predictions, kept_labels)) / len(kept_labels)
+        latencies.sort()
+        print(
+            f"{variant:<8} {os.path.getsize(model_path) / 1e6:>8.1f} {save_seconds:>7.2f} {load_seconds:>7.2f} "
+            f"{macro_f1(kept_labels, predictions):>6.3f} {accuracy:>6.3f} "
+            f"{statistics.median(latencies):>7.1f} {latencies[int(0.95 * (len(latencies) - 1))]:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,128 +1,739 @@
+import hashlib
 import json
 import os
-from math import ceil
+import random
+import re
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
 
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 import time
-def update_openai_results_with_original_filename(ai_responses, images):
-    total_images = len(images)
-    print(total_images, len(ai_responses), 'ai+responses + total images')
-    for index, ai_response in enumerate(ai_responses):
-        if index< total_images:
-            ai_response['filename'] = images[index].get('filename',f'image_{index}')
-    return ai_responses
 
+from batch_planner import image_input_cost, plan_batches
 
 
-# --- Ask GPT to find POIs for a single batch ---
-def get_pois_for_batch(
-        prompt_original,
-        image_filenames,
-        image_inputs,
-        batch_size=5
-):
-    start_time = time.time()
-    if len(image_inputs)>50:
-        batch_size = 10
+OPENAI_PARALLEL_WORKERS = int(os.getenv("OPENAI_PARALLEL_WORKERS", "10"))
+# Upper bound the adaptive limiter may grow to; also the size of the worker pools
+OPENAI_MAX_CONCURRENCY = max(OPENAI_PARALLEL_WORKERS, int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")))
+OPENAI_BASE_URL = (os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
+# USD per million tokens, defaults are gpt-5 list prices
+OPENAI_PRICE_INPUT_PER_M = float(os.getenv("OPENAI_PRICE_INPUT_PER_M", "1.25"))
+OPENAI_PRICE_CACHED_INPUT_PER_M = float(os.getenv("OPENAI_PRICE_CACHED_INPUT_PER_M", "0.125"))
+OPENAI_PRICE_OUTPUT_PER_M = float(os.getenv("OPENAI_PRICE_OUTPUT_PER_M", "10"))
+OPENAI_REQUEST_TIMEOUT = float(os.getenv("OPENAI_REQUEST_TIMEOUT", "300"))
+# Total time a batch may spend retrying before it is given up
+OPENAI_RETRY_BUDGET_SECONDS = float(os.getenv("OPENAI_RETRY_BUDGET_SECONDS", "180"))
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "5"))
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# Schema-constrained output (json_schema) instead of free-form JSON; "false" falls back to json_object
+OPENAI_STRUCTURED_OUTPUTS = (os.getenv("OPENAI_STRUCTURED_OUTPUTS") or "true").lower() != "false"
+# Follow-up requests for images missing or invalid in a batch answer
+OPENAI_REPAIR_ROUNDS = int(os.getenv("OPENAI_REPAIR_ROUNDS", "1"))
+# Hedging: resend a request still running after this percentile of recent latencies (0 disables)
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "0"))
+# Hedges allowed as a fraction of all requests sent
+OPENAI_HEDGE_BUDGET = float(os.getenv("OPENAI_HEDGE_BUDGET", "0.1"))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "10"))
+OPENAI_HEDGE_MIN_DELAY = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "2"))
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on in-flight OpenAI requests, shared by every batch in the container.
+
+    Each success grows the limit by roughly one request per round trip; a
+    rate limit or server error halves it, and a Retry-After (or exhausted
+    rate-limit window) pauses new requests until it has passed. Latency is
+    not a signal: it grows with the images and tokens in a batch, not only
+    with load, so only errors back the limit off.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=OPENAI_MAX_CONCURRENCY):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.blocked_until - time.time()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout=wait if wait > 0 else 1.0)
+
+    def release(self, outcome, retry_after=None):
+        """
+        Record a finished request: outcome is 'success', 'rate_limited' or
+        'error'; 'cancelled' frees a slot taken for a request that never ran
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if outcome == 'success':
+                self.limit = min(self.maximum, self.limit + 1.0 / max(self.limit, 1.0))
+            elif outcome != 'cancelled':
+                self.limit = max(self.minimum, self.limit * 0.5)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.time() + retry_after)
+            self.condition.notify_all()
+
+    def try_acquire(self):
+        """Take a slot only if one is free right now"""
+        with self.condition:
+            if self.blocked_until <= time.time() and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def pause(self, seconds):
+        with self.condition:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+
+openai_limiter = AdaptiveConcurrencyLimiter(OPENAI_PARALLEL_WORKERS)
+
+
+class HedgePolicy:
+    """
+    Decides when a slow request gets a duplicate. The hedge delay is the
+    configured percentile of recent successful latencies (never below
+    `min_delay`), and hedges are capped at `budget` times the requests sent.
+    """
+
+    def __init__(self, percentile=OPENAI_HEDGE_PERCENTILE, budget=OPENAI_HEDGE_BUDGET,
+                 min_samples=OPENAI_HEDGE_MIN_SAMPLES, min_delay=OPENAI_HEDGE_MIN_DELAY):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = deque(maxlen=200)
+        self.requests = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def delay(self):
+        """Seconds to wait before hedging a new request, or None when hedging is off or unwarranted"""
+        with self.lock:
+            self.requests += 1
+            if self.percentile <= 0 or len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    def can_hedge(self):
+        with self.lock:
+            return self.hedges + 1 <= self.budget * self.requests
+
+    def hedged(self):
+        with self.lock:
+            self.hedges += 1
+
+
+hedge_policy = HedgePolicy()
+
+
+def parse_duration(value):
+    """Parse OpenAI reset durations ("1s", "6m0s", "20ms", "1h2m3.5s") or plain seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+
+def retry_after_seconds(headers):
+    """Server-requested wait from Retry-After / retry-after-ms or the rate-limit reset headers"""
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        seconds = parse_duration(retry_after)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    resets = []
+    for kind in ("requests", "tokens"):
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+            resets.append(parse_duration(headers.get(f"x-ratelimit-reset-{kind}")))
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+def backoff_seconds(attempt, base=1.0, cap=30.0):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def release_for_response(response, latency):
+    """Feed one finished request back into the limiter and hedge latencies"""
+    retry_after = retry_after_seconds(response.headers)
+    if response.status_code == 200:
+        openai_limiter.release('success')
+        hedge_policy.record(latency)
+        if retry_after:
+            # Window exhausted: hold new requests until it resets
+            openai_limiter.pause(retry_after)
+    elif response.status_code == 429 and '"insufficient_quota"' in response.text:
+        openai_limiter.release('error')
+    elif response.status_code not in RETRYABLE_STATUS_CODES:
+        openai_limiter.release('error')
+    else:
+        openai_limiter.release('rate_limited' if response.status_code == 429 else 'error', retry_after)
+
+
+def limited_post(url, headers, request_body, acquired=False):
+    """One POST holding a limiter slot for its duration"""
+    if not acquired:
+        openai_limiter.acquire()
+    request_start = time.time()
+    released = False
+    try:
+        response = get_openai_session().post(url, headers=headers, data=request_body, timeout=OPENAI_REQUEST_TIMEOUT)
+        released = True
+        release_for_response(response, time.time() - request_start)
+        return response
+    finally:
+        # Whatever went wrong, the slot must go back or the limiter shrinks for good
+        if not released:
+            openai_limiter.release('error')
+
+
+def _discard_loser(future):
+    # The losing duplicate finished after the winner was taken: free its connection
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def hedged_post(url, headers, request_body, batch_label, record):
+    """
+    POST once; if no answer arrives within the hedge delay and the budget and
+    limiter allow, send a duplicate and return whichever succeeds first. A
+    loser still queued is cancelled; one already on the wire is left to finish
+    and its response discarded.
+    """
+    delay = hedge_policy.delay()
+    if delay is None:
+        return limited_post(url, headers, request_body)
+
+    executor = get_hedge_executor()
+    primary = executor.submit(limited_post, url, headers, request_body)
+    done, _ = wait([primary], timeout=delay)
+    if done or not hedge_policy.can_hedge() or not openai_limiter.try_acquire():
+        return primary.result()
+
+    hedge_policy.hedged()
+    record['hedges'] = record.get('hedges', 0) + 1
+    print(f"Batch {batch_label} still running after {delay:.1f}s, sending a hedged request")
+    hedge = executor.submit(limited_post, url, headers, request_body, True)
+
+    pending = {primary, hedge}
+    winner = None
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winner = next((f for f in done if f.exception() is None and f.result().status_code == 200), None)
+    if winner is None:
+        return primary.result()
+    for future in pending:
+        if future.cancel():
+            if future is hedge:
+                # The hedge's slot was taken up front and limited_post never ran to free it
+                openai_limiter.release('cancelled')
+            record['hedges_cancelled'] = record.get('hedges_cancelled', 0) + 1
+        else:
+            future.add_done_callback(_discard_loser)
+    if winner is hedge:
+        record['hedges_won'] = record.get('hedges_won', 0) + 1
+    return winner.result()
+
+
+def post_with_retries(url, request_body, headers, batch_label, record):
+    """
+    POST to OpenAI under the adaptive limiter, retrying rate limits, server
+    errors and network failures with jittered backoff within the retry budget.
+    Returns the final response, or None if every attempt failed.
+    """
+    deadline = time.time() + OPENAI_RETRY_BUDGET_SECONDS
+    response = None
+    for attempt in range(OPENAI_MAX_ATTEMPTS):
+        record['attempts'] += 1
+        retry_after = None
+        try:
+            response = hedged_post(url, headers, request_body, batch_label, record)
+        except requests.RequestException as e:
+            print(f"Batch {batch_label} attempt {attempt + 1} request error: {e}")
+            response = None
+        else:
+            record['status'] = response.status_code
+            if response.status_code == 200:
+                return response
+            if response.status_code == 429 and '"insufficient_quota"' in response.text:
+                print(f"Batch {batch_label} failed: quota exhausted")
+                return response
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+            retry_after = retry_after_seconds(response.headers)
+            print(f"Batch {batch_label} attempt {attempt + 1} got {response.status_code}, limit now {openai_limiter.limit:.1f}")
+
+        wait_seconds = max(retry_after or 0.0, backoff_seconds(attempt))
+        if attempt + 1 >= OPENAI_MAX_ATTEMPTS or time.time() + wait_seconds > deadline:
+            break
+        time.sleep(wait_seconds)
+    print(f"Batch {batch_label} gave up after {record['attempts']} attempt(s)")
+    return response
+
+
+def summarize_hedges(batch_stats):
+    """Hedged requests sent, won by the duplicate and cancelled before sending, over the given batch records"""
+    return {
+        'sent': sum(record.get('hedges', 0) for record in batch_stats),
+        'won': sum(record.get('hedges_won', 0) for record in batch_stats),
+        'cancelled': sum(record.get('hedges_cancelled', 0) for record in batch_stats),
+    }
+
+
+def default_batch_size(total_images, batch_size=5):
+    """Images per OpenAI request for a claim of `total_images` images"""
+    if total_images > 50:
+        return 10
+    return batch_size
+
+
+def openai_headers():
     # Get API key
     api_key = os.getenv("OPENAI_API_KEY") or ""  # <-- replace with env var only in prod
-
-    headers = {
+    return {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
 
-    total_images = len(image_inputs)
-    total_batches = ceil(total_images / batch_size)
-    all_results = []
 
-    print(f"Total images: {total_images}, Processing in {total_batches} batch(es)...")
+# Pooled keep-alive session and batch executor, created once per container and
+# reused across warm invocations so batches skip the TCP+TLS handshake
+_openai_session = None
+_batch_executor = None
+_hedge_executor = None
+_openai_pool_lock = threading.Lock()
 
-    def process_single_batch(batch_index):
-        start = batch_index * batch_size
-        end = min(start + batch_size, total_images)
 
-        batch_filenames_local = image_filenames[start:end]
-        batch_inputs_local = image_inputs[start:end]
+def get_openai_session():
+    global _openai_session
+    if _openai_session is None:
+        with _openai_pool_lock:
+            if _openai_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OPENAI_MAX_CONCURRENCY, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(openai_headers())
+                _openai_session = session
+    return _openai_session
 
-        print(f"🟦 Processing batch {batch_index + 1}/{total_batches} ({len(batch_inputs_local)} images)")
 
-        image_info_local = []
-        for i, item in enumerate(batch_filenames_local):
-            image_info_local.append({
-                "filename": item.get('filename', f'image_{start + i}'),
-                "onnx_prediction": item.get('labels', []),
-                "reasons": item.get('reasons', '')
-            })
+def get_batch_executor():
+    global _batch_executor
+    if _batch_executor is None:
+        with _openai_pool_lock:
+            if _batch_executor is None:
+                _batch_executor = ThreadPoolExecutor(max_workers=OPENAI_MAX_CONCURRENCY, thread_name_prefix="openai-batch")
+    return _batch_executor
 
-        prompt_local = prompt_original.replace("images_placeholder", json.dumps(image_info_local, indent=2))
-        prompt_local = prompt_local.replace("input_images_length_placeholder", f'{len(image_info_local)}')
 
-        content_local = [{"type": "input_text", "text": prompt_local}] + batch_inputs_local
-        messages_local = [{"role": "user", "content": content_local}]
-        payload_local = {
-            "model": "gpt-5",
-            "input": messages_local,
-            "text": {"format": {"type": "json_object"}}
-        }
+def get_hedge_executor():
+    # Runs the primary and duplicate of hedged requests; sized for one of each per batch worker
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _openai_pool_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=2 * OPENAI_MAX_CONCURRENCY, thread_name_prefix="openai-hedge")
+    return _hedge_executor
 
-        try:
-            response = requests.post(
-                "https://api.openai.com/v1/responses",
-                headers=headers,
-                json=payload_local
+
+# Placeholders older prompts put in the middle of the instructions. They are
+# swapped for fixed references so the instructions stay byte-identical across
+# batches, and the per-batch values go in the BATCH section after them.
+PROMPT_PLACEHOLDER_REFERENCES = {
+    "input_images_length_placeholder": "the number of images in the BATCH section",
+    "images_placeholder": "(listed in the BATCH section at the end)",
+}
+
+
+@lru_cache(maxsize=32)
+def static_prompt_prefix(prompt_original):
+    prompt = prompt_original
+    for placeholder, reference in PROMPT_PLACEHOLDER_REFERENCES.items():
+        prompt = prompt.replace(placeholder, reference)
+    return prompt
+
+
+@lru_cache(maxsize=32)
+def prompt_cache_key(prompt_original):
+    """Routing hint so requests sharing the static prefix land on the same prompt cache"""
+    return "poi-" + hashlib.sha256(static_prompt_prefix(prompt_original).encode("utf-8")).hexdigest()[:16]
+
+
+def build_batch_content(prompt_original, image_info, batch_inputs, kind='validation'):
+    """
+    Request content with the static instructions first and everything that
+    changes per batch last, so OpenAI's automatic prompt caching can reuse
+    the instruction prefix across batches and claims.
+    """
+    if kind == 'damage':
+        batch_text = (
+            f"# BATCH\n"
+            f"{len(image_info)} images follow, in this order:\n"
+            f"{json.dumps(image_info)}\n"
+            f'Return exactly {len(image_info)} entries in "damage_results", in the same order.'
+        )
+    else:
+        # A custom prompt names its own results array
+        results_array = '' if kind == 'custom' else ' in "validation_results"'
+        batch_text = (
+            f"# BATCH\n"
+            f"{len(image_info)} images follow, in this order, with the ONNX model prediction for each:\n"
+            f"{json.dumps(image_info)}\n"
+            f'Return exactly {len(image_info)} entries{results_array}, in the same order.'
+        )
+    return [
+        {"type": "input_text", "text": static_prompt_prefix(prompt_original)},
+        {"type": "input_text", "text": batch_text},
+    ] + batch_inputs
+
+
+def record_usage(record, usage):
+    """Add token usage, including prompt-cache hits, from a Responses API usage block to the record and price it"""
+    if not usage:
+        return
+    input_tokens = usage.get("input_tokens", 0)
+    cached_tokens = (usage.get("input_tokens_details") or {}).get("cached_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    cost_usd = (
+        (input_tokens - cached_tokens) * OPENAI_PRICE_INPUT_PER_M
+        + cached_tokens * OPENAI_PRICE_CACHED_INPUT_PER_M
+        + output_tokens * OPENAI_PRICE_OUTPUT_PER_M
+    ) / 1_000_000
+    record['input_tokens'] = record.get('input_tokens', 0) + input_tokens
+    record['cached_tokens'] = record.get('cached_tokens', 0) + cached_tokens
+    record['output_tokens'] = record.get('output_tokens', 0) + output_tokens
+    record['reasoning_tokens'] = record.get('reasoning_tokens', 0) + (usage.get("output_tokens_details") or {}).get("reasoning_tokens", 0)
+    record['cost_usd'] = round(record.get('cost_usd', 0) + cost_usd, 6)
+    print(f"Batch {record['batch']}: {input_tokens} input tokens ({cached_tokens} cached), {output_tokens} output tokens, ${cost_usd:.4f}")
+
+
+def summarize_usage(batch_stats):
+    """Token, cost, latency and retry totals over the given batch records"""
+    latencies = sorted(record['latency_seconds'] for record in batch_stats if 'latency_seconds' in record)
+    totals = {
+        'batches': len(batch_stats),
+        'failed_batches': sum(record.get('status') != 200 for record in batch_stats),
+        'images': sum(record.get('images', 0) for record in batch_stats),
+        'attempts': sum(record.get('attempts', 0) for record in batch_stats),
+        'request_bytes': sum(record.get('request_bytes', 0) for record in batch_stats),
+        'repaired_images': sum(record.get('repaired_images', 0) for record in batch_stats),
+        'missing_images': sum(record.get('missing_images', 0) for record in batch_stats),
+    }
+    for name in ('input_tokens', 'cached_tokens', 'output_tokens', 'reasoning_tokens'):
+        totals[name] = sum(record.get(name, 0) for record in batch_stats)
+    totals['cached_ratio'] = round(totals['cached_tokens'] / totals['input_tokens'], 3) if totals['input_tokens'] else 0.0
+    totals['cost_usd'] = round(sum(record.get('cost_usd', 0) for record in batch_stats), 6)
+    totals['latency_p50_seconds'] = latencies[len(latencies) // 2] if latencies else None
+    totals['latency_max_seconds'] = latencies[-1] if latencies else None
+    return totals
+
+
+POI_OPTIONS = [
+    "Right Front Corner", "Right Front Side", "Right Side", "Right Rear Side",
+    "Right Rear Corner", "Rear", "Left Rear Corner", "Left Rear Side",
+    "Left Side", "Left Front Side", "Left Front Corner", "Front", "Roof",
+    "Engine / Electrical", "Interior", "Steering / Suspension", "A/C", "Frame / Floor",
+]
+
+
+def _strict_object(properties):
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+DAMAGE_REGIONS_SCHEMA = {
+    "type": "array",
+    "items": _strict_object({
+        "poi": {"type": "string", "enum": POI_OPTIONS},
+        "severity": {"type": "string", "enum": ["major", "minor"]},
+        "type": {"type": "string", "enum": ["primary", "secondary"]},
+        "description": {"type": "string"},
+    }),
+}
+
+# Structured-output schema for the validation answer (all fields required, as strict mode demands)
+VALIDATION_RESPONSE_SCHEMA = _strict_object({
+    "validation_results": {
+        "type": "array",
+        "items": _strict_object({
+            "filename": {"type": "string"},
+            "onnx_prediction": {"type": "array", "items": {"type": "string"}},
+            "validated_labels": {"type": "array", "items": {"type": "string"}},
+            "is_correct": {"type": "boolean"},
+            "confidence": {"type": "string", "enum": ["high", "medium", "low"]},
+            "confidence_number": {"type": "number"},
+            "reasoning": {"type": "string"},
+            "changes_made": {"type": "string"},
+            "has_damage": {"type": "boolean"},
+            "damage_regions": DAMAGE_REGIONS_SCHEMA,
+        }),
+    },
+})
+
+# Damage-only answer for images whose ONNX position is trusted as is
+DAMAGE_RESPONSE_SCHEMA = _strict_object({
+    "damage_results": {
+        "type": "array",
+        "items": _strict_object({
+            "filename": {"type": "string"},
+            "has_damage": {"type": "boolean"},
+            "damage_regions": DAMAGE_REGIONS_SCHEMA,
+        }),
+    },
+})
+
+RESPONSE_SCHEMAS = {'validation': VALIDATION_RESPONSE_SCHEMA, 'damage': DAMAGE_RESPONSE_SCHEMA}
+
+
+def response_text_format(kind='validation'):
+    # A custom prompt defines its own answer shape, so it only gets JSON mode
+    if OPENAI_STRUCTURED_OUTPUTS and kind in RESPONSE_SCHEMAS:
+        return {"type": "json_schema", "name": f"{kind}_results", "strict": True, "schema": RESPONSE_SCHEMAS[kind]}
+    return {"type": "json_object"}
+
+
+def is_valid_result(result, kind='validation'):
+    if not isinstance(result, dict) or not isinstance(result.get('filename'), str):
+        return False
+    if kind == 'custom':
+        return True
+    if kind == 'damage':
+        return isinstance(result.get('damage_regions'), list)
+    return isinstance(result.get('validated_labels'), list)
+
+
+def match_results_to_filenames(batch_result, filenames, kind='validation'):
+    """
+    Attach results to the images they name. A result whose filename is not
+    one of `filenames` (compared exactly, then by basename) or that lacks the
+    required fields is dropped rather than guessed at by position.
+
+    Returns:
+        tuple: (results by filename, number of dropped results)
+    """
+    by_basename = {os.path.basename(name).strip().lower(): name for name in filenames}
+    matched = {}
+    dropped = 0
+    for result in batch_result if isinstance(batch_result, list) else []:
+        if not is_valid_result(result, kind):
+            dropped += 1
+            continue
+        filename = result['filename'] if result['filename'] in filenames else by_basename.get(
+            os.path.basename(result['filename']).strip().lower()
+        )
+        if filename is None or filename in matched:
+            dropped += 1
+            continue
+        result['filename'] = filename
+        matched[filename] = result
+    return matched, dropped
+
+
+def request_validation(prompt_original, image_info, image_inputs, batch_label, headers, record, kind='validation'):
+    """
+    One validation request. Returns the list of results, or None when the
+    request itself failed (no point in re-asking).
+    """
+    payload_local = {
+        "model": "gpt-5",
+        "input": [{"role": "user", "content": build_batch_content(prompt_original, image_info, image_inputs, kind)}],
+        "text": {"format": response_text_format(kind)},
+        "prompt_cache_key": prompt_cache_key(prompt_original),
+    }
+    request_body = json.dumps(payload_local)
+    record['request_bytes'] = record.get('request_bytes', 0) + len(request_body)
+    request_start = time.time()
+    response = post_with_retries(f"{OPENAI_BASE_URL}/responses", request_body, headers, batch_label, record)
+    print(f"Batch {batch_label}: {len(request_body) / 1e6:.2f}MB request, {record['attempts']} attempt(s), {time.time() - request_start:.2f}s")
+
+    if response is None:
+        return None
+    if response.status_code != 200:
+        print(f"Batch {batch_label} failed: {response.status_code} - {response.text}")
+        return None
+    response_data = response.json()
+    record_usage(record, response_data.get("usage"))
+    output_list = response_data.get("output", [])
+    assistant_output = next((item for item in output_list if item.get("role") == "assistant"), None)
+    content = (assistant_output or {}).get("content", [])
+    if not content:
+        print(f"Empty content for batch {batch_label}")
+        return []
+    if content[0].get("type") == "refusal":
+        print(f"Batch {batch_label} refused: {content[0].get('refusal')}")
+        return None
+
+    raw_text = content[0].get("text", "")
+    print(f"Batch {batch_label} response received")
+    try:
+        parsed = json.loads(raw_text)
+    except ValueError as ee:
+        print(f"JSON parse error for batch {batch_label}: {ee}")
+        print(raw_text)
+        return []
+    # Check for validation_results (for validation) or damage_results (for damage detection)
+    if isinstance(parsed, dict):
+        return parsed.get("validation_results") or parsed.get("damage_results") or []
+    return parsed if isinstance(parsed, list) else []
+
+
+def process_single_batch(prompt_original, batch_filenames_local, batch_inputs_local, batch_label, start=0, headers=None, batch_stats=None, kind='validation'):
+    """
+    Send one batch of images to OpenAI and return its validation results ([] on failure).
+
+    `kind` is 'validation' for the full position validation and damage
+    answer, 'damage' for a damage-only answer about images whose ONNX
+    position needs no second opinion, or 'custom' for a caller's own prompt,
+    whose results only need a filename.
+
+    Results are matched to images by filename. Images the answer leaves out,
+    or answers that are malformed, are re-asked in a smaller follow-up request
+    (up to OPENAI_REPAIR_ROUNDS times) instead of discarding the whole batch.
+
+    A per-batch record (attempts, final status, latency, request size,
+    repaired and missing images) is appended to `batch_stats` when a list is given.
+    """
+    batch_start = time.time()
+    record = {'batch': batch_label, 'kind': kind, 'images': len(batch_inputs_local), 'attempts': 0, 'status': None, 'results': 0}
+    if batch_stats is not None:
+        batch_stats.append(record)
+    print(f"🟦 Processing batch {batch_label} ({len(batch_inputs_local)} images)")
+
+    image_info_local = []
+    for i, item in enumerate(batch_filenames_local):
+        info = {"filename": item.get('filename', f'image_{start + i}')}
+        if kind != 'damage':
+            info["onnx_prediction"] = item.get('labels', [])
+            info["reasons"] = item.get('reasons', '')
+        image_info_local.append(info)
+    filenames = [info['filename'] for info in image_info_local]
+
+    results = {}
+    pending = list(range(len(image_info_local)))
+    try:
+        for repair_round in range(OPENAI_REPAIR_ROUNDS + 1):
+            label = batch_label if repair_round == 0 else f"{batch_label} repair {repair_round}"
+            batch_result = request_validation(
+                prompt_original,
+                [image_info_local[i] for i in pending],
+                [batch_inputs_local[i] for i in pending],
+                label,
+                headers,
+                record,
+                kind,
             )
+            if batch_result is None:
+                break
+            matched, dropped = match_results_to_filenames(batch_result, [filenames[i] for i in pending], kind)
+            results.update(matched)
+            pending = [i for i in pending if filenames[i] not in results]
+            if not pending:
+                break
+            print(f"Batch {label}: {len(matched)} matched, {dropped} invalid, {len(pending)} image(s) missing")
+            if repair_round < OPENAI_REPAIR_ROUNDS:
+                record['repaired_images'] = record.get('repaired_images', 0) + len(pending)
+    except Exception as e:
+        print(f"Exception during batch {batch_label}: {e}")
 
-            if response.status_code != 200:
-                print(f"Batch {batch_index + 1} failed: {response.status_code} - {response.text}")
-                return []
-            response_data = response.json()
-            output_list = response_data.get("output", [])
-            assistant_output = next((item for item in output_list if item.get("role") == "assistant"), None)
-            if not assistant_output:
-                return []
-            content = assistant_output.get("content", [])
-            if not content:
-                print(f"Empty content for batch {batch_index + 1}")
-                return []
-
-            raw_text = content[0].get("text", "")
-            print(f"Batch {batch_index + 1} response received")
-            try:
-                parsed = json.loads(raw_text)
-                # Check for validation_results (for validation) or damage_results (for damage detection)
-                batch_result = parsed.get("validation_results") or parsed.get("damage_results") or parsed
-                batch_result = update_openai_results_with_original_filename(batch_result, batch_filenames_local)
-                return batch_result
-            except Exception as ee:
-                print(f"JSON parse error for batch {batch_index + 1}: {ee}")
-                print(raw_text)
-                return []
+    record['latency_seconds'] = round(time.time() - batch_start, 3)
+    record['results'] = len(results)
+    record['missing_images'] = len(pending)
+    return [results[name] for name in filenames if name in results]
 
-        except Exception as e:
-            print(f"Exception during batch {batch_index + 1}: {e}")
-            return []
 
-    max_workers = min(int(os.getenv("OPENAI_PARALLEL_WORKERS", "10")), total_batches) if total_batches > 0 else 0
-    if max_workers == 0:
+# --- Ask GPT to find POIs for a single batch ---
+def get_pois_for_batch(
+        prompt_original,
+        image_filenames,
+        image_inputs,
+        batch_size=5,
+        batch_stats=None,
+        kind='validation'
+):
+    start_time = time.time()
+    batch_size = default_batch_size(len(image_inputs), batch_size)
+
+    total_images = len(image_inputs)
+    # Pack by encoded size and vision tokens, with batch_size as the image cap
+    batches = plan_batches(
+        [image_input_cost(image_input) for image_input in image_inputs],
+        max_images=batch_size,
+        workers=int(openai_limiter.limit),
+    )
+    total_batches = len(batches)
+    all_results = []
+
+    print(f"Total images: {total_images}, Processing in {total_batches} batch(es) of {[len(b) for b in batches]} images...")
+
+    def run_batch(batch_index):
+        indices = batches[batch_index]
+        return process_single_batch(
+            prompt_original,
+            [image_filenames[i] for i in indices],
+            [image_inputs[i] for i in indices],
+            f"{batch_index + 1}/{total_batches}",
+            start=indices[0],
+            batch_stats=batch_stats,
+            kind=kind,
+        )
+
+    if total_batches == 0:
         print("No batches to process.")
         total_seconds = time.time() - start_time
         print(f"get_pois_for_batch total time: {total_seconds:.2f}s")
         return []
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_single_batch, batch_index): batch_index for batch_index in range(total_batches)}
-        for future in as_completed(futures):
-            try:
-                result = future.result()
-                if result:
-                    all_results.extend(result)
-            except Exception as e:
-                print(f"Unhandled exception in batch future: {e}")
+    # The adaptive limiter decides how many of the shared workers may call OpenAI at once
+    executor = get_batch_executor()
+    futures = {executor.submit(run_batch, batch_index): batch_index for batch_index in range(total_batches)}
+    for future in as_completed(futures):
+        try:
+            result = future.result()
+            if result:
+                all_results.extend(result)
+        except Exception as e:
+            print(f"Unhandled exception in batch future: {e}")
 
     print(f"All {total_batches} batches processed successfully.")
+    if batch_stats is not None:
+        print(f"Hedged requests: {summarize_hedges(batch_stats)}, usage: {summarize_usage(batch_stats)}")
     total_seconds = time.time() - start_time
     print(f"get_pois_for_batch total time: {total_seconds:.2f}s")
     return all_results
-
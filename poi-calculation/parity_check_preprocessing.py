@@ -0,0 +1,92 @@
+"""
+Accuracy parity and cost check for the reduced-resolution preprocessing.
+
+    python parity_check_preprocessing.py --model ONNX_f1_0.83-positons-res34.onnx --labelled ./labelled_sample
+
+`--labelled` is a directory with one sub-folder per position label
+(position-Front, position-Rear_Left, ...) containing photos of that class.
+Compares the original full-resolution decode + resize against
+`preprocess_into_batch` and reports accuracy, prediction agreement, decode
+time and the size of the decoded bitmap (the dominant per-image memory).
+"""
+import argparse
+import os
+import statistics
+import time
+
+import numpy as np
+import onnxruntime as rt
+from PIL import Image
+
+from lambda_function import ONNX_INPUT_SIZE, onnx_model_io, position_labels, preprocess_into_batch, run_onnx_batch
+
+
+def full_resolution_transform(path, size, out):
+    """The preprocessing used before reduced-resolution decoding."""
+    image = Image.open(path)
+    image.load()
+    decoded_bytes = image.width * image.height * len(image.getbands())
+    image = image.convert('RGB').resize((size, size))
+    np.divide(np.asarray(image).transpose(2, 0, 1), np.float32(255), out=out, dtype=np.float32)
+    return decoded_bytes
+
+
+def reduced_resolution_transform(path, size, out):
+    with Image.open(path) as image:
+        image.draft(image.mode, (size, size))
+        decoded_bytes = image.size[0] * image.size[1] * len(image.getbands())
+    preprocess_into_batch(path, size, out)
+    return decoded_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--labelled", required=True)
+    args = parser.parse_args()
+
+    samples = []
+    for label in sorted(os.listdir(args.labelled)):
+        folder = os.path.join(args.labelled, label)
+        if label in position_labels and os.path.isdir(folder):
+            samples.extend((os.path.join(folder, name), label) for name in sorted(os.listdir(folder)))
+    if not samples:
+        raise SystemExit(f"No labelled images found under {args.labelled}")
+
+    session = rt.InferenceSession(args.model)
+    model_io = onnx_model_io(session)
+    batch = np.zeros((model_io[2] or 1, 3, ONNX_INPUT_SIZE, ONNX_INPUT_SIZE), dtype=np.float32)
+
+    report = {}
+    predictions = {}
+    for name, transform in (("full", full_resolution_transform), ("reduced", reduced_resolution_transform)):
+        times, decoded, preds, inputs = [], [], [], []
+        for path, _ in samples:
+            start = time.perf_counter()
+            decoded.append(transform(path, ONNX_INPUT_SIZE, batch[0]))
+            times.append((time.perf_counter() - start) * 1000)
+            inputs.append(batch[0].copy())
+            preds.append(position_labels[int(np.argmax(run_onnx_batch(session, model_io, batch, 1)[0]))])
+        correct = sum(pred == label for pred, (_, label) in zip(preds, samples))
+        predictions[name] = (preds, inputs)
+        report[name] = {
+            "accuracy": correct / len(samples),
+            "decode_ms_p50": statistics.median(times),
+            "decoded_mb_mean": statistics.mean(decoded) / 1e6,
+        }
+
+    agreement = sum(a == b for a, b in zip(predictions["full"][0], predictions["reduced"][0])) / len(samples)
+    input_diff = statistics.mean(
+        float(np.abs(a - b).mean()) for a, b in zip(predictions["full"][1], predictions["reduced"][1])
+    )
+    print(f"{len(samples)} labelled images")
+    for name, values in report.items():
+        print(
+            f"{name:<8} accuracy {values['accuracy']:.3f}  decode p50 {values['decode_ms_p50']:.1f}ms  "
+            f"decoded bitmap {values['decoded_mb_mean']:.1f}MB"
+        )
+    print(f"prediction agreement {agreement:.3f}, mean |input diff| {input_diff:.4f}")
+
+
+if __name__ == "__main__":
+    main()
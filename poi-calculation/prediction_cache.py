@@ -0,0 +1,81 @@
+import json
+import os
+
+import boto3
+
+# PREDICTION_CACHE selects the backend: "s3" (default), "local" or "none"
+PREDICTION_CACHE = (os.getenv("PREDICTION_CACHE") or "s3").lower()
+PREDICTION_CACHE_PREFIX = os.getenv("PREDICTION_CACHE_PREFIX") or "cache/onnx-predictions/"
+PREDICTION_CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR") or "/tmp/onnx-predictions"
+
+
+def prediction_cache_key(etag, model_version):
+    """Cache key for one image: the S3 object ETag scoped to the model that produced the prediction"""
+    if not etag:
+        return None
+    etag = etag.strip('"')
+    return f"{model_version}/{etag}"
+
+
+class S3PredictionCache:
+    """Stores one JSON object per prediction under `prefix` in the claims bucket"""
+
+    def __init__(self, bucket, prefix=PREDICTION_CACHE_PREFIX, s3_client=None):
+        self.s3 = s3_client or boto3.client('s3')
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}.json")
+            return json.loads(obj["Body"].read())
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            print(f"Prediction cache read failed for {key}: {e}")
+            return None
+
+    def put(self, key, value):
+        try:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=f"{self.prefix}{key}.json",
+                Body=json.dumps(value).encode("utf-8"),
+                ContentType="application/json",
+            )
+        except Exception as e:
+            print(f"Prediction cache write failed for {key}: {e}")
+
+
+class LocalPredictionCache:
+    """Directory-backed cache for local runs and tests"""
+
+    def __init__(self, base_dir=PREDICTION_CACHE_DIR):
+        self.base_dir = base_dir
+
+    def path(self, key):
+        return os.path.join(self.base_dir, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+
+def get_prediction_cache(bucket, s3_client=None):
+    """Cache backend configured by PREDICTION_CACHE, or None when disabled"""
+    if PREDICTION_CACHE == "s3":
+        return S3PredictionCache(bucket, s3_client=s3_client)
+    if PREDICTION_CACHE == "local":
+        return LocalPredictionCache()
+    return None
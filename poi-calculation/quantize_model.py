@@ -0,0 +1,101 @@
+"""
+Produce an INT8 variant of the position model.
+
+    # dynamic: weights quantized offline, activations at runtime (no calibration data)
+    python quantize_model.py --mode dynamic
+
+    # static: weights and activations quantized using calibration photos (QDQ format)
+    python quantize_model.py --mode static --calibration ./calibration_images [--upload]
+
+The output is written as ONNX_MODEL_VARIANTS['int8'] and, with --upload,
+copied to s3://$BUCKET_NAME/models/ where models_loading() picks it up when
+the Lambda runs with ONNX_MODEL_VARIANT=int8 or {"model_variant": "int8"}.
+"""
+import argparse
+import os
+
+import numpy as np
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from lambda_function import (
+    BUCKET_NAME,
+    ONNX_INPUT_SIZE,
+    ONNX_MODEL_VARIANTS,
+    fetch_model_file,
+    preprocess_into_batch,
+    s3,
+)
+
+
+class ImageCalibrationReader(CalibrationDataReader):
+    """Feeds calibration photos through the production preprocessing"""
+
+    def __init__(self, image_dir, input_name, limit=200):
+        names = sorted(
+            name for name in os.listdir(image_dir)
+            if name.lower().endswith((".jpg", ".jpeg", ".png"))
+        )[:limit]
+        self.paths = [os.path.join(image_dir, name) for name in names]
+        self.input_name = input_name
+        self.index = 0
+
+    def get_next(self):
+        while self.index < len(self.paths):
+            path = self.paths[self.index]
+            self.index += 1
+            image = np.empty((1, 3, ONNX_INPUT_SIZE, ONNX_INPUT_SIZE), dtype=np.float32)
+            try:
+                preprocess_into_batch(path, ONNX_INPUT_SIZE, image[0])
+            except Exception as e:
+                print(f"Skipping calibration image {path}: {e}")
+                continue
+            return {self.input_name: image}
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["dynamic", "static"], default="static")
+    parser.add_argument("--calibration", help="directory of calibration photos (static mode)")
+    parser.add_argument("--calibration-limit", type=int, default=200)
+    parser.add_argument("--output", default=ONNX_MODEL_VARIANTS['int8'])
+    parser.add_argument("--upload", action="store_true")
+    args = parser.parse_args()
+
+    fp32_path = fetch_model_file(ONNX_MODEL_VARIANTS['fp32'])
+    preprocessed_path = f"{args.output}.preprocessed.onnx"
+    quant_pre_process(fp32_path, preprocessed_path)
+
+    if args.mode == "dynamic":
+        quantize_dynamic(preprocessed_path, args.output, weight_type=QuantType.QInt8)
+    else:
+        if not args.calibration:
+            raise SystemExit("--calibration is required for static quantization")
+        import onnx
+        input_name = onnx.load(preprocessed_path).graph.input[0].name
+        quantize_static(
+            preprocessed_path,
+            args.output,
+            ImageCalibrationReader(args.calibration, input_name, args.calibration_limit),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+    os.remove(preprocessed_path)
+    print(f"Wrote {args.output} ({os.path.getsize(args.output) / 1e6:.1f}MB, fp32 {os.path.getsize(fp32_path) / 1e6:.1f}MB)")
+
+    if args.upload:
+        s3.upload_file(args.output, BUCKET_NAME, f"models/{os.path.basename(args.output)}")
+        print(f"Uploaded to s3://{BUCKET_NAME}/models/{os.path.basename(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
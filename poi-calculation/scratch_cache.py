@@ -0,0 +1,224 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+# Claim images kept in /tmp across warm invocations, one directory per claim
+SCRATCH_CACHE_DIR = os.getenv("SCRATCH_CACHE_DIR") or "/tmp/claim-images"
+# Lambda's default ephemeral storage is 512MB; leave room for models and other scratch files
+SCRATCH_CACHE_MAX_BYTES = int(os.getenv("SCRATCH_CACHE_MAX_BYTES") or 300_000_000)
+
+
+def _safe_name(value):
+    value = str(value)
+    if value and all(c.isalnum() or c in "-_." for c in value) and value not in (".", ".."):
+        return value
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def new_cache_stats():
+    return {'hits': 0, 'misses': 0, 'bytes_downloaded': 0, 'bytes_saved': 0, 'evicted_claims': 0}
+
+
+class ClaimScratchCache:
+    """
+    Claim-scoped scratch directory for downloaded images.
+
+    Files live at <base>/<claim>/<etag>/<filename>, so photos with the same
+    name in different claims never collide, and a warm container reuses a
+    file only when it is the same S3 object (same ETag). Whole claims are
+    evicted least recently used first once the directory grows past
+    `max_bytes`; claims being processed (between begin_claim and end_claim)
+    are never evicted.
+    """
+
+    def __init__(self, base_dir=SCRATCH_CACHE_DIR, max_bytes=SCRATCH_CACHE_MAX_BYTES):
+        self.base_dir = base_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.claims = OrderedDict()  # claim dir -> bytes, least recently used first
+        self.active = {}  # claim dir -> pipelines currently using it
+        os.makedirs(base_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        # Pick up files left by earlier invocations of this container
+        found = []
+        for name in os.listdir(self.base_dir):
+            claim_dir = os.path.join(self.base_dir, name)
+            if not os.path.isdir(claim_dir):
+                continue
+            size = 0
+            for root, _, files in os.walk(claim_dir):
+                size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+            found.append((os.path.getmtime(claim_dir), name, size))
+        for _, name, size in sorted(found):
+            self.claims[name] = size
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(self.claims.values())
+
+    def begin_claim(self, claim_id, stats=None):
+        """Mark a claim as most recently used and make room for it"""
+        claim = _safe_name(claim_id)
+        with self.lock:
+            self.claims.setdefault(claim, 0)
+            self.claims.move_to_end(claim)
+            self.active[claim] = self.active.get(claim, 0) + 1
+        claim_dir = os.path.join(self.base_dir, claim)
+        os.makedirs(claim_dir, exist_ok=True)
+        os.utime(claim_dir)  # the directory mtime orders claims when a new process rescans
+        self._evict(claim, stats)
+
+    def end_claim(self, claim_id):
+        """Let the claim's files be evicted again once no pipeline is using them"""
+        claim = _safe_name(claim_id)
+        with self.lock:
+            if self.active.get(claim, 0) > 1:
+                self.active[claim] -= 1
+            else:
+                self.active.pop(claim, None)
+
+    def path_for(self, claim_id, key, etag):
+        version = _safe_name(etag.strip('"')) if etag else "unversioned"
+        return os.path.join(self.base_dir, _safe_name(claim_id), version, os.path.basename(key))
+
+    def lookup(self, claim_id, key, etag, stats=None):
+        """Local path of a cached copy of this object version, or None"""
+        claim = _safe_name(claim_id)
+        local_file = self.path_for(claim_id, key, etag)
+        if not etag or not os.path.exists(local_file):
+            return None
+        size = os.path.getsize(local_file)
+        with self.lock:
+            self.claims.setdefault(claim, 0)
+            self.claims.move_to_end(claim)
+            if stats is not None:
+                stats['hits'] += 1
+                stats['bytes_saved'] += size
+        return local_file
+
+    def fetch(self, claim_id, key, etag, download, stats=None):
+        """
+        Local path of `key` for this claim, calling `download(key, path)` only
+        when no copy of the same object version is cached.
+        """
+        cached_file = self.lookup(claim_id, key, etag, stats)
+        if cached_file:
+            return cached_file
+
+        claim = _safe_name(claim_id)
+        local_file = self.path_for(claim_id, key, etag)
+        os.makedirs(os.path.dirname(local_file), exist_ok=True)
+        replaced = os.path.getsize(local_file) if os.path.exists(local_file) else 0
+        # Download next to the target and rename, so a half-written file is never reused
+        partial_file = f"{local_file}.{threading.get_ident()}.part"
+        try:
+            download(key, partial_file)
+            os.replace(partial_file, local_file)
+        finally:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+        size = os.path.getsize(local_file)
+        with self.lock:
+            self.claims[claim] = self.claims.get(claim, 0) + size - replaced
+            self.claims.move_to_end(claim)
+            if stats is not None:
+                stats['misses'] += 1
+                stats['bytes_downloaded'] += size
+        self._drop_other_versions(claim, local_file)
+        self._evict(claim, stats)
+        return local_file
+
+    def _drop_other_versions(self, claim, local_file):
+        # An object that changed in S3 leaves its old version behind; remove it
+        version_dir, filename = os.path.split(local_file)
+        claim_dir = os.path.dirname(version_dir)
+        for version in os.listdir(claim_dir):
+            stale_file = os.path.join(claim_dir, version, filename)
+            if stale_file != local_file and os.path.isfile(stale_file):
+                size = os.path.getsize(stale_file)
+                os.remove(stale_file)
+                with self.lock:
+                    self.claims[claim] = max(0, self.claims.get(claim, 0) - size)
+
+    def _evict(self, active_claim, stats=None):
+        while True:
+            with self.lock:
+                if sum(self.claims.values()) <= self.max_bytes:
+                    return
+                victim = next((claim for claim in self.claims if claim != active_claim and claim not in self.active), None)
+                if victim is None:
+                    return
+                size = self.claims.pop(victim)
+            shutil.rmtree(os.path.join(self.base_dir, victim), ignore_errors=True)
+            print(f"Scratch cache evicted claim {victim} ({size / 1e6:.1f}MB)")
+            if stats is not None:
+                stats['evicted_claims'] += 1
+
+
+class ImageBuffers:
+    """
+    Image bytes held in memory for one claim, keyed by S3 key.
+
+    Each photo is read from S3 once and the same buffer feeds the ONNX
+    decoder and the OpenAI encoder, with no /tmp round trip. `reserve`
+    refuses a photo once `max_bytes` are held, and the caller spills it to
+    the scratch cache instead; `release` frees a buffer as soon as nothing
+    downstream needs it.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.buffers = {}
+        self.held_bytes = 0
+        self.stats = {'in_memory': 0, 'spilled': 0, 'bytes_read': 0, 'peak_bytes': 0}
+
+    def reserve(self, size):
+        """Claim room for a photo of `size` bytes; False means spill it to disk"""
+        with self.lock:
+            if self.held_bytes and self.held_bytes + size > self.max_bytes:
+                self.stats['spilled'] += 1
+                return False
+            self.held_bytes += size
+            return True
+
+    def put(self, key, data, reserved):
+        with self.lock:
+            # Listed sizes can be missing or stale; account for what was actually read
+            self.held_bytes += len(data) - reserved
+            self.buffers[key] = data
+            self.stats['in_memory'] += 1
+            self.stats['bytes_read'] += len(data)
+            self.stats['peak_bytes'] = max(self.stats['peak_bytes'], self.held_bytes)
+
+    def cancel(self, reserved):
+        with self.lock:
+            self.held_bytes -= reserved
+
+    def get(self, key):
+        with self.lock:
+            return self.buffers.get(key)
+
+    def release(self, key):
+        with self.lock:
+            data = self.buffers.pop(key, None)
+            if data is not None:
+                self.held_bytes -= len(data)
+
+
+_scratch_cache = None
+_scratch_cache_lock = threading.Lock()
+
+
+def get_scratch_cache():
+    """Container-wide scratch cache, created on first use"""
+    global _scratch_cache
+    if _scratch_cache is None:
+        with _scratch_cache_lock:
+            if _scratch_cache is None:
+                _scratch_cache = ClaimScratchCache()
+    return _scratch_cache
@@ -0,0 +1,112 @@
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import fan_out
+import lambda_function
+from fan_out import merge_shard_results, merge_stats, plan_shards, run_shards
+
+
+def shard_worker(event):
+    if event.get("fail"):
+        raise RuntimeError("shard worker crashed")
+    return event["value"] * 2
+
+
+def shard_result(objects, **pipeline):
+    return {
+        'onnx_results': {'items': [{'filename': obj['Key']} for obj in objects]},
+        'openai_validation': [{'filename': obj['Key']} for obj in objects],
+        'pipeline': dict({'images': len(objects), 'openai_batches': [], 'seconds': 1.0}, **pipeline),
+        'model_init': {'cold_start': False},
+    }
+
+
+class PlanShardsTest(unittest.TestCase):
+    def test_shards_are_contiguous_and_balanced(self):
+        shards = plan_shards(list(range(10)), 4)
+        self.assertEqual(shards, [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]])
+
+    def test_no_objects_no_shards(self):
+        self.assertEqual(plan_shards([], 4), [])
+
+
+class MergeStatsTest(unittest.TestCase):
+    def test_counters_add_up_and_settings_come_from_the_first_shard(self):
+        merged = merge_stats([
+            {'images': 40, 'peak_bytes': 10, 'dedup': {'method': 'dhash', 'threshold': 4, 'duplicates': 3, 'ratio': 0.075},
+             'openai_batches': [{'batch': '1/4'}], 'cold_start': True},
+            {'images': 38, 'peak_bytes': 25, 'dedup': {'method': 'dhash', 'threshold': 4, 'duplicates': 1, 'ratio': 0.026},
+             'openai_batches': [{'batch': '1/4'}, {'batch': '2/4'}], 'cold_start': False},
+        ])
+        self.assertEqual(merged['images'], 78)
+        self.assertEqual(merged['peak_bytes'], 25)
+        self.assertEqual(merged['dedup'], {'method': 'dhash', 'threshold': 4, 'duplicates': 4, 'ratio': 0.075})
+        self.assertEqual(len(merged['openai_batches']), 3)
+        self.assertIs(merged['cold_start'], True)
+
+    def test_inputs_are_not_modified(self):
+        first = {'openai_batches': [{'batch': '1/1'}], 'quality': {'flagged': 1}}
+        merge_stats([first, {'openai_batches': [{'batch': '1/1'}], 'quality': {'flagged': 2}}])
+        self.assertEqual(first, {'openai_batches': [{'batch': '1/1'}], 'quality': {'flagged': 1}})
+
+    def test_batch_labels_are_prefixed_with_the_shard_number(self):
+        results = [
+            shard_result([{'Key': 'a'}], openai_batches=[{'batch': '1/1'}]),
+            shard_result([{'Key': 'b'}], openai_batches=[{'batch': '1/1'}]),
+        ]
+        onnx_results, validation, stats = merge_shard_results(results)
+        self.assertEqual([item['filename'] for item in onnx_results['items']], ['a', 'b'])
+        self.assertEqual(len(validation), 2)
+        self.assertEqual([batch['batch'] for batch in stats['openai_batches']], ['1:1/1', '2:1/1'])
+
+
+class RunShardsTest(unittest.TestCase):
+    def test_failed_shard_is_reported_without_losing_the_others(self):
+        results, errors = run_shards(
+            [{'value': 1}, {'value': 2, 'fail': True}, {'value': 3}], shard_worker, invoker='local'
+        )
+        self.assertEqual(results, [2, None, 6])
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], RuntimeError)
+
+    def test_lambda_invoker_needs_a_function_name(self):
+        with mock.patch.object(fan_out, "FAN_OUT_FUNCTION_NAME", None):
+            with self.assertRaises(ValueError):
+                run_shards([{}], shard_worker, invoker='lambda')
+
+
+class FanOutPipelineTest(unittest.TestCase):
+    def test_failed_shards_are_rerun_in_the_coordinator_and_merged_in_order(self):
+        objects = [{'Key': f'img_{i}.jpg'} for i in range(10)]
+        shards = plan_shards(objects, 3)
+
+        def fake_run_shards(shard_events, worker, invoker=None):
+            results = [shard_result(event['shard']['objects']) for event in shard_events]
+            errors = [None] * len(shard_events)
+            for index in (1, 3):
+                results[index], errors[index] = None, RuntimeError("timeout")
+            return results, errors
+
+        reruns = []
+
+        def fake_process_shard(event):
+            reruns.append([obj['Key'] for obj in event['shard']['objects']])
+            return dict(shard_result(event['shard']['objects']), shard=event['shard']['index'])
+
+        with mock.patch.object(lambda_function, "run_shards", fake_run_shards), \
+                mock.patch.object(lambda_function, "process_shard", fake_process_shard):
+            onnx_results, validation, stats, _ = lambda_function.run_fan_out_pipeline({'shard_size': 3}, objects)
+
+        self.assertEqual(reruns, [[obj['Key'] for obj in shards[1] + shards[3]]])
+        self.assertEqual([item['filename'] for item in onnx_results['items']], [obj['Key'] for obj in objects])
+        self.assertEqual(len(validation), len(objects))
+        self.assertEqual(stats['images'], len(objects))
+        self.assertEqual(stats['fan_out']['shards'], 4)
+        self.assertEqual(stats['fan_out']['rerun_shards'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import openai_executions
+from openai_executions import AdaptiveConcurrencyLimiter, HedgePolicy
+
+
+def fake_response(status_code=200, headers=None):
+    return SimpleNamespace(status_code=status_code, headers=headers or {}, text="")
+
+
+class AdaptiveConcurrencyLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.limiter = AdaptiveConcurrencyLimiter(8, maximum=16)
+        for name, value in (("openai_limiter", self.limiter), ("hedge_policy", HedgePolicy())):
+            patcher = mock.patch.object(openai_executions, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def finish(self, response, latency):
+        self.limiter.acquire()
+        openai_executions.release_for_response(response, latency)
+
+    def test_limit_holds_steady_under_mixed_batch_sizes(self):
+        # Small batches answer in ~2s, full batches in ~40s: slower, but nothing is overloaded
+        for images in [1, 20, 2, 20, 1, 15, 20, 3] * 5:
+            self.finish(fake_response(), 2.0 * images)
+        self.assertGreaterEqual(self.limiter.limit, 8)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_rate_limit_halves_limit_and_pauses(self):
+        self.finish(fake_response(429, {"retry-after": "5"}), 1.0)
+        self.assertEqual(self.limiter.limit, 4)
+        self.assertGreater(self.limiter.blocked_until, 0)
+        self.assertFalse(self.limiter.try_acquire())
+
+    def test_server_error_halves_limit(self):
+        self.finish(fake_response(503), 1.0)
+        self.assertEqual(self.limiter.limit, 4)
+        self.assertEqual(self.limiter.blocked_until, 0)
+
+    def test_success_grows_limit_back(self):
+        self.finish(fake_response(500), 1.0)
+        for _ in range(20):
+            self.finish(fake_response(), 30.0)
+        self.assertGreater(self.limiter.limit, 4)
+
+
+class ResponseKindTest(unittest.TestCase):
+    def test_custom_prompt_results_only_need_a_filename(self):
+        results = [{"filename": "a.jpg", "has_damage": True, "damage_regions": []}]
+        matched, dropped = openai_executions.match_results_to_filenames(results, ["a.jpg"], "custom")
+        self.assertEqual(list(matched), ["a.jpg"])
+        self.assertEqual(dropped, 0)
+        self.assertEqual(openai_executions.response_text_format("custom"), {"type": "json_object"})
+
+    def test_default_prompt_results_need_validated_labels(self):
+        results = [{"filename": "a.jpg", "has_damage": True, "damage_regions": []}]
+        matched, dropped = openai_executions.match_results_to_filenames(results, ["a.jpg"])
+        self.assertEqual(matched, {})
+        self.assertEqual(dropped, 1)
+
+    def test_damage_results_match_the_damage_schema(self):
+        results = [{"filename": "a.jpg", "has_damage": False, "damage_regions": []}]
+        matched, _ = openai_executions.match_results_to_filenames(results, ["a.jpg"], "damage")
+        self.assertEqual(list(matched), ["a.jpg"])
+        self.assertEqual(openai_executions.response_text_format("damage")["schema"], openai_executions.DAMAGE_RESPONSE_SCHEMA)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import io
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("SCRATCH_CACHE_DIR", tempfile.mkdtemp(prefix="claim-images-"))
+
+import numpy as np
+from PIL import Image
+
+import lambda_function
+from prediction_cache import LocalPredictionCache, prediction_cache_key
+
+
+class FakeSession:
+    """Position model stand-in: predicts the label indexed by the image's dominant channel"""
+
+    def __init__(self):
+        self.rows = 0
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="input", shape=["batch", 3, 448, 448])]
+
+    def get_outputs(self):
+        return [SimpleNamespace(name="output")]
+
+    def run(self, output_names, feeds):
+        batch = feeds["input"]
+        self.rows += len(batch)
+        scores = np.zeros((len(batch), len(lambda_function.position_labels)), dtype=np.float32)
+        scores[np.arange(len(batch)), batch.mean(axis=(2, 3)).argmax(axis=1)] = 10.0
+        return [scores]
+
+
+def jpeg(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class PredictionCachePipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = LocalPredictionCache(os.path.join(self.tmp.name, "predictions"))
+        self.images = {
+            "claims/c/est/InputImages/red.jpg": jpeg((250, 10, 10)),
+            "claims/c/est/InputImages/green.jpg": jpeg((10, 250, 10)),
+            "claims/c/est/InputImages/blue.jpg": jpeg((10, 10, 250)),
+        }
+        self.session = FakeSession()
+        for name, value in (
+            ("read_file_from_s3", self.images.__getitem__),
+            ("get_position_model", lambda model_file: self.session),
+        ):
+            patcher = mock.patch.object(lambda_function, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def objects(self, etag_suffix=""):
+        return [{"Key": key, "ETag": f'"{os.path.basename(key)}{etag_suffix}"'} for key in self.images]
+
+    def run_pipeline(self, objects, **kwargs):
+        results, _, stats = lambda_function.run_classification_pipeline(
+            objects, prediction_cache=self.cache, dedup="none", quality_action="off", claim_id="c", **kwargs
+        )
+        return [item["labels"] for item in results["items"]], stats["prediction_cache"]
+
+    def test_second_run_is_served_from_the_cache(self):
+        labels, counts = self.run_pipeline(self.objects())
+        self.assertEqual(counts, {"hits": 0, "misses": 3})
+        self.assertEqual(self.session.rows, 3)
+        self.assertEqual(labels, [["Front"], ["Front", "Left"], ["Front", "Right"]])
+
+        cached_labels, counts = self.run_pipeline(self.objects())
+        self.assertEqual(counts, {"hits": 3, "misses": 0})
+        self.assertEqual(self.session.rows, 3)
+        self.assertEqual(cached_labels, labels)
+
+    def test_etag_change_invalidates_the_entry(self):
+        self.run_pipeline(self.objects())
+        objects = self.objects()
+        objects[0]["ETag"] = '"red.jpg-edited"'
+        _, counts = self.run_pipeline(objects)
+        self.assertEqual(counts, {"hits": 2, "misses": 1})
+        self.assertEqual(self.session.rows, 4)
+
+    def test_model_version_change_invalidates_every_entry(self):
+        self.run_pipeline(self.objects())
+        _, counts = self.run_pipeline(self.objects(), model_variant="int8")
+        self.assertEqual(counts, {"hits": 0, "misses": 3})
+        self.assertEqual(self.session.rows, 6)
+
+    def test_key_is_scoped_to_etag_and_model_version(self):
+        self.assertEqual(prediction_cache_key('"abc"', "model-448"), "model-448/abc")
+        self.assertNotEqual(prediction_cache_key("abc", "model-448"), prediction_cache_key("abc", "model.int8-448"))
+        self.assertIsNone(prediction_cache_key(None, "model-448"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+from scratch_cache import ClaimScratchCache, new_cache_stats
+
+
+class ClaimScratchCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.downloads = []
+
+    def cache(self, max_bytes=1000):
+        return ClaimScratchCache(self.tmp.name, max_bytes)
+
+    def download(self, size):
+        def write(key, path):
+            self.downloads.append(key)
+            with open(path, "wb") as f:
+                f.write(b"x" * size)
+        return write
+
+    def claim_dirs(self):
+        return sorted(os.listdir(self.tmp.name))
+
+    def test_same_object_version_is_downloaded_once(self):
+        cache = self.cache()
+        stats = new_cache_stats()
+        first = cache.fetch("claim-1", "claims/claim-1/est/InputImages/a.jpg", '"v1"', self.download(100), stats)
+        second = cache.fetch("claim-1", "claims/claim-1/est/InputImages/a.jpg", '"v1"', self.download(100), stats)
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.downloads), 1)
+        self.assertEqual((stats['misses'], stats['hits'], stats['bytes_saved']), (1, 1, 100))
+
+    def test_same_filename_in_two_claims_does_not_collide(self):
+        cache = self.cache()
+        first = cache.fetch("claim-1", "claims/claim-1/est/InputImages/a.jpg", '"v1"', self.download(100))
+        second = cache.fetch("claim-2", "claims/claim-2/est/InputImages/a.jpg", '"v1"', self.download(100))
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(self.downloads), 2)
+
+    def test_new_object_version_drops_the_old_one(self):
+        cache = self.cache()
+        old = cache.fetch("claim-1", "a.jpg", '"v1"', self.download(100))
+        new = cache.fetch("claim-1", "a.jpg", '"v2"', self.download(150))
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(cache.total_bytes(), 150)
+
+    def test_least_recently_used_claim_is_evicted(self):
+        cache = self.cache(max_bytes=250)
+        stats = new_cache_stats()
+        for claim in ("claim-1", "claim-2"):
+            cache.begin_claim(claim)
+            cache.fetch(claim, "a.jpg", '"v1"', self.download(100))
+            cache.end_claim(claim)
+        cache.lookup("claim-1", "a.jpg", '"v1"')  # claim-1 is now the most recently used
+        cache.begin_claim("claim-3", stats)
+        cache.fetch("claim-3", "a.jpg", '"v1"', self.download(100), stats)
+        self.assertEqual(self.claim_dirs(), ["claim-1", "claim-3"])
+        self.assertEqual(stats['evicted_claims'], 1)
+
+    def test_active_claim_is_never_evicted(self):
+        cache = self.cache(max_bytes=150)
+        cache.begin_claim("claim-1")
+        cache.fetch("claim-1", "a.jpg", '"v1"', self.download(100))
+        cache.begin_claim("claim-2")
+        cache.fetch("claim-2", "a.jpg", '"v1"', self.download(100))
+        self.assertEqual(self.claim_dirs(), ["claim-1", "claim-2"])
+        cache.end_claim("claim-1")
+        cache.fetch("claim-2", "b.jpg", '"v1"', self.download(10))
+        self.assertEqual(self.claim_dirs(), ["claim-2"])
+
+    def test_warm_files_are_picked_up_by_a_new_cache(self):
+        self.cache().fetch("claim-1", "a.jpg", '"v1"', self.download(100))
+        cache = self.cache()
+        self.assertEqual(cache.total_bytes(), 100)
+        self.assertIsNotNone(cache.lookup("claim-1", "a.jpg", '"v1"'))
+        self.assertIsNone(cache.lookup("claim-1", "a.jpg", '"v2"'))
+
+
+if __name__ == "__main__":
+    unittest.main()